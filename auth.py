@@ -1,8 +1,13 @@
 # auth.py
 import os
+import time
+import asyncio
 import logging
+import threading
+from typing import Callable
 from dotenv import load_dotenv
-from msal import PublicClientApplication, SerializableTokenCache
+
+import metrics
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -12,41 +17,189 @@ TENANT_ID   = os.getenv("TENANT_ID")
 SCOPES      = ["User.Read", "Mail.Read", "Mail.Send"]
 CACHE_PATH  = "token_cache.bin"
 
-# Prepara el cache
-token_cache = SerializableTokenCache()
-if os.path.exists(CACHE_PATH):
-    token_cache.deserialize(open(CACHE_PATH, "r").read())
+# El token vigente se sirve desde memoria; se renueva en segundo plano
+# GRAPH_TOKEN_REFRESH_MARGIN s antes de caducar, y el camino de cada petición
+# solo vuelve a MSAL si quedan menos de GRAPH_TOKEN_EXPIRY_SKEW s.
+TOKEN_REFRESH_MARGIN = float(os.getenv("GRAPH_TOKEN_REFRESH_MARGIN", 300))
+TOKEN_EXPIRY_SKEW    = float(os.getenv("GRAPH_TOKEN_EXPIRY_SKEW", 60))
+TOKEN_RETRY_DELAY    = float(os.getenv("GRAPH_TOKEN_RETRY_DELAY", 30))
 
-# Crea la app con el cache
-app = PublicClientApplication(
-    client_id=CLIENT_ID,
-    authority=f"https://login.microsoftonline.com/common",
-    token_cache=token_cache,
-)
+# MSAL, su cache en disco y la app se cargan en el primer get_graph_token
+token_cache = None
+app = None
+_app_lock = threading.Lock()
 
-def get_graph_token() -> str | None:
-    # 1) Intenta silent
-    accounts = app.get_accounts()
-    if accounts:
-        result = app.acquire_token_silent(SCOPES, account=accounts[0])
-        if result and "access_token" in result:
-            logger.debug("Token silent obtenido de cache")
-            return result["access_token"]
-
-    # 2) Si no hay token, inicia Device Code Flow UNA VEZ
-    flow = app.initiate_device_flow(scopes=SCOPES)
-    if "user_code" not in flow:
-        logger.error("Error iniciando Device Code Flow: %s", flow)
+def get_app():
+    global token_cache, app
+    with _app_lock:
+        if app is None:
+            from msal import PublicClientApplication, SerializableTokenCache
+            # Prepara el cache
+            token_cache = SerializableTokenCache()
+            if os.path.exists(CACHE_PATH):
+                with open(CACHE_PATH, "r") as f:
+                    token_cache.deserialize(f.read())
+            # Crea la app con el cache
+            app = PublicClientApplication(
+                client_id=CLIENT_ID,
+                authority=f"https://login.microsoftonline.com/common",
+                token_cache=token_cache,
+            )
+        return app
+
+def save_cache(cache, path: str = CACHE_PATH) -> bool:
+    """Escribe el cache de MSAL solo si cambió (también tras un refresh silencioso)."""
+    if cache is None or not cache.has_state_changed:
+        return False
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(cache.serialize())
+    os.replace(tmp, path)
+    logger.debug("Cache de tokens guardado en %s", path)
+    return True
+
+def acquire_token(interactive: bool = True, force_refresh: bool = False) -> dict | None:
+    """
+    Pide un token a MSAL: primero silent (con `force_refresh` ignora el access
+    token cacheado y usa el refresh token); si no hay cuenta y `interactive`,
+    Device Code Flow. Devuelve el resultado de MSAL o None.
+    """
+    app = get_app()
+    try:
+        # 1) Intenta silent
+        accounts = app.get_accounts()
+        if accounts:
+            result = app.acquire_token_silent(SCOPES, account=accounts[0], force_refresh=force_refresh)
+            if result and "access_token" in result:
+                logger.debug("Token silent obtenido de cache")
+                return result
+        if not interactive:
+            return None
+
+        # 2) Si no hay token, inicia Device Code Flow UNA VEZ
+        flow = app.initiate_device_flow(scopes=SCOPES)
+        if "user_code" not in flow:
+            logger.error("Error iniciando Device Code Flow: %s", flow)
+            return None
+        print(flow["message"])  # "Ve a ... e ingresa este código..."
+
+        result = app.acquire_token_by_device_flow(flow)
+        if "access_token" in result:
+            logger.info("Token delegado obtenido.")
+            return result
+
+        logger.error("Error obteniendo token: %s", result.get("error_description"))
+        return None
+    finally:
+        save_cache(token_cache)
+
+
+# ------------------- gestor del token ---------------------------------------------------
+TOKEN_REFRESHES = metrics.counter(
+    "inventario_graph_token_refresh_total", "Renovaciones del token de Graph (mode=inline|background)")
+GRAPH_TOKEN_SECONDS = metrics.histogram(
+    "inventario_graph_token_seconds", "Llamadas a MSAL para obtener el token (incluye Device Code Flow)")
+
+class TokenManager:
+    """
+    Token de Graph en memoria con su caducidad. `get()` lo devuelve sin tocar
+    MSAL mientras sea válido; si hay que renovarlo, solo un hilo llama a MSAL
+    y el resto espera ese mismo resultado (single-flight). `run_refresher()`
+    lo renueva antes de que caduque para que no toque hacerlo en línea.
+    """
+
+    def __init__(self, acquire: Callable[..., dict | None] = acquire_token,
+                 refresh_margin: float = TOKEN_REFRESH_MARGIN, expiry_skew: float = TOKEN_EXPIRY_SKEW,
+                 clock: Callable[[], float] = time.time):
+        self._acquire = acquire
+        self.refresh_margin = refresh_margin
+        self.expiry_skew = expiry_skew
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._rejected = False          # Graph rechazó el token: MSAL no debe devolver el cacheado
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def cached(self) -> str | None:
+        """Token vigente si lo hay, sin bloquear ni llamar a MSAL."""
+        token = self._token
+        if token and self._clock() < self._expires_at - self.expiry_skew:
+            return token
         return None
-    print(flow["message"])  # "Ve a ... e ingresa este código..."
-
-    result = app.acquire_token_by_device_flow(flow)
-    if "access_token" in result:
-        # Guarda cache en disco
-        with open(CACHE_PATH, "w") as f:
-            f.write(token_cache.serialize())
-        logger.info("Token delegado obtenido y cache guardado.")
-        return result["access_token"]
-
-    logger.error("Error obteniendo token: %s", result.get("error_description"))
-    return None
+
+    def get(self) -> str | None:
+        token = self.cached()
+        if token:
+            return token
+        with self._lock:
+            # otro hilo pudo renovarlo mientras esperábamos el lock
+            token = self.cached()
+            if token:
+                return token
+            with GRAPH_TOKEN_SECONDS.time(mode="inline"):
+                result = self._acquire(interactive=True, force_refresh=self._rejected)
+            if self._store(result, "inline"):
+                self._rejected = False
+            return self.cached()
+
+    __call__ = get
+
+    def refresh(self) -> bool:
+        """Renovación proactiva: silent con refresh token, nunca Device Code Flow."""
+        with self._lock:
+            with GRAPH_TOKEN_SECONDS.time(mode="background"):
+                result = self._acquire(interactive=False, force_refresh=True)
+            return self._store(result, "background")
+
+    def invalidate(self, token: str | None = None):
+        """
+        Descarta el token en memoria (p. ej. tras un 401 de Graph); el próximo
+        `get()` pide uno nuevo con force_refresh. Con `token`, solo si sigue
+        siendo el vigente: otra petición pudo renovarlo ya.
+        """
+        with self._lock:
+            if token is not None and token != self._token:
+                return
+            self._token, self._expires_at = None, 0.0
+            self._rejected = True
+
+    def _store(self, result: dict | None, mode: str) -> bool:
+        ok = bool(result and "access_token" in result)
+        TOKEN_REFRESHES.inc(mode=mode, result="ok" if ok else "failed")
+        if ok:
+            self._token = result["access_token"]
+            self._expires_at = self._clock() + float(result.get("expires_in", 3600))
+        return ok
+
+    async def run_refresher(self):
+        """
+        Renueva el token refresh_margin s antes de su caducidad, indefinidamente.
+        Mientras no se haya obtenido el primero (get), solo espera.
+        """
+        while True:
+            if self._token is None:
+                await asyncio.sleep(TOKEN_RETRY_DELAY)
+                continue
+            remaining = self._expires_at - self._clock()
+            # tokens más cortos que el margen: se renuevan a mitad de vida
+            delay = max(remaining - self.refresh_margin, remaining / 2)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                ok = await asyncio.to_thread(self.refresh)
+            except Exception:
+                logger.exception("Error renovando el token de Graph")
+                ok = False
+            if not ok:
+                logger.warning("No se pudo renovar el token de Graph; reintento en %s s", TOKEN_RETRY_DELAY)
+                await asyncio.sleep(TOKEN_RETRY_DELAY)
+
+
+token_manager = TokenManager()
+
+def get_graph_token() -> str | None:
+    return token_manager.get()
@@ -0,0 +1 @@
+"""Benchmarks de extremo a extremo con Graph y LLM simulados."""
@@ -0,0 +1,151 @@
+"""
+Servidor de correo Graph en memoria para tests y benchmarks.
+
+Se monta como transporte de httpx dentro del propio `GraphClient`, así que
+todo el código de `email_io` (delta, cuerpos, sendMail, $batch y reintentos
+por 429) y las suscripciones de `graph_notify` se ejercitan sin red. Latencia y
+throttling son configurables; `notification()` hace de notificador de Graph.
+"""
+
+import json
+import random
+import asyncio
+import itertools
+from urllib.parse import urlencode
+
+import httpx
+
+import email_io
+
+
+class FakeGraph(httpx.AsyncBaseTransport):
+    """
+    • latency      → segundos de espera por petición (y por sub-petición de $batch)
+    • throttle_rate → probabilidad de responder 429 a cada envío
+    • retry_after  → valor de la cabecera Retry-After en los 429
+    """
+
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: float = 0.01, seed: int | None = None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.inbox: list[dict] = []
+        self.sent: list[dict] = []
+        self.requests = 0
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._delta_cursor = 0
+        self.subscriptions: dict[str, dict] = {}
+        self._sub_ids = itertools.count(1)
+
+    # ------------------- buzón -------------------------------------------------------
+    def add_message(self, subject: str, body: str = "", sender: str = "bench@example.com") -> str:
+        msg_id = f"msg-{len(self.inbox)}"
+        self.inbox.append({
+            "id": msg_id,
+            "subject": subject,
+            "sender": {"emailAddress": {"address": sender}},
+            "body": {"contentType": "text", "content": body},
+        })
+        return msg_id
+
+    def notification(self, msg_id: str | None = None, lifecycle_event: str | None = None,
+                     client_state: str | None = None) -> dict:
+        """
+        Cuerpo del POST que Graph enviaría al webhook de la suscripción activa:
+        un 'created' de `msg_id` o un evento de ciclo de vida (`missed`…).
+        """
+        sub_id, sub = next(iter(self.subscriptions.items()))
+        item = {
+            "subscriptionId": sub_id,
+            "clientState": sub["clientState"] if client_state is None else client_state,
+            "tenantId": "fake-tenant",
+        }
+        if lifecycle_event:
+            item["lifecycleEvent"] = lifecycle_event
+        else:
+            item.update(
+                changeType="created",
+                resource=f"Users/fake/Messages/{msg_id}",
+                resourceData={"@odata.type": "#Microsoft.Graph.Message", "id": msg_id},
+            )
+        return {"value": [item]}
+
+    def client(self) -> email_io.GraphClient:
+        """GraphClient con token fijo que habla con este servidor."""
+        return email_io.GraphClient(token_provider=lambda: "fake-token", transport=self)
+
+    # ------------------- transporte --------------------------------------------------
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = request.url.path
+        if path.endswith("/$batch"):
+            return await self._batch(json.loads(request.content)["requests"])
+        if path.endswith("/sendMail"):
+            status, headers = self._send(json.loads(request.content))
+            return httpx.Response(status, headers=headers)
+        if "/subscriptions" in path:
+            return self._subscription(request)
+        if path.endswith("/messages/delta"):
+            return self._delta(request)
+        if "/messages/" in path:
+            return self._message(path.rsplit("/", 1)[-1])
+        if path.endswith("/messages"):
+            return self._json({"value": [self._header(m) for m in self.inbox]})
+        return httpx.Response(404, json={"error": {"message": f"ruta no simulada: {path}"}})
+
+    def _send(self, payload: dict) -> tuple[int, dict]:
+        if self.throttle_rate and self._rng.random() < self.throttle_rate:
+            self.throttled += 1
+            return 429, {"Retry-After": str(self.retry_after)}
+        self.sent.append(payload)
+        return 202, {}
+
+    async def _batch(self, reqs: list[dict]) -> httpx.Response:
+        responses = []
+        for r in reqs:
+            if self.latency:
+                await asyncio.sleep(self.latency / len(reqs))
+            status, headers = self._send(r["body"])
+            responses.append({"id": r["id"], "status": status, "headers": headers})
+        return self._json({"responses": responses})
+
+    def _delta(self, request: httpx.Request) -> httpx.Response:
+        # Cada llamada devuelve lo llegado desde la anterior y un deltaLink nuevo
+        new = self.inbox[self._delta_cursor:]
+        self._delta_cursor = len(self.inbox)
+        link = f"{request.url.copy_with(query=None)}?{urlencode({'$deltatoken': self._delta_cursor})}"
+        return self._json({"value": [self._header(m) for m in new], "@odata.deltaLink": link})
+
+    def _message(self, msg_id: str) -> httpx.Response:
+        for m in self.inbox:
+            if m["id"] == msg_id:
+                return self._json(m)
+        return httpx.Response(404, json={"error": {"message": "mensaje no encontrado"}})
+
+    def _subscription(self, request: httpx.Request) -> httpx.Response:
+        sub_id = request.url.path.rsplit("/", 1)[-1]
+        if request.method == "POST":
+            sub = {**json.loads(request.content), "id": f"sub-{next(self._sub_ids)}"}
+            self.subscriptions[sub["id"]] = sub
+            return httpx.Response(201, json=sub)
+        if sub_id not in self.subscriptions:
+            return httpx.Response(404, json={"error": {"message": "suscripción no encontrada"}})
+        if request.method == "PATCH":
+            self.subscriptions[sub_id].update(json.loads(request.content))
+            return self._json(self.subscriptions[sub_id])
+        if request.method == "DELETE":
+            del self.subscriptions[sub_id]
+            return httpx.Response(204)
+        return httpx.Response(405)
+
+    @staticmethod
+    def _header(m: dict) -> dict:
+        return {"id": m["id"], "subject": m["subject"], "sender": m["sender"]}
+
+    @staticmethod
+    def _json(data: dict) -> httpx.Response:
+        return httpx.Response(200, json=data)
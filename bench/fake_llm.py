@@ -0,0 +1,43 @@
+"""
+Sustituto local de la cadena LangChain de `nl_to_sql` (misma interfaz
+invoke / ainvoke) para tests y benchmarks: sin red ni coste por llamada.
+"""
+
+import time
+import asyncio
+
+# Consulta válida para cualquier tipo no registrado: usa :producto y :dias
+DEFAULT_SQL = (
+    "SELECT p.quantity AS current_stock, COALESCE(SUM(d.net_change), 0) AS net_movement "
+    "FROM products p LEFT JOIN movement_daily d "
+    "ON d.product_id = p.id AND d.day >= date('now', '-' || :dias || ' days') "
+    "WHERE p.name = :producto GROUP BY p.id;"
+)
+
+
+class FakeLLM:
+    def __init__(self, sql: str = DEFAULT_SQL, latency: float = 0.0):
+        self.sql = sql
+        self.latency = latency
+        self.calls: list[dict] = []
+
+    def invoke(self, inputs: dict) -> str:
+        self.calls.append(inputs)
+        if self.latency:
+            time.sleep(self.latency)
+        return self.sql
+
+    async def ainvoke(self, inputs: dict) -> str:
+        self.calls.append(inputs)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.sql
+
+
+def install(llm: FakeLLM | None = None) -> FakeLLM:
+    """Sustituye la cadena de `nl_to_sql` y vacía su cache de SQL generado."""
+    import nl_to_sql
+    llm = llm or FakeLLM()
+    nl_to_sql._CHAIN = llm
+    nl_to_sql._LLM_CACHE.clear()
+    return llm
@@ -0,0 +1,197 @@
+"""
+Benchmark de extremo a extremo: asunto → SQL → consulta → respuesta → envío.
+
+Graph y el LLM se sustituyen por `FakeGraph` / `FakeLLM` (latencia y 429
+configurables), y la base es sintética (ver `seed_db.seed_synthetic`).
+Informa p50/p95/p99 por etapa (parse, sql, format, send) y tipo de consulta,
+más el throughput total. Con --budget la salida es distinta de 0 si alguna
+etapa supera su presupuesto de p95, para cortar regresiones antes de desplegar.
+
+    python -m bench.run_bench --products 5000 --movements 2000000 --requests 2000
+    python -m bench.run_bench --reuse --budget sql=20 --budget send=50
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+
+STAGES = ("parse", "sql", "format", "send")
+TIPOS = ("saldo", "historial", "proyección")
+LLM_TIPO = "rotación"          # tipo sin plantilla → fallback LLM
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Percentil por rango más cercano (sin dependencias externas)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _subjects(n: int, n_products: int, llm_share: float, rng: random.Random) -> list[str]:
+    subjects = []
+    for _ in range(n):
+        tipo = LLM_TIPO if rng.random() < llm_share else rng.choice(TIPOS)
+        product = f"SKU{rng.randrange(n_products):06d}"
+        subjects.append(f"Consulta inventario: {product}, {tipo}, {rng.choice((7, 30, 90))} días")
+    return subjects
+
+
+async def _run(subjects: list[str], concurrency: int, graph, samples: dict) -> float:
+    # Importes tardíos: DATABASE_URL ya apunta a la base del benchmark
+    import email_io
+    from nl_to_sql import parse_request, asql_for_request
+    from db import run_query
+    from main import format_response
+
+    email_io.set_client(graph.client())
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(subject: str):
+        async with sem:
+            t0 = time.perf_counter()
+            req = parse_request(subject)
+            t1 = time.perf_counter()
+            query = await asql_for_request(req)
+            rows = await asyncio.to_thread(run_query, query.name, query.params)
+            t2 = time.perf_counter()
+            body = format_response(rows, req.dias)
+            t3 = time.perf_counter()
+            await email_io.get_reply_queue().send("bench@example.com", f"Re: {subject}", body)
+            t4 = time.perf_counter()
+        per_stage = samples.setdefault(req.tipo, {s: [] for s in STAGES})
+        for stage, dt in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+            per_stage[stage].append(dt * 1000)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(s) for s in subjects))
+    finally:
+        await email_io.close_reply_queue()
+        await email_io.close_client()
+    return time.perf_counter() - start
+
+
+def run(requests: int = 500, concurrency: int = 16, products: int = 1_000,
+        movements: int = 200_000, days: int = 365, graph_latency: float = 0.005,
+        throttle_rate: float = 0.0, llm_latency: float = 0.5, llm_share: float = 0.05,
+        reuse: bool = False, seed: int = 42) -> dict:
+    """Ejecuta el benchmark y devuelve el informe como dict (ver `print_report`)."""
+    from bench.fake_graph import FakeGraph
+    from bench import fake_llm
+
+    if not reuse:
+        from seed_db import seed_synthetic
+        seed_synthetic(products, movements, days, rng_seed=seed)
+    llm = fake_llm.install(fake_llm.FakeLLM(latency=llm_latency))
+    graph = FakeGraph(latency=graph_latency, throttle_rate=throttle_rate, seed=seed)
+
+    rng = random.Random(seed)
+    samples: dict[str, dict[str, list[float]]] = {}
+    elapsed = asyncio.run(_run(_subjects(requests, products, llm_share, rng), concurrency, graph, samples))
+
+    return {
+        "requests": requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "llm_calls": len(llm.calls),
+        "graph_requests": graph.requests,
+        "graph_throttled": graph.throttled,
+        "sent": len(graph.sent),
+        "stages": {
+            tipo: {
+                stage: {
+                    "p50": round(percentile(v, 50), 3),
+                    "p95": round(percentile(v, 95), 3),
+                    "p99": round(percentile(v, 99), 3),
+                    "n": len(v),
+                }
+                for stage, v in per_stage.items()
+            }
+            for tipo, per_stage in sorted(samples.items())
+        },
+    }
+
+
+def check_budgets(report: dict, budgets: dict[str, float]) -> list[str]:
+    """Etapas cuyo p95 (ms) supera el presupuesto, en cualquier tipo."""
+    failures = []
+    for tipo, per_stage in report["stages"].items():
+        for stage, limit in budgets.items():
+            p95 = per_stage.get(stage, {}).get("p95", 0.0)
+            if p95 > limit:
+                failures.append(f"{tipo}/{stage}: p95 {p95:.1f} ms > {limit:.1f} ms")
+    return failures
+
+
+def print_report(report: dict):
+    print(f"{report['requests']} consultas en {report['elapsed_s']} s "
+          f"→ {report['throughput_rps']} req/s "
+          f"(LLM: {report['llm_calls']} llamadas, Graph: {report['graph_requests']} peticiones, "
+          f"{report['graph_throttled']} 429, {report['sent']} enviados)")
+    print(f"{'tipo':<12} {'etapa':<7} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for tipo, per_stage in report["stages"].items():
+        for stage in STAGES:
+            s = per_stage[stage]
+            print(f"{tipo:<12} {stage:<7} {s['n']:>6} {s['p50']:>9.2f} {s['p95']:>9.2f} {s['p99']:>9.2f}")
+
+
+def _budget(value: str) -> tuple[str, float]:
+    stage, _, ms = value.partition("=")
+    if stage not in STAGES or not ms:
+        raise argparse.ArgumentTypeError(f"use ETAPA=ms con ETAPA en {', '.join(STAGES)}")
+    return stage, float(ms)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", help="fichero SQLite del benchmark (por defecto, uno temporal)")
+    parser.add_argument("--reuse", action="store_true", help="no regenerar la base indicada en --db")
+    parser.add_argument("--products", type=int, default=1_000)
+    parser.add_argument("--movements", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--graph-latency", type=float, default=0.005, help="segundos por petición a Graph")
+    parser.add_argument("--throttle", type=float, default=0.0, help="fracción de envíos con 429")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="segundos por llamada al LLM")
+    parser.add_argument("--llm-share", type=float, default=0.05, help="fracción de consultas sin plantilla")
+    parser.add_argument("--budget", type=_budget, action="append", default=[],
+                        help="presupuesto de p95 por etapa, p. ej. sql=20 (repetible)")
+    parser.add_argument("--json", action="store_true", help="informe en JSON")
+    args = parser.parse_args(argv)
+
+    if args.reuse and not args.db:
+        parser.error("--reuse necesita --db")
+    db_file = args.db or os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
+    os.environ.setdefault("GRAPH_BATCH_DELAY", "0.01")
+    logging.disable(logging.INFO)         # un log por correo distorsiona las medidas
+
+    report = run(
+        requests=args.requests, concurrency=args.concurrency, products=args.products,
+        movements=args.movements, days=args.days, graph_latency=args.graph_latency,
+        throttle_rate=args.throttle, llm_latency=args.llm_latency, llm_share=args.llm_share,
+        reuse=args.reuse,
+    )
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+    failures = check_budgets(report, dict(args.budget))
+    for f in failures:
+        print(f"✘ presupuesto superado: {f}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+# bulk_import.py
+# Carga masiva de movimientos y de fotos de stock desde CSV (export nocturno
+# del ERP). Se lee en streaming por bloques de IMPORT_CHUNK_SIZE filas: cada
+# bloque es una transacción con inserts executemany, así la memoria
+# no depende del tamaño del fichero.
+#
+#   products.csv  → name,quantity                (upsert: fija el stock)
+#   movements.csv → product,change,date          (date ISO 8601; suma al stock)
+#
+#   python bulk_import.py movements export.csv [--no-reconcile]
+
+import io
+import os
+import csv
+import time
+import logging
+import argparse
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterable, NamedTuple
+
+from sqlalchemy import Engine, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import engine as default_engine, Product, init_db
+from migrations import ROLLUP_INSERT_TRIGGER, ROLLUP_TRIGGERS
+from result_cache import cache as result_cache
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 50_000))
+
+_products = Product.__table__
+
+
+class ImportResult(NamedTuple):
+    rows:     int       # filas del CSV cargadas
+    products: int       # productos distintos afectados
+    created:  int       # productos nuevos (solo movimientos de productos desconocidos)
+    seconds:  float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+def _chunks(rows: Iterable, size: int):
+    it = iter(rows)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+def _reader(source, columns: set[str]) -> csv.DictReader:
+    """DictReader sobre un fichero binario o de texto, validando la cabecera."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if not isinstance(source, io.TextIOBase):
+        source = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(source)
+    missing = columns - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(sorted(missing))}")
+    return reader
+
+def _int(value: str, line: int, column: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Línea {line}: '{column}' no es un entero: {value!r}") from None
+
+def _date(value: str, line: int) -> datetime:
+    try:
+        date = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Línea {line}: fecha inválida: {value!r}") from None
+    # movements guarda UTC sin zona (datetime.utcnow)
+    return date.astimezone(timezone.utc).replace(tzinfo=None) if date.tzinfo else date
+
+
+# ------------------- productos (foto de stock) ----------------------------------------
+def import_products(source, engine: Engine = default_engine,
+                    chunk_size: int = IMPORT_CHUNK_SIZE) -> ImportResult:
+    """Upsert por nombre: crea los productos nuevos y fija `quantity` en los existentes."""
+    start = time.perf_counter()
+    reader = _reader(source, {"name", "quantity"})
+    stmt = sqlite_insert(_products)
+    stmt = stmt.on_conflict_do_update(index_elements=[_products.c.name],
+                                      set_={"quantity": stmt.excluded.quantity})
+    rows = 0
+    names: set[str] = set()
+    for chunk in _chunks(enumerate(reader, start=2), chunk_size):
+        params = {}
+        for line, r in chunk:
+            name = (r["name"] or "").strip()
+            if not name:
+                raise ValueError(f"Línea {line}: producto vacío")
+            params[name] = {"name": name, "quantity": _int(r["quantity"], line, "quantity")}
+        with engine.begin() as conn:
+            conn.execute(stmt, list(params.values()))
+        result_cache.invalidate_products(params)
+        rows += len(chunk)
+        names.update(params)
+    return ImportResult(rows, len(names), 0, time.perf_counter() - start)
+
+
+# ------------------- movimientos ------------------------------------------------------
+def _product_ids(conn, names: set[str], known: dict[str, int]) -> int:
+    """Completa `known` con los ids de `names`; crea con stock 0 los que no existan."""
+    missing = [n for n in names if n not in known]
+    if not missing:
+        return 0
+    conn.execute(sqlite_insert(_products).on_conflict_do_nothing(),
+                 [{"name": n, "quantity": 0} for n in missing])
+    known.update(conn.execute(select(_products.c.name, _products.c.id)
+                              .where(_products.c.name.in_(missing))).all())
+    return len(missing)
+
+# Durante la carga, el trigger fila a fila de movement_daily se sustituye por
+# un upsert de los totales ya agregados por (producto, día) del bloque. Todo
+# ocurre dentro de la misma transacción BEGIN IMMEDIATE: ningún otro escritor
+# llega a ver movements sin su trigger.
+_INSERT_TRIGGER = next(t for t in ROLLUP_TRIGGERS if f" {ROLLUP_INSERT_TRIGGER} " in t)
+_INSERT_MOVEMENTS = "INSERT INTO movements (product_id, change, date) VALUES (?, ?, ?)"
+_UPSERT_DAILY = (
+    "INSERT INTO movement_daily (product_id, day, net_change, n_movements) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (product_id, day) DO UPDATE SET "
+    "net_change = net_change + excluded.net_change, n_movements = n_movements + excluded.n_movements"
+)
+_ADD_STOCK = "UPDATE products SET quantity = quantity + ? WHERE id = ?"
+
+def import_movements(source, engine: Engine = default_engine,
+                     chunk_size: int = IMPORT_CHUNK_SIZE, reconcile: bool = True) -> ImportResult:
+    """
+    Inserta los movimientos por bloques. Con `reconcile` el cambio neto de cada
+    bloque se suma a products.quantity en la misma transacción, de modo que el
+    stock nunca queda a medias respecto a los movimientos ya cargados.
+    """
+    start = time.perf_counter()
+    reader = _reader(source, {"product", "change", "date"})
+    columns = reader.fieldnames
+    i_product, i_change, i_date = (columns.index(c) for c in ("product", "change", "date"))
+    with engine.connect() as conn:
+        ids: dict[str, int] = dict(conn.execute(select(_products.c.name, _products.c.id)).all())
+
+    rows = created = 0
+    touched: set[str] = set()
+    # filas como listas (csv.reader): evita un dict por fila. Las líneas en
+    # blanco se saltan, como hace DictReader en import_products
+    lines = ((line, r) for line, r in enumerate(reader.reader, start=2) if r)
+    for chunk in _chunks(lines, chunk_size):
+        parsed = []
+        for line, r in chunk:
+            if len(r) < len(columns):
+                raise ValueError(f"Línea {line}: faltan campos")
+            name = r[i_product].strip()
+            if not name:
+                raise ValueError(f"Línea {line}: producto vacío")
+            # mismo formato de texto que DateTime de SQLAlchemy en SQLite
+            date = _date(r[i_date], line).isoformat(" ", "microseconds")
+            parsed.append((name, _int(r[i_change], line, "change"), date))
+        names = {name for name, _, _ in parsed}
+
+        with engine.begin() as conn:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            created += _product_ids(conn, names, ids)
+            values = [(ids[name], change, date) for name, change, date in parsed]
+
+            daily: dict[tuple[int, str], list[int]] = {}
+            net: dict[int, int] = {}
+            for pid, change, date in values:
+                agg = daily.setdefault((pid, date[:10]), [0, 0])
+                agg[0] += change
+                agg[1] += 1
+                net[pid] = net.get(pid, 0) + change
+
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {ROLLUP_INSERT_TRIGGER}")
+            conn.exec_driver_sql(_INSERT_MOVEMENTS, values)
+            conn.exec_driver_sql(_UPSERT_DAILY, [(pid, day, n, c) for (pid, day), (n, c) in daily.items()])
+            conn.exec_driver_sql(_INSERT_TRIGGER)
+            if reconcile:
+                deltas = [(d, pid) for pid, d in net.items() if d]
+                if deltas:
+                    conn.exec_driver_sql(_ADD_STOCK, deltas)
+        result_cache.invalidate_products(names)
+        rows += len(chunk)
+        touched |= names
+        logger.debug("Importadas %d filas de movimientos", rows)
+
+    result = ImportResult(rows, len(touched), created, time.perf_counter() - start)
+    logger.info("Importados %d movimientos de %d productos en %.1f s (%.0f filas/s)",
+                result.rows, result.products, result.seconds, result.rows_per_second)
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Importa movimientos o stock desde CSV")
+    parser.add_argument("kind", choices=["movements", "products"])
+    parser.add_argument("csv_file")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--no-reconcile", action="store_true",
+                        help="no sumar los movimientos a products.quantity")
+    args = parser.parse_args()
+
+    init_db()
+    with open(args.csv_file, "rb") as f:
+        if args.kind == "products":
+            res = import_products(f, chunk_size=args.chunk_size)
+        else:
+            res = import_movements(f, chunk_size=args.chunk_size, reconcile=not args.no_reconcile)
+    print(f"✔ {res.rows} filas ({res.products} productos, {res.created} nuevos) "
+          f"en {res.seconds:.1f} s → {res.rows_per_second:,.0f} filas/s")
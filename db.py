@@ -1,24 +1,144 @@
 # db.py
-from sqlalchemy import text
-from models import SessionLocal, init_db
+import os
+import time
+import threading
+from functools import lru_cache
+from typing import Iterator
 
-# Inicializa la base de datos (crea tablas) antes de consultas
-def init():
-    init_db()
+from sqlalchemy import Row, TextClause, text
 
-# Ejecuta init al importar el módulo
-auto_init = init()
+import metrics
+from diagnostics import SLOW_SQL, SLOW_SQL_SECONDS
+from sql_guard import Budget, guarded, check_rows
+from models import engine, SessionLocal, init_db
 
-def execute_sql(sql: str):
+# Inicializa la base de datos (crea tablas y migra) en la primera consulta,
+# no al importar: importar el módulo no toca el disco
+_initialized = False
+_init_lock = threading.Lock()
+
+def ensure_db():
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            init_db()
+            _initialized = True
+
+# ------------------- consultas con nombre --------------------------------------------
+# Cada sentencia se construye una sola vez; SQLAlchemy reutiliza su forma
+# compilada en cada ejecución y solo cambian los parámetros enlazados.
+_QUERIES: dict[str, TextClause] = {}
+# Consultas que se ejecutan bajo sql_guard (solo lectura, tiempo y filas acotados)
+_BUDGETS: dict[str, Budget] = {}
+
+SQL_SECONDS = metrics.histogram(
+    "inventario_sql_seconds", "Ejecución de SQL en SQLite (query=nombre registrado o adhoc)")
+
+# Filas que se leen del cursor de cada vez en modo streaming
+SQL_STREAM_BATCH = int(os.getenv("SQL_STREAM_BATCH", 500))
+
+def explain(stmt: TextClause | str, params: dict | None = None) -> list[str]:
+    """Detalle de EXPLAIN QUERY PLAN de la sentencia, una línea por paso."""
+    sql = stmt.text if isinstance(stmt, TextClause) else stmt
+    ensure_db()
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params or {})]
+
+def _observe(query: str, stmt: TextClause, params: dict | None, start: float, **details):
+    """Registra la duración y, por encima de SLOW_SQL_SECONDS, la guarda con su plan."""
+    seconds = time.perf_counter() - start
+    SQL_SECONDS.observe(seconds, query=query)
+    if seconds < SLOW_SQL_SECONDS:
+        return
+    try:
+        plan = explain(stmt, params)
+    except Exception as exc:
+        plan = [f"(sin plan: {exc})"]
+    SLOW_SQL.record(seconds, query=query, sql=stmt.text,
+                    params={k: repr(v)[:200] for k, v in (params or {}).items()}, plan=plan, **details)
+
+def register_query(name: str, sql: str, budget: Budget | None = None) -> None:
+    _QUERIES[name] = text(sql)
+    if budget is None:
+        _BUDGETS.pop(name, None)
+    else:
+        _BUDGETS[name] = budget
+
+def unregister_query(name: str) -> None:
+    _QUERIES.pop(name, None)
+    _BUDGETS.pop(name, None)
+
+def run_query(name: str, params: dict | None = None) -> list[Row]:
+    """
+    Ejecuta la consulta registrada como `name` sobre una conexión Core del pool
+    y devuelve las filas como tuplas con nombre (`row.quantity`, `row._mapping`).
+    """
+    try:
+        stmt = _QUERIES[name]
+    except KeyError:
+        raise ValueError(f"Consulta no registrada: {name}")
+    ensure_db()
+    budget = _BUDGETS.get(name)
+    start = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            if budget is None:
+                return conn.execute(stmt, params or {}).fetchall()
+            with guarded(conn.connection.driver_connection, budget, name):
+                rows = conn.execute(stmt, params or {}).fetchmany(budget.rows + 1)
+            return check_rows(rows, budget, name)
+    finally:
+        _observe(name, stmt, params, start)
+
+def stream_query(name: str, params: dict | None = None,
+                 batch_size: int = SQL_STREAM_BATCH) -> Iterator[tuple]:
+    """
+    Como `run_query`, pero genera tuplas según se leen del cursor, de
+    `batch_size` en `batch_size`: la memoria no crece con el número de filas.
+    La conexión sigue abierta hasta agotar (o cerrar) el generador.
+    """
+    try:
+        stmt = _QUERIES[name]
+    except KeyError:
+        raise ValueError(f"Consulta no registrada: {name}")
+    return _iter_rows(stmt, params, name, batch_size)
+
+def _iter_rows(stmt: TextClause, params: dict | None, query: str, batch_size: int) -> Iterator[tuple]:
+    ensure_db()
+    start = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(yield_per=batch_size).execute(stmt, params or {})
+            for row in result:
+                yield tuple(row)
+    finally:
+        # incluye el tiempo del consumidor entre lotes
+        _observe(query, stmt, params, start, stream=True)
+
+# ------------------- SQL libre ---------------------------------------------------------
+@lru_cache(maxsize=256)
+def _text(sql: str) -> TextClause:
+    return text(sql)
+
+def execute_sql(sql: str, params: dict | None = None, stream: bool = False,
+                batch_size: int = SQL_STREAM_BATCH):
     """
     Ejecuta la consulta SQL en SQLite y devuelve resultados como lista de diccionarios.
+    Los valores de `params` se enlazan a los marcadores `:nombre` de la sentencia.
+    Con `stream=True` devuelve en su lugar un generador de tuplas (ver stream_query).
     """
-    db = SessionLocal()
+    if stream:
+        return _iter_rows(_text(sql), params, "adhoc", batch_size)
+    ensure_db()
+    stmt = _text(sql)
+    start = time.perf_counter()
     try:
-        result = db.execute(text(sql))
-        keys = result.keys()
-        rows = result.fetchall()
-        # Mapea a dict por fila
-        return [dict(zip(keys, row)) for row in rows]
+        with engine.connect() as conn:
+            result = conn.execute(stmt, params or {})
+            keys = result.keys()
+            # Mapea a dict por fila
+            return [dict(zip(keys, row)) for row in result]
     finally:
-        db.close()
+        _observe("adhoc", stmt, params, start)
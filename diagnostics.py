@@ -0,0 +1,200 @@
+# diagnostics.py
+# Diagnóstico en producción sin reiniciar ni dependencias externas:
+#
+# • Sampler: perfilador por muestreo. Cada PROFILE_INTERVAL s toma la pila de
+#   todos los hilos (sys._current_frames) y cuenta pilas "plegadas"
+#   (hilo;f1;f2;… n), el formato de flamegraph.pl y speedscope. Se activa por
+#   petición con la cabecera X-Profile (ver main.py); las últimas PROFILE_KEEP
+#   quedan en memoria y, con PROFILE_DIR, también en disco.
+# • SlowLog: buffers circulares con las sentencias SQL que tardan más de
+#   SLOW_SQL_SECONDS (con su EXPLAIN QUERY PLAN, ver db.py) y las llamadas al
+#   LLM que tardan más de SLOW_LLM_SECONDS (con el tamaño del prompt).
+
+import os
+import sys
+import time
+import uuid
+import hmac
+import logging
+import threading
+from collections import Counter as Tally, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INTERVAL  = float(os.getenv("PROFILE_INTERVAL", 0.005))
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", 64))
+PROFILE_KEEP      = int(os.getenv("PROFILE_KEEP", 20))
+PROFILE_DIR       = os.getenv("PROFILE_DIR", "")            # vacío = solo en memoria
+SLOW_SQL_SECONDS  = float(os.getenv("SLOW_SQL_SECONDS", 0.2))
+SLOW_LLM_SECONDS  = float(os.getenv("SLOW_LLM_SECONDS", 2.0))
+SLOW_LOG_SIZE     = int(os.getenv("SLOW_LOG_SIZE", 200))
+# /admin/* y X-Profile exigen la cabecera X-Admin-Token; sin ADMIN_TOKEN quedan
+# cerrados, salvo con ADMIN_OPEN=1 (solo desarrollo: abiertos a cualquiera)
+ADMIN_TOKEN       = os.getenv("ADMIN_TOKEN", "")
+ADMIN_OPEN        = os.getenv("ADMIN_OPEN", "0") == "1"
+
+SLOW_EVENTS = metrics.counter("inventario_slow_events_total", "Eventos del registro lento (kind=sql|llm)")
+
+def authorized(token: str | None) -> bool:
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(token or "", ADMIN_TOKEN)
+    return ADMIN_OPEN
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+
+# ------------------- registro lento ------------------------------------------------------
+class SlowLog:
+    """Últimos `size` eventos lentos, del más antiguo al más reciente."""
+
+    def __init__(self, kind: str, size: int = SLOW_LOG_SIZE):
+        self.kind = kind
+        self._entries: deque[dict] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, **details):
+        SLOW_EVENTS.inc(kind=self.kind)
+        entry = {"at": _now(), "seconds": round(seconds, 4), **details}
+        with self._lock:
+            self._entries.append(entry)
+        logger.warning("%s lento (%.3f s): %s", self.kind.upper(), seconds,
+                       details.get("query") or details.get("call"))
+
+    def entries(self) -> list[dict]:
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+SLOW_SQL = SlowLog("sql")
+SLOW_LLM = SlowLog("llm")
+
+@contextmanager
+def llm_call(call: str, prompt_chars: int, texts: int = 1):
+    """Mide una llamada real al LLM y la registra si supera SLOW_LLM_SECONDS."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if seconds >= SLOW_LLM_SECONDS:
+            SLOW_LLM.record(seconds, call=call, prompt_chars=prompt_chars, texts=texts)
+
+
+# ------------------- perfilador por muestreo ---------------------------------------------
+# Hilos parados en estos módulos están esperando (pool ocioso, selector del
+# event loop): se cuentan aparte para que no tapen el trabajo real.
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+class Profile(NamedTuple):
+    id:      str
+    request: str            # "POST /process-email"
+    at:      str
+    seconds: float
+    samples: int
+    idle:    int            # muestras de hilos en espera, no incluidas en `stacks`
+    stacks:  dict[str, int] # pila plegada → muestras
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.stacks.items(), key=lambda kv: -kv[1]))
+
+    def top(self, n: int = 15) -> list[dict]:
+        """Funciones con más muestras propias (la hoja de la pila)."""
+        leaves = Tally()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [{"function": f, "samples": c} for f, c in leaves.most_common(n)]
+
+    def summary(self) -> dict:
+        return {"id": self.id, "request": self.request, "at": self.at,
+                "seconds": round(self.seconds, 4), "samples": self.samples, "idle": self.idle}
+
+
+class Sampler:
+    """
+    `with Sampler() as s:` (o `start()`/`stop()`) muestrea todos los hilos del
+    proceso (salvo el propio) mientras dura el bloque. El coste es de un hilo
+    que despierta cada `interval` s; fuera del bloque no hay ninguno.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, max_depth: int = PROFILE_MAX_DEPTH):
+        self.interval, self.max_depth = interval, max_depth
+        self.stacks: Tally[str] = Tally()
+        self.samples = self.idle = 0
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "Sampler":
+        self._start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self._start
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    self.idle += 1
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def profile(self, request: str, profile_id: str | None = None) -> Profile:
+        return Profile(profile_id or new_profile_id(), request, _now(), self.seconds,
+                       self.samples, self.idle, dict(self.stacks))
+
+
+def new_profile_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+_profiles: deque[Profile] = deque(maxlen=PROFILE_KEEP)
+_profiles_lock = threading.Lock()
+
+def save_profile(profile: Profile):
+    """Lo guarda en el buffer y, con PROFILE_DIR, en <id>.folded."""
+    with _profiles_lock:
+        _profiles.append(profile)
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, f"{profile.id}.folded"), "w", encoding="utf-8") as f:
+                f.write(profile.folded())
+        except OSError:
+            logger.exception("No se pudo guardar el perfil %s", profile.id)
+
+def profiles() -> list[Profile]:
+    with _profiles_lock:
+        return list(_profiles)
+
+def get_profile(profile_id: str) -> Profile | None:
+    return next((p for p in profiles() if p.id == profile_id), None)
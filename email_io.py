@@ -1,76 +1,571 @@
 # email_io.py
-# Simulación de lectura y envío de correos reales usando flujo delegado (/me)...
+# Lectura y envío de correos reales usando flujo delegado (/me) con un cliente
+# asíncrono y un pool compartido de conexiones keep-alive hacia Graph.
 
+import os
+import json
+import base64
+import asyncio
 import logging
-import requests
-from auth import get_graph_token
+from datetime import datetime, timedelta, timezone
+from typing import Callable, NamedTuple
+
+import httpx
+import metrics
+from auth import token_manager
 
 logger = logging.getLogger(__name__)
 graph_api_endpoint = "https://graph.microsoft.com/v1.0"
 
-def fetch_new_emails(folder_id: str = 'Inbox', top: int = 10):
+# Límites del pool y timeouts (configurables por entorno)
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", 10))
+GRAPH_MAX_KEEPALIVE   = int(os.getenv("GRAPH_MAX_KEEPALIVE", 5))
+GRAPH_KEEPALIVE_EXPIRY = float(os.getenv("GRAPH_KEEPALIVE_EXPIRY", 60))
+GRAPH_TIMEOUT         = float(os.getenv("GRAPH_TIMEOUT", 30))
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", 10))
+
+
+class GraphClient:
     """
-    Obtiene los últimos correos desde Microsoft Graph API usando flujo delegado (/me).
-    Retorna una lista de dicts: {'from', 'subject', 'body'}.
+    Cliente asíncrono de Microsoft Graph sobre un único `httpx.AsyncClient`,
+    de modo que todas las peticiones reutilizan las conexiones del pool.
     """
-    token = get_graph_token()
-    if not token:
-        return []
 
-    url = f"{graph_api_endpoint}/me/mailFolders/{folder_id}/messages"
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
+    def __init__(
+        self,
+        base_url: str = graph_api_endpoint,
+        token_provider: Callable[[], str | None] = token_manager,
+        limits: httpx.Limits | None = None,
+        timeout: httpx.Timeout | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.base_url = base_url
+        self._token_provider = token_provider
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            limits=limits or httpx.Limits(
+                max_connections=GRAPH_MAX_CONNECTIONS,
+                max_keepalive_connections=GRAPH_MAX_KEEPALIVE,
+                keepalive_expiry=GRAPH_KEEPALIVE_EXPIRY,
+            ),
+            timeout=timeout or httpx.Timeout(GRAPH_TIMEOUT, connect=GRAPH_CONNECT_TIMEOUT),
+            transport=transport,
+        )
+
+    async def _auth_headers(self) -> dict | None:
+        # Token vigente en memoria: sin salto a un hilo. Si no lo hay, MSAL es
+        # síncrono (y puede bloquear en Device Code Flow): fuera del event loop
+        cached = getattr(self._token_provider, "cached", None)
+        token = cached() if cached else None
+        if token is None:
+            token = await asyncio.to_thread(self._token_provider)
+        if not token:
+            return None
+        return {"Authorization": f"Bearer {token}"}
+
+    async def authenticate(self) -> bool:
+        """Obtiene un token (MSAL en un hilo). True si Graph está listo para usarse."""
+        return await self._auth_headers() is not None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response | None:
+        """
+        Ejecuta una petición autenticada. Devuelve None si no hay token o si
+        falla el transporte (el error queda registrado). Ante un 401 (token
+        revocado o caducado antes de tiempo) lo invalida y reintenta una vez
+        con uno nuevo.
+        """
+        extra = kwargs.pop("headers", {})
+        invalidate = getattr(self._token_provider, "invalidate", None)
+        for retry in (False, True):
+            headers = await self._auth_headers()
+            if headers is None:
+                return None
+            token = headers["Authorization"].removeprefix("Bearer ")
+            headers.update(extra)
+            try:
+                resp = await self._http.request(method, url, headers=headers, **kwargs)
+            except httpx.HTTPError as exc:
+                logger.error("Error de transporte con Graph (%s %s): %s", method, url, exc)
+                return None
+            if resp.status_code != 401 or invalidate is None or retry:
+                return resp
+            logger.warning("Graph rechazó el token (%s %s); se renueva y se reintenta", method, url)
+            invalidate(token)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+# ------------------- cliente compartido ----------------------------------------------
+_client: GraphClient | None = None
+
+def get_client() -> GraphClient:
+    global _client
+    if _client is None:
+        _client = GraphClient()
+    return _client
+
+def set_client(client: GraphClient | None):
+    """Sustituye el cliente compartido (p. ej. por uno con transporte de pruebas)."""
+    global _client
+    _client = client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# ------------------- sincronización de bandeja ---------------------------------------
+SUBJECT_PREFIX = "Consulta inventario:"
+
+# "delta": consulta incremental con deltaLink persistido
+# "list" : listado filtrado en servidor por prefijo de asunto y ventana temporal
+GRAPH_SYNC_MODE        = os.getenv("GRAPH_SYNC_MODE", "delta")
+GRAPH_PAGE_SIZE        = int(os.getenv("GRAPH_PAGE_SIZE", 50))
+GRAPH_LOOKBACK_MINUTES = int(os.getenv("GRAPH_LOOKBACK_MINUTES", 60 * 24))
+DELTA_STATE_FILE       = os.getenv("GRAPH_DELTA_STATE_FILE", "data/graph_delta.json")
+
+# deltaLink confirmado por carpeta y el pendiente de la última lectura
+_delta_links: dict[str, str] | None = None
+_pending_delta: dict[str, str] = {}
+
+def _load_delta_links() -> dict[str, str]:
+    global _delta_links
+    if _delta_links is None:
+        _delta_links = {}
+        if os.path.exists(DELTA_STATE_FILE):
+            with open(DELTA_STATE_FILE, "r") as f:
+                _delta_links = json.load(f)
+    return _delta_links
+
+def commit_sync_state(folder_id: str = 'Inbox'):
+    """
+    Persiste el deltaLink de la última lectura. Se llama después de procesar
+    los correos devueltos, así un fallo intermedio vuelve a leerlos.
+    """
+    link = _pending_delta.pop(folder_id, None)
+    if link is None:
+        return
+    links = _load_delta_links()
+    links[folder_id] = link
+    os.makedirs(os.path.dirname(DELTA_STATE_FILE) or ".", exist_ok=True)
+    tmp = DELTA_STATE_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(links, f)
+    os.replace(tmp, DELTA_STATE_FILE)
+
+def reload_sync_state():
+    """Descarta el deltaLink en memoria: el siguiente ciclo lo relee del fichero (otro proceso pudo avanzarlo)."""
+    global _delta_links
+    _delta_links = None
+    _pending_delta.clear()
+
+def reset_sync_state(folder_id: str = 'Inbox'):
+    _load_delta_links().pop(folder_id, None)
+    _pending_delta.pop(folder_id, None)
+
+def _since_filter() -> str:
+    since = datetime.now(timezone.utc) - timedelta(minutes=GRAPH_LOOKBACK_MINUTES)
+    return f"receivedDateTime ge {since.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+
+class _DeltaExpired(Exception):
+    """Graph respondió 410: el deltaLink ya no es válido."""
+
+async def _paginate(url: str, params: dict | None, headers: dict) -> tuple[list[dict], str | None] | None:
+    """
+    Recorre todas las páginas siguiendo @odata.nextLink. Devuelve los items
+    y el @odata.deltaLink final (si lo hay), o None si alguna página falla.
+    """
+    client = get_client()
+    items: list[dict] = []
+    while url:
+        resp = await client.request("GET", url, params=params, headers=headers)
+        if resp is None:
+            return None
+        if resp.status_code == 410:
+            raise _DeltaExpired(resp.text)
+        if resp.status_code != 200:
+            logger.error("Error al leer correos: %s %s", resp.status_code, resp.text)
+            return None
+        data = resp.json()
+        items.extend(data.get('value', []))
+        url, params = data.get('@odata.nextLink'), None   # el nextLink ya trae los parámetros
+        if '@odata.deltaLink' in data:
+            return items, data['@odata.deltaLink']
+    return items, None
+
+async def _fetch_headers_delta(folder_id: str, page_size: int) -> list[dict] | None:
+    headers = {'Prefer': f'odata.maxpagesize={page_size}'}
+    initial = (
+        f"/me/mailFolders/{folder_id}/messages/delta",
+        {'$select': 'id,sender,subject', '$filter': _since_filter()},
+    )
+    link = _load_delta_links().get(folder_id)
+    try:
+        result = await _paginate(link, None, headers) if link else await _paginate(*initial, headers)
+    except _DeltaExpired:
+        logger.warning("deltaLink caducado para %s, se reinicia la sincronización", folder_id)
+        reset_sync_state(folder_id)
+        result = await _paginate(*initial, headers)
+    if result is None:
+        return None
+
+    items, delta_link = result
+    if delta_link:
+        _pending_delta[folder_id] = delta_link
+    # delta no admite $filter por asunto: se filtra sobre cabeceras (sin cuerpo)
+    return [
+        it for it in items
+        if '@removed' not in it
+        and (it.get('subject') or '').lower().startswith(SUBJECT_PREFIX.lower())
+    ]
+
+async def _fetch_headers_list(folder_id: str, page_size: int) -> list[dict] | None:
+    prefix = SUBJECT_PREFIX.replace("'", "''")
     params = {
-        '$top': top,
-        '$select': 'sender,subject,body'
+        '$top': page_size,
+        '$select': 'id,sender,subject',
+        '$filter': f"startswith(subject,'{prefix}') and {_since_filter()}",
     }
-    resp = requests.get(url, headers=headers, params=params)
-    if resp.status_code != 200:
-        logger.error("Error al leer correos: %s %s", resp.status_code, resp.text)
+    result = await _paginate(f"/me/mailFolders/{folder_id}/messages", params, {})
+    return None if result is None else result[0]
+
+async def _fetch_body(message_id: str) -> str | None:
+    resp = await get_client().request(
+        "GET", f"/me/messages/{message_id}",
+        params={'$select': 'body'},
+        headers={'Prefer': 'outlook.body-content-type="text"'},
+    )
+    if resp is None or resp.status_code != 200:
+        logger.error("Error al leer cuerpo de %s: %s", message_id, resp and resp.status_code)
+        return None
+    return resp.json().get('body', {}).get('content')
+
+
+# ------------------- API de correo ---------------------------------------------------
+FETCH_SECONDS = metrics.histogram("inventario_fetch_emails_seconds", "Duración de fetch_new_emails")
+EMAILS_FETCHED = metrics.counter("inventario_emails_fetched_total", "Correos de consulta descargados de Graph")
+SEND_SECONDS = metrics.histogram(
+    "inventario_send_seconds", "Envío de una respuesta hasta su confirmación por Graph (mode=direct|batch)")
+SENT_TOTAL = metrics.counter("inventario_sent_total", "Respuestas enviadas por resultado (mode, status)")
+
+@metrics.timed(FETCH_SECONDS)
+async def fetch_new_emails(folder_id: str = 'Inbox', top: int = GRAPH_PAGE_SIZE):
+    """
+    Obtiene de Microsoft Graph (flujo delegado, /me) los correos nuevos cuyo
+    asunto empieza por "Consulta inventario:". Solo se descargan los cuerpos
+    de los mensajes que coinciden.
+    Retorna una lista de dicts: {'id', 'from', 'subject', 'body'}.
+    """
+    if GRAPH_SYNC_MODE == "delta":
+        items = await _fetch_headers_delta(folder_id, top)
+    else:
+        items = await _fetch_headers_list(folder_id, top)
+    if not items:
         return []
 
-    items = resp.json().get('value', [])
+    bodies = await asyncio.gather(*(_fetch_body(it['id']) for it in items))
     emails = []
-    for item in items:
+    for item, body_content in zip(items, bodies):
         sender = item.get('sender', {}).get('emailAddress', {}).get('address')
         subject = item.get('subject')
-        body_content = item.get('body', {}).get('content')
-        emails.append({'from': sender, 'subject': subject, 'body': body_content})
+        emails.append({'id': item['id'], 'from': sender, 'subject': subject, 'body': body_content})
+    EMAILS_FETCHED.inc(len(emails))
     logger.info(f"Obtenidos {len(emails)} correos")
     return emails
 
-
-def send_email(to: str, subject: str, body: str):
+async def fetch_email(message_id: str) -> dict | None:
     """
-    Envía un correo usando Microsoft Graph API con flujo delegado (/me/sendMail).
+    Un mensaje concreto (p. ej. el de una notificación de cambio) con cabeceras
+    y cuerpo en una sola petición: {'id', 'from', 'subject', 'body'} o None.
     """
-    token = get_graph_token()
-    if not token:
-        return False
-
-    url = f"{graph_api_endpoint}/me/sendMail"
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
+    resp = await get_client().request(
+        "GET", f"/me/messages/{message_id}",
+        params={'$select': 'id,sender,subject,body'},
+        headers={'Prefer': 'outlook.body-content-type="text"'},
+    )
+    if resp is None or resp.status_code != 200:
+        logger.error("Error al leer el mensaje %s: %s", message_id, resp and resp.status_code)
+        return None
+    item = resp.json()
+    EMAILS_FETCHED.inc()
+    return {
+        'id': item.get('id', message_id),
+        'from': item.get('sender', {}).get('emailAddress', {}).get('address'),
+        'subject': item.get('subject'),
+        'body': item.get('body', {}).get('content'),
     }
+
+
+class Attachment(NamedTuple):
+    """Fichero adjunto a una respuesta (Graph admite hasta 3 MB en sendMail)."""
+    name:         str
+    content_type: str
+    data:         bytes
+
+
+def _mail_payload(to: str, subject: str, body: str, attachments: tuple[Attachment, ...] = ()) -> dict:
     message = {
-        'message': {
-            'subject': subject,
-            'body': {
-                'contentType': 'Text',
-                'content': body
-            },
-            'toRecipients': [
-                {'emailAddress': {'address': to}}
-            ]
-        }
+        'subject': subject,
+        'body': {
+            'contentType': 'Text',
+            'content': body
+        },
+        'toRecipients': [
+            {'emailAddress': {'address': to}}
+        ]
     }
-    resp = requests.post(url, headers=headers, json=message)
-    if resp.status_code in (200, 202):
+    if attachments:
+        message['attachments'] = [{
+            '@odata.type': '#microsoft.graph.fileAttachment',
+            'name': a.name,
+            'contentType': a.content_type,
+            'contentBytes': base64.b64encode(a.data).decode('ascii'),
+        } for a in attachments]
+    return {'message': message}
+
+
+@metrics.timed(SEND_SECONDS, mode="direct")
+async def send_email(to: str, subject: str, body: str, attachments: tuple[Attachment, ...] = ()):
+    """
+    Envía un correo usando Microsoft Graph API con flujo delegado (/me/sendMail).
+    """
+    resp = await get_client().request("POST", "/me/sendMail",
+                                      json=_mail_payload(to, subject, body, attachments))
+    ok = resp is not None and resp.status_code in (200, 202)
+    SENT_TOTAL.inc(mode="direct", status="ok" if ok else "failed")
+    if resp is None:
+        return False
+    if ok:
         logger.info(f"Correo enviado a {to} vía Graph API")
         return True
     else:
         logger.error("Error al enviar correo: %s %s", resp.status_code, resp.text)
         return False
+
+
+# ------------------- respuestas agrupadas vía $batch ---------------------------------
+GRAPH_BATCH_SIZE        = min(int(os.getenv("GRAPH_BATCH_SIZE", 20)), 20)   # máximo de Graph
+GRAPH_BATCH_DELAY       = float(os.getenv("GRAPH_BATCH_DELAY", 0.5))
+# Graph rechaza peticiones de más de 4 MB: un lote se cierra antes de pasar de
+# GRAPH_BATCH_MAX_BYTES y una respuesta más grande (adjuntos) se envía sola
+GRAPH_BATCH_MAX_BYTES   = int(os.getenv("GRAPH_BATCH_MAX_BYTES", 3_000_000))
+GRAPH_BATCH_MAX_RETRIES = int(os.getenv("GRAPH_BATCH_MAX_RETRIES", 3))
+GRAPH_DEFAULT_RETRY_AFTER = 5.0
+
+
+class SendResult(NamedTuple):
+    """Resultado de un envío individual dentro de un lote."""
+    ok:     bool
+    status: int | None = None
+    error:  str | None = None
+
+
+def _retry_after(headers: dict | None) -> float:
+    value = {k.lower(): v for k, v in (headers or {}).items()}.get("retry-after")
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return GRAPH_DEFAULT_RETRY_AFTER
+
+
+class _Outgoing:
+    __slots__ = ("to", "payload", "size", "future", "attempts")
+
+    def __init__(self, to: str, payload: dict, future: asyncio.Future):
+        self.to, self.payload, self.future, self.attempts = to, payload, future, 0
+        self.size = len(json.dumps(payload))          # bytes en el cuerpo JSON (ASCII)
+
+
+class ReplyQueue:
+    """
+    Cola de respuestas salientes. Agrupa hasta `max_batch` correos o
+    `max_bytes` de cuerpo por petición JSON `$batch` y la envía al llenarse o
+    cuando el más antiguo lleva `max_delay` segundos esperando; un correo que
+    solo ya pasa de `max_bytes` va directo a /me/sendMail. Cada `send()` espera
+    su propio resultado; los 429 se reintentan tras su `Retry-After`.
+    """
+
+    def __init__(self, max_batch: int = GRAPH_BATCH_SIZE, max_delay: float = GRAPH_BATCH_DELAY,
+                 max_retries: int = GRAPH_BATCH_MAX_RETRIES, max_bytes: int = GRAPH_BATCH_MAX_BYTES):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.max_bytes = max_bytes
+        self._loop = asyncio.get_running_loop()
+        self._pending: list[_Outgoing] = []
+        self._pending_bytes = 0
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._inflight: set[asyncio.Task] = set()
+        self._task = self._loop.create_task(self._run())
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def send(self, to: str, subject: str, body: str,
+                   attachments: tuple[Attachment, ...] = ()) -> SendResult:
+        payload = _mail_payload(to, subject, body, attachments)
+        item = _Outgoing(to, payload, self._loop.create_future())
+        with SEND_SECONDS.time(mode="batch"):
+            self._enqueue(item)
+            result = await item.future
+        SENT_TOTAL.inc(mode="batch", status="ok" if result.ok else "failed")
+        return result
+
+    def _enqueue(self, item: _Outgoing):
+        if item.size > self.max_bytes:
+            self._spawn(self._send_alone(item))
+            return
+        self._pending.append(item)
+        self._pending_bytes += item.size
+        self._has_items.set()
+        if self._is_full():
+            self._full.set()
+
+    def _is_full(self) -> bool:
+        return len(self._pending) >= self.max_batch or self._pending_bytes >= self.max_bytes
+
+    def _take(self) -> list[_Outgoing]:
+        """Siguiente lote: hasta max_batch correos sin pasar de max_bytes."""
+        n, size = 0, 0
+        while (n < len(self._pending) and n < self.max_batch
+               and size + self._pending[n].size <= self.max_bytes):
+            size += self._pending[n].size
+            n += 1
+        batch, self._pending = self._pending[:n], self._pending[n:]
+        self._pending_bytes -= size
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if not self._is_full():
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._take()
+            self._full.clear()
+            if self._is_full():
+                self._full.set()
+            if not self._pending:
+                self._has_items.clear()
+            if batch:
+                self._spawn(self._flush(batch))
+
+    def _spawn(self, coro):
+        task = self._loop.create_task(coro)
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _flush(self, batch: list[_Outgoing]):
+        requests_ = [
+            {
+                "id": str(i),
+                "method": "POST",
+                "url": "/me/sendMail",
+                "headers": {"Content-Type": "application/json"},
+                "body": item.payload,
+            }
+            for i, item in enumerate(batch)
+        ]
+        resp = await get_client().request("POST", "/$batch", json={"requests": requests_})
+        if resp is None:
+            for item in batch:
+                self._finish(item, SendResult(False, None, "sin token o error de transporte"))
+            return
+        if resp.status_code == 429:
+            self._retry(batch, _retry_after(resp.headers))
+            return
+        if resp.status_code != 200:
+            logger.error("Error en $batch: %s %s", resp.status_code, resp.text)
+            for item in batch:
+                self._finish(item, SendResult(False, resp.status_code, resp.text))
+            return
+
+        by_id = {r.get("id"): r for r in resp.json().get("responses", [])}
+        throttled: dict[float, list[_Outgoing]] = {}
+        for i, item in enumerate(batch):
+            sub = by_id.get(str(i))
+            if sub is None:
+                self._finish(item, SendResult(False, None, "sin respuesta en el lote"))
+                continue
+            status = sub.get("status")
+            if status in (200, 202):
+                logger.info(f"Correo enviado a {item.to} vía Graph API ($batch)")
+                self._finish(item, SendResult(True, status))
+            elif status == 429:
+                throttled.setdefault(_retry_after(sub.get("headers")), []).append(item)
+            else:
+                error = (sub.get("body") or {}).get("error", {}).get("message")
+                logger.error("Error al enviar correo a %s: %s %s", item.to, status, error)
+                self._finish(item, SendResult(False, status, error))
+        for delay, items in throttled.items():
+            self._retry(items, delay)
+
+    async def _send_alone(self, item: _Outgoing):
+        resp = await get_client().request("POST", "/me/sendMail", json=item.payload)
+        if resp is None:
+            self._finish(item, SendResult(False, None, "sin token o error de transporte"))
+        elif resp.status_code == 429:
+            self._retry([item], _retry_after(resp.headers))
+        elif resp.status_code in (200, 202):
+            logger.info(f"Correo enviado a {item.to} vía Graph API (fuera del lote, {item.size} bytes)")
+            self._finish(item, SendResult(True, resp.status_code))
+        else:
+            logger.error("Error al enviar correo a %s: %s %s", item.to, resp.status_code, resp.text)
+            self._finish(item, SendResult(False, resp.status_code, resp.text))
+
+    def _retry(self, items: list[_Outgoing], delay: float):
+        retry = []
+        for item in items:
+            item.attempts += 1
+            if item.attempts > self.max_retries:
+                self._finish(item, SendResult(False, 429, "límite de reintentos por throttling"))
+            else:
+                retry.append(item)
+        if retry:
+            logger.warning("Graph limitó %d envíos, reintento en %.1f s", len(retry), delay)
+            self._spawn(self._requeue_later(retry, delay))
+
+    async def _requeue_later(self, items: list[_Outgoing], delay: float):
+        await asyncio.sleep(delay)
+        for item in items:
+            self._enqueue(item)
+
+    @staticmethod
+    def _finish(item: _Outgoing, result: SendResult):
+        if not item.future.done():
+            item.future.set_result(result)
+
+    async def aclose(self):
+        """Envía lo pendiente y detiene la cola."""
+        while self._pending or self._inflight:
+            if self._pending:
+                await self._flush(self._take())
+            if self._inflight:
+                await asyncio.gather(*self._inflight, return_exceptions=True)
+        self._task.cancel()
+
+
+_reply_queue: ReplyQueue | None = None
+
+def get_reply_queue() -> ReplyQueue:
+    """Cola compartida de respuestas, ligada al event loop en curso."""
+    global _reply_queue
+    if _reply_queue is None or _reply_queue._loop is not asyncio.get_running_loop():
+        _reply_queue = ReplyQueue()
+    return _reply_queue
+
+def pending_replies() -> int:
+    """Respuestas en cola aún no entregadas a Graph."""
+    return len(_reply_queue) if _reply_queue is not None else 0
+
+async def close_reply_queue():
+    global _reply_queue
+    if _reply_queue is not None:
+        await _reply_queue.aclose()
+        _reply_queue = None
@@ -1,11 +1,40 @@
 # extract_query.py
-from langchain_openai import OpenAI
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
+# LangChain/OpenAI se importan y construyen en la primera extracción.
+#
+# Delante de la cadena hay una cache por texto normalizado ("saldo  ABC" y
+# "saldo ABC" son la misma pregunta; "saldo abc" o "saldo ABC-1" no, porque el
+# producto distingue mayúsculas y puntuación): LRU en memoria y, debajo, la tabla
+# extract_cache de inventory.db, que sobrevive a reinicios. Peticiones
+# idénticas simultáneas esperan a una sola llamada al LLM (single-flight) y
+# `extract_queries` manda todas las preguntas distintas pendientes en una
+# sola llamada batch de la cadena.
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+
+from sqlalchemy import Engine, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import metrics
+from diagnostics import llm_call
+from models import engine as default_engine, ExtractCacheEntry
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_CACHE_SIZE      = int(os.getenv("EXTRACT_CACHE_SIZE", 1024))
+EXTRACT_CACHE_DISK_ROWS = int(os.getenv("EXTRACT_CACHE_DISK_ROWS", 50_000))
 
 # Cadena que extrae JSON con producto, tipo y días
 EXTRACT_TEMPLATE = """\
-Eres un extractor. Recibes un texto de correo (asunto + cuerpo). 
+Eres un extractor. Recibes un texto de correo (asunto + cuerpo).
 De ahí solo extrae en JSON estas 3 llaves, nada más:
   - product: nombre del producto (exacto, mayúsculas/minúsculas como en DB)
   - request_type: uno de ["saldo", "historial", "proyección"]
@@ -18,20 +47,202 @@ Salida JSON válida:
 {{"product": "...", "request_type": "...", "days": ...}}
 """
 
-extract_prompt = PromptTemplate(
-    input_variables=["text"],
-    template=EXTRACT_TEMPLATE
-)
-_llm = OpenAI(temperature=0, max_tokens=100)
-_extract_chain = LLMChain(llm=_llm, prompt=extract_prompt)
+_extract_chain = None
 
-def extract_query(text: str) -> dict:
-    out = _extract_chain.run(text=text)
+def _get_extract_chain():
+    global _extract_chain
+    if _extract_chain is None:
+        from langchain_openai import OpenAI
+        from langchain.chains import LLMChain
+        from langchain.prompts import PromptTemplate
+        extract_prompt = PromptTemplate(
+            input_variables=["text"],
+            template=EXTRACT_TEMPLATE
+        )
+        _llm = OpenAI(temperature=0, max_tokens=100)
+        _extract_chain = LLMChain(llm=_llm, prompt=extract_prompt)
+    return _extract_chain
+
+def _parse(out: str) -> dict:
     try:
-        data = __import__("json").loads(out)
+        data = json.loads(out)
         # Validaciones básicas
         if not all(k in data for k in ("product", "request_type", "days")):
             raise ValueError
         return data
     except Exception:
         raise ValueError(f"No pude extraer consulta válida del texto:\n{out}")
+
+def _run_chain(texts: list[str]) -> list[str]:
+    """Una sola llamada batch de la cadena para todos los textos."""
+    prompt_chars = sum(len(EXTRACT_TEMPLATE.format(text=t)) for t in texts)
+    with EXTRACT_LLM_SECONDS.time(), llm_call("extract_query", prompt_chars, texts=len(texts)):
+        outputs = _get_extract_chain().batch([{"text": t} for t in texts])
+    EXTRACT_LLM_TEXTS.inc(len(texts))
+    # LLMChain devuelve {"text": ...}; un Runnable prompt | llm, la cadena
+    return [o["text"] if isinstance(o, dict) else str(o) for o in outputs]
+
+# ------------------- métricas ----------------------------------------------------------
+EXTRACT_LOOKUPS = metrics.counter(
+    "inventario_extract_lookups_total", "Extracciones por origen (source=memory|disk|shared|llm)")
+EXTRACT_LLM_SECONDS = metrics.histogram(
+    "inventario_extract_llm_seconds", "Llamadas batch reales al LLM extractor")
+EXTRACT_LLM_TEXTS = metrics.counter(
+    "inventario_extract_llm_texts_total", "Textos enviados al LLM extractor")
+
+# ------------------- cache ---------------------------------------------------------------
+_SPACES = re.compile(r"\s+")
+
+def normalize(text: str) -> str:
+    """
+    Espacios colapsados y tildes en forma compuesta (NFC). Mayúsculas y
+    puntuación se conservan: "ABC-1" y "abc 1" pueden ser productos distintos.
+    """
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def cache_key(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+class ExtractCache:
+    """
+    Dos niveles: LRU en memoria (`max_entries`) y tabla extract_cache en
+    disco, recortada a `max_rows` por último uso. `get_many` resuelve cada
+    clave una sola vez aunque la pidan varios hilos a la vez.
+    """
+
+    def __init__(self, engine: Engine = default_engine, max_entries: int = EXTRACT_CACHE_SIZE,
+                 max_rows: int = EXTRACT_CACHE_DISK_ROWS, run_chain=None):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._run_chain = run_chain or _run_chain
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._inflight: dict[str, Future] = {}
+        self._table = ExtractCacheEntry.__table__
+        self._table.create(engine, checkfirst=True)
+
+    # ------------------- niveles -----------------------------------------------------
+    def _remember(self, key: str, value: dict):
+        # con el lock tomado
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, keys: list[str]) -> dict[str, dict]:
+        t = self._table
+        with self.engine.begin() as conn:
+            rows = conn.execute(select(t.c.key, t.c.result).where(t.c.key.in_(keys))).all()
+            if rows:
+                conn.execute(update(t).where(t.c.key.in_([r.key for r in rows]))
+                             .values(used_at=datetime.utcnow()))
+        return {r.key: json.loads(r.result) for r in rows}
+
+    def _store(self, values: dict[str, dict]):
+        t = self._table
+        now = datetime.utcnow()
+        stmt = sqlite_insert(t).values([
+            {"key": k, "result": json.dumps(v, ensure_ascii=False), "used_at": now}
+            for k, v in values.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[t.c.key], set_={"result": stmt.excluded.result, "used_at": now})
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+            total = conn.execute(select(func.count()).select_from(t)).scalar_one()
+            if total > self.max_rows:
+                oldest = select(t.c.key).order_by(t.c.used_at).limit(total - self.max_rows)
+                conn.execute(delete(t).where(t.c.key.in_(oldest)))
+
+    # ------------------- consulta ----------------------------------------------------
+    def get_many(self, texts: list[str]) -> list[dict]:
+        """
+        Resultado de cada texto: memoria → otra petición en curso → disco →
+        una sola llamada batch al LLM con las preguntas distintas restantes.
+        Un texto que el LLM no sabe extraer lanza ValueError.
+        """
+        keys = [cache_key(t) for t in texts]
+        results: dict[str, dict] = {}
+        waiting: dict[str, Future] = {}
+        mine: dict[str, Future] = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[key] = self._memory[key]
+                    EXTRACT_LOOKUPS.inc(source="memory")
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                    EXTRACT_LOOKUPS.inc(source="shared")
+                else:
+                    mine[key] = self._inflight[key] = Future()
+
+        if mine:
+            first = {}
+            for key, text in zip(keys, texts):
+                if key in mine:
+                    first.setdefault(key, text)
+            self._resolve(mine, first)
+        for key, future in {**waiting, **mine}.items():
+            results[key] = future.result()
+        return [results[k] for k in keys]
+
+    def get(self, text: str) -> dict:
+        return self.get_many([text])[0]
+
+    def _resolve(self, mine: dict[str, Future], texts: dict[str, str]):
+        # Resuelve las claves propias y despierta a quien las espere
+        try:
+            found = self._load(list(mine))
+            EXTRACT_LOOKUPS.inc(len(found), source="disk")
+            missing = [k for k in mine if k not in found]
+            fresh: dict[str, dict] = {}
+            errors: dict[str, Exception] = {}
+            if missing:
+                EXTRACT_LOOKUPS.inc(len(missing), source="llm")
+                for key, out in zip(missing, self._run_chain([texts[k] for k in missing])):
+                    try:
+                        fresh[key] = _parse(out)
+                    except ValueError as exc:
+                        errors[key] = exc       # no se cachea: se reintenta la próxima vez
+                if fresh:
+                    self._store(fresh)
+        except BaseException as exc:
+            with self._lock:
+                for key, future in mine.items():
+                    self._inflight.pop(key, None)
+                    future.set_exception(exc)
+            raise
+        with self._lock:
+            for key, future in mine.items():
+                self._inflight.pop(key, None)
+                if key in errors:
+                    future.set_exception(errors[key])
+                else:
+                    value = found.get(key) or fresh[key]
+                    self._remember(key, value)
+                    future.set_result(value)
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+
+_cache: ExtractCache | None = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> ExtractCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractCache()
+        return _cache
+
+def extract_query(text: str) -> dict:
+    return get_cache().get(text)
+
+def extract_queries(texts: list[str]) -> list[dict]:
+    """Varios textos a la vez: una sola llamada batch al LLM para los que falten."""
+    return get_cache().get_many(texts)
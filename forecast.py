@@ -0,0 +1,186 @@
+# forecast.py
+# Previsión de agotamiento de todo el catálogo en una sola pasada vectorizada.
+# Las series diarias (movement_daily) de todos los productos se cargan en una
+# matriz NumPy productos × días; de ahí salen consumo medio, media móvil
+# reciente y días hasta agotar para cada ventana de FORECAST_WINDOWS, que se
+# guardan en stock_forecasts. Una respuesta de proyección es entonces una
+# búsqueda por clave y el informe de roturas de stock un recorrido de índice.
+#
+#   python forecast.py            → recalcula stock_forecasts
+
+import os
+import json
+import time
+import asyncio
+import logging
+from itertools import chain
+from typing import Callable, NamedTuple
+
+import numpy as np
+from sqlalchemy import Engine
+
+import metrics
+from models import engine as default_engine, init_db
+
+logger = logging.getLogger(__name__)
+
+FORECAST_WINDOWS      = tuple(int(w) for w in os.getenv("FORECAST_WINDOWS", "7,14,30").split(","))
+FORECAST_SHORT_WINDOW = int(os.getenv("FORECAST_SHORT_WINDOW", 7))
+FORECAST_INTERVAL     = int(os.getenv("FORECAST_INTERVAL", 900))     # segundos entre pasadas
+
+FORECAST_SECONDS = metrics.histogram(
+    "inventario_forecast_seconds", "Pasadas de previsión (phase=load|compute|store)")
+FORECAST_PRODUCTS = metrics.gauge(
+    "inventario_forecast_products", "Productos en la última previsión calculada")
+
+
+class Series(NamedTuple):
+    """Catálogo cargado: ids ordenados, stock y cambio neto diario (columna -1 = ayer)."""
+    as_of:      str             # día en curso 'YYYY-MM-DD' (UTC, como date('now'))
+    product_ids: np.ndarray     # (n,)
+    stock:      np.ndarray      # (n,)
+    daily:      np.ndarray      # (n, días)
+
+
+class Forecast(NamedTuple):
+    window_days:      int
+    net_change:       np.ndarray    # suma de la ventana
+    daily_rate:       np.ndarray    # consumo medio/día (>0 consume, <0 repone)
+    short_rate:       np.ndarray    # ídem en los últimos FORECAST_SHORT_WINDOW días
+    days_to_stockout: np.ndarray    # NaN sin consumo neto
+
+
+def _int_matrix(cursor, columns: int) -> np.ndarray:
+    # tuplas del driver aplanadas directamente a int64 (sin objetos Row intermedios)
+    rows = cursor.fetchall()
+    flat = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * columns)
+    return flat.reshape(-1, columns)
+
+def load_series(conn, days: int, product_ids: list[int] | None = None) -> Series:
+    """
+    Lee el stock y los `days` días completos anteriores a hoy de movement_daily
+    (hoy no ha terminado: la consulta de proyección lo suma en vivo). Con
+    `product_ids`, solo esos productos.
+    """
+    cursor = conn.connection.driver_connection.cursor()
+    as_of = cursor.execute("SELECT date('now')").fetchone()[0]
+    only, ids = "", ()
+    if product_ids is not None:
+        only, ids = " AND {} IN (SELECT value FROM json_each(?))", (json.dumps(product_ids),)
+    products = _int_matrix(cursor.execute(
+        "SELECT id, quantity FROM products WHERE 1" + only.format("id") + " ORDER BY id", ids), 2)
+    # back = días hacia atrás desde hoy (1 = ayer … days); recorre ix_movement_daily_day
+    cells = _int_matrix(cursor.execute(
+        "SELECT product_id, CAST(julianday(?) - julianday(day) AS INTEGER), net_change "
+        "FROM movement_daily WHERE day >= date(?, ?) AND day < ?" + only.format("product_id"),
+        (as_of, as_of, f"-{days} days", as_of, *ids),
+    ), 3)
+    cursor.close()
+
+    ids = products[:, 0]
+    daily = np.zeros((len(ids), days), dtype=np.int64)
+    rows = np.searchsorted(ids, cells[:, 0])
+    daily[rows, days - cells[:, 1]] = cells[:, 2]
+    return Series(as_of, ids, products[:, 1], daily)
+
+
+def days_to_stockout(stock, daily_rate, short_rate):
+    """
+    Días hasta agotar con el mayor de los dos consumos (una aceleración
+    reciente adelanta la fecha; un parón reciente no la retrasa). Admite
+    escalares o arrays; NaN sin consumo neto, stock negativo cuenta como 0.
+    Es la misma cuenta para stock_forecasts y para la respuesta de proyección.
+    """
+    burn = np.maximum(daily_rate, short_rate)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(burn > 0, np.maximum(stock, 0) / burn, np.nan)
+
+def compute(stock: np.ndarray, daily: np.ndarray, windows=FORECAST_WINDOWS,
+            short_window: int = FORECAST_SHORT_WINDOW) -> list[Forecast]:
+    """
+    Todas las ventanas de una vez: sumas acumuladas desde el día más reciente,
+    así la suma de cada ventana es una sola columna.
+    """
+    recent_first = np.cumsum(daily[:, ::-1], axis=1)
+    short = min(short_window, daily.shape[1])
+    short_rate = -recent_first[:, short - 1] / short
+    out = []
+    for w in windows:
+        net = recent_first[:, w - 1]
+        rate = -net / w
+        out.append(Forecast(w, net, rate, short_rate, days_to_stockout(stock, rate, short_rate)))
+    return out
+
+
+def refresh_forecasts(engine: Engine = default_engine, windows=FORECAST_WINDOWS,
+                      product_ids: list[int] | None = None) -> int:
+    """
+    Recalcula stock_forecasts en una transacción: entera o, con `product_ids`,
+    solo esas filas (tras escribir movimientos). Devuelve los productos.
+    """
+    with FORECAST_SECONDS.time(phase="load"), engine.connect() as conn:
+        series = load_series(conn, max(max(windows), FORECAST_SHORT_WINDOW), product_ids)
+
+    with FORECAST_SECONDS.time(phase="compute"):
+        forecasts = compute(series.stock, series.daily, windows)
+        ids, stock = series.product_ids.tolist(), series.stock.tolist()
+        rows = []
+        for f in forecasts:
+            left = np.where(np.isnan(f.days_to_stockout), None, f.days_to_stockout.round(1)).tolist()
+            rows += zip(ids, [f.window_days] * len(ids), [series.as_of] * len(ids), stock,
+                        f.net_change.tolist(), f.daily_rate.tolist(), f.short_rate.tolist(), left)
+
+    with FORECAST_SECONDS.time(phase="store"), engine.begin() as conn:
+        if product_ids is None:
+            conn.exec_driver_sql("DELETE FROM stock_forecasts")
+        else:
+            conn.exec_driver_sql("DELETE FROM stock_forecasts WHERE product_id IN (SELECT value FROM json_each(?))",
+                                 (json.dumps(product_ids),))
+        if rows:
+            conn.exec_driver_sql(
+                "INSERT INTO stock_forecasts (product_id, window_days, as_of, current_stock, "
+                "net_change, daily_rate, short_rate, days_to_stockout) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+    if product_ids is None:
+        FORECAST_PRODUCTS.set(len(ids))
+    return len(ids)
+
+
+def stockout_report(engine: Engine = default_engine, window: int = FORECAST_WINDOWS[0],
+                    horizon: float = 30, limit: int = 100) -> list[dict]:
+    """Productos que se agotan en `horizon` días o menos, los más urgentes primero."""
+    with engine.connect() as conn:
+        result = conn.exec_driver_sql(
+            "SELECT p.name AS product, f.current_stock, f.daily_rate, f.short_rate, "
+            "f.days_to_stockout, f.as_of "
+            "FROM stock_forecasts f JOIN products p ON p.id = f.product_id "
+            "WHERE f.window_days = ? AND f.days_to_stockout <= ? "
+            "ORDER BY f.days_to_stockout LIMIT ?",
+            (window, horizon, limit),
+        )
+        keys = list(result.keys())
+        return [dict(zip(keys, row)) for row in result]
+
+
+async def run_refresher(interval: float = FORECAST_INTERVAL, active: Callable[[], bool] = lambda: True):
+    """Recalcula la previsión cada `interval` s mientras `active()`, indefinidamente."""
+    while True:
+        if not active():
+            await asyncio.sleep(interval)
+            continue
+        try:
+            start = time.perf_counter()
+            n = await asyncio.to_thread(refresh_forecasts)
+            logger.info("Previsión de %d productos recalculada en %.2f s", n, time.perf_counter() - start)
+        except Exception:
+            logger.exception("Error recalculando la previsión de stock")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    start = time.perf_counter()
+    n = refresh_forecasts()
+    print(f"✔ Previsión de {n} productos en {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,183 @@
+# graph_notify.py
+# Ingesta por notificaciones de cambio de Graph (INGEST_MODE=notify): Graph
+# llama a nuestro webhook cuando llega un correo a la bandeja y se procesa al
+# momento, en lugar de esperar al siguiente polling. La suscripción se crea al
+# arrancar, se renueva antes de caducar y se borra al parar; el polling queda
+# como red de seguridad a intervalo largo (NOTIFY_FALLBACK_POLL_INTERVAL).
+
+import os
+import hmac
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+import metrics
+from email_io import get_client
+
+logger = logging.getLogger(__name__)
+
+INGEST_MODE                   = os.getenv("INGEST_MODE", "poll")            # "poll" | "notify"
+NOTIFY_URL                    = os.getenv("NOTIFY_URL")                     # https pública del webhook
+# Obligatorio con INGEST_MODE=notify: todos los procesos deben validar el mismo valor
+NOTIFY_CLIENT_STATE           = os.getenv("NOTIFY_CLIENT_STATE", "")
+NOTIFY_SUBSCRIPTION_MINUTES   = int(os.getenv("NOTIFY_SUBSCRIPTION_MINUTES", 60 * 24 * 2))
+NOTIFY_RENEW_MARGIN           = int(os.getenv("NOTIFY_RENEW_MARGIN", 60 * 60))   # segundos
+NOTIFY_RETRY_DELAY            = int(os.getenv("NOTIFY_RETRY_DELAY", 60))
+NOTIFY_FALLBACK_POLL_INTERVAL = int(os.getenv("NOTIFY_FALLBACK_POLL_INTERVAL", 600))
+NOTIFY_SIGNAL_CHECK           = float(os.getenv("NOTIFY_SIGNAL_CHECK", 10))     # s entre consultas de avisos
+
+NOTIFICATIONS = metrics.counter(
+    "inventario_graph_notifications_total", "Notificaciones de Graph recibidas (kind=created|lifecycle|rejected)")
+
+
+def _iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.0000000Z")
+
+def _parse_iso(value: str) -> datetime:
+    # Graph devuelve hasta 7 decimales: fromisoformat admite 6
+    head, _, frac = value.rstrip("Z").partition(".")
+    return datetime.fromisoformat(f"{head}.{(frac or '0')[:6]}").replace(tzinfo=timezone.utc)
+
+
+class SubscriptionManager:
+    """Suscripción de Graph a los correos nuevos de una carpeta, siempre vigente."""
+
+    def __init__(self, notification_url: str, client_state: str = NOTIFY_CLIENT_STATE,
+                 folder_id: str = "Inbox", minutes: int = NOTIFY_SUBSCRIPTION_MINUTES,
+                 renew_margin: int = NOTIFY_RENEW_MARGIN):
+        self.notification_url = notification_url
+        self.client_state = client_state
+        self.resource = f"me/mailFolders('{folder_id}')/messages"
+        self.minutes = minutes
+        self.renew_margin = renew_margin
+        self.subscription_id: str | None = None
+        self.expires_at: datetime | None = None
+        self._wake: asyncio.Event | None = None
+
+    def _expiration(self) -> str:
+        return _iso(datetime.now(timezone.utc) + timedelta(minutes=self.minutes))
+
+    def _store(self, data: dict):
+        self.subscription_id = data["id"]
+        self.expires_at = _parse_iso(data["expirationDateTime"])
+
+    async def create(self) -> bool:
+        resp = await get_client().request("POST", "/subscriptions", json={
+            "changeType": "created",
+            "notificationUrl": self.notification_url,
+            "lifecycleNotificationUrl": self.notification_url,
+            "resource": self.resource,
+            "expirationDateTime": self._expiration(),
+            "clientState": self.client_state,
+        })
+        if resp is None or resp.status_code != 201:
+            logger.error("No se pudo crear la suscripción de Graph: %s %s",
+                         resp and resp.status_code, resp and resp.text)
+            return False
+        self._store(resp.json())
+        logger.info("Suscripción %s creada hasta %s", self.subscription_id, self.expires_at)
+        return True
+
+    async def renew(self) -> bool:
+        """Amplía la caducidad; si Graph ya no la conoce (404), crea otra."""
+        if self.subscription_id is None:
+            return await self.create()
+        resp = await get_client().request(
+            "PATCH", f"/subscriptions/{self.subscription_id}",
+            json={"expirationDateTime": self._expiration()},
+        )
+        if resp is not None and resp.status_code == 404:
+            logger.warning("Suscripción %s desaparecida, se crea otra", self.subscription_id)
+            self.subscription_id = None
+            return await self.create()
+        if resp is None or resp.status_code != 200:
+            logger.error("No se pudo renovar la suscripción: %s", resp and resp.status_code)
+            return False
+        self._store(resp.json())
+        logger.info("Suscripción %s renovada hasta %s", self.subscription_id, self.expires_at)
+        return True
+
+    async def delete(self):
+        if self.subscription_id is None:
+            return
+        await get_client().request("DELETE", f"/subscriptions/{self.subscription_id}")
+        self.subscription_id = self.expires_at = None
+
+    def seconds_until_renewal(self) -> float:
+        if self.expires_at is None:
+            return 0.0
+        remaining = (self.expires_at - datetime.now(timezone.utc)).total_seconds()
+        return max(0.0, remaining - self.renew_margin)
+
+    def request_renewal(self):
+        """Adelanta la próxima renovación de `run` (evento de ciclo de vida)."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _wait(self, seconds: float, renewal_requested: Callable[[], bool] | None):
+        # Duerme hasta `seconds`; despierta antes con request_renewal() o si
+        # `renewal_requested()` (aviso de otro proceso) devuelve True
+        deadline = time.monotonic() + seconds
+        while (left := deadline - time.monotonic()) > 0:
+            try:
+                await asyncio.wait_for(self._wake.wait(), min(left, NOTIFY_SIGNAL_CHECK))
+                return
+            except asyncio.TimeoutError:
+                pass
+            if renewal_requested is not None and await asyncio.to_thread(renewal_requested):
+                return
+
+    async def run(self, active: Callable[[], bool] = lambda: True,
+                  renewal_requested: Callable[[], bool] | None = None):
+        """
+        Crea la suscripción y la renueva antes de que caduque, indefinidamente,
+        mientras `active()` (con varios procesos, solo el titular del lease).
+        """
+        self._wake = asyncio.Event()
+        while True:
+            if not active():
+                await asyncio.sleep(NOTIFY_RETRY_DELAY)
+                continue
+            self._wake.clear()
+            ok = await self.renew() if self.subscription_id else await self.create()
+            await self._wait(self.seconds_until_renewal() if ok else NOTIFY_RETRY_DELAY, renewal_requested)
+
+
+# ------------------- notificaciones entrantes ------------------------------------------
+class Notifications:
+    """
+    Resultado de validar el cuerpo de un POST de Graph al webhook:
+    ids de mensajes nuevos y si algún evento de ciclo de vida pide resincronizar.
+    """
+
+    def __init__(self, message_ids: list[str], resync: bool, renew: bool):
+        self.message_ids, self.resync, self.renew = message_ids, resync, renew
+
+def parse_notifications(payload: dict, client_state: str = NOTIFY_CLIENT_STATE) -> Notifications:
+    """
+    Descarta lo que no trae nuestro clientState (no viene de nuestra suscripción).
+    `missed` → resincronizar por delta; `reauthorizationRequired` /
+    `subscriptionRemoved` → renovar o recrear la suscripción y resincronizar.
+    """
+    ids: list[str] = []
+    resync = renew = False
+    for n in payload.get("value", []):
+        # sin clientState configurado no se acepta nada
+        if not client_state or not hmac.compare_digest(str(n.get("clientState", "")), client_state):
+            NOTIFICATIONS.inc(kind="rejected")
+            logger.warning("Notificación con clientState inválido para %s", n.get("subscriptionId"))
+            continue
+        event = n.get("lifecycleEvent")
+        if event:
+            NOTIFICATIONS.inc(kind="lifecycle")
+            logger.info("Evento de ciclo de vida de Graph: %s", event)
+            resync = True
+            renew = renew or event in ("reauthorizationRequired", "subscriptionRemoved")
+            continue
+        msg_id = (n.get("resourceData") or {}).get("id")
+        if n.get("changeType") == "created" and msg_id:
+            NOTIFICATIONS.inc(kind="created")
+            ids.append(msg_id)
+    return Notifications(ids, resync, renew)
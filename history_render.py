@@ -0,0 +1,139 @@
+# history_render.py
+# Respuesta de historial construida en streaming: las filas (producto, día,
+# cambio) se agregan según llegan —por día o, en ventanas largas, por semana—,
+# el cuerpo se corta en HISTORIAL_MAX_BODY_CHARS y el detalle diario completo
+# va en un CSV comprimido adjunto. Nada depende del número de filas salvo el
+# adjunto, que se escribe a un fichero temporal y tiene su propio tope.
+
+import io
+import os
+import csv
+import gzip
+import tempfile
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Iterable, NamedTuple
+
+from email_io import Attachment
+
+HISTORIAL_WEEKLY_AFTER_DAYS   = int(os.getenv("HISTORIAL_WEEKLY_AFTER_DAYS", 31))
+HISTORIAL_MAX_BODY_CHARS      = int(os.getenv("HISTORIAL_MAX_BODY_CHARS", 16_000))
+HISTORIAL_MAX_ATTACHMENT_BYTES = int(os.getenv("HISTORIAL_MAX_ATTACHMENT_BYTES", 2 * 1024 * 1024))
+ATTACHMENT_NAME = "historial.csv.gz"
+
+
+class Rendered(NamedTuple):
+    body:       str
+    attachment: Attachment | None = None
+
+
+class _Body:
+    """Acumula líneas hasta el tope de caracteres; a partir de ahí solo las cuenta."""
+
+    def __init__(self, limit: int):
+        self._buf = io.StringIO()
+        self._room = limit
+        self.omitted = 0
+
+    def add(self, line: str):
+        if self.omitted or len(line) + 1 > self._room:
+            self.omitted += 1
+            return
+        self._buf.write(line + "\n")
+        self._room -= len(line) + 1
+
+    def text(self) -> str:
+        return self._buf.getvalue().rstrip("\n")
+
+
+class _Detail:
+    """CSV gzip del detalle diario en un fichero temporal; deja de crecer al pasar el tope."""
+
+    def __init__(self, limit: int):
+        self._file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        # nivel 6: casi el mismo tamaño que 9 en CSV y bastante más rápido
+        self._gz = gzip.GzipFile(fileobj=self._file, mode="wb", compresslevel=6)
+        self._text = io.TextIOWrapper(self._gz, encoding="utf-8", newline="")
+        self._csv = csv.writer(self._text)
+        self._csv.writerow(["product", "date", "change"])
+        self._limit = limit
+        self.overflow = False
+
+    def add(self, product: str | None, day: str, change: int):
+        if self.overflow:
+            return
+        self._csv.writerow([product or "", day, change])
+        if self._file.tell() > self._limit:
+            self.overflow = True
+
+    def close(self) -> bytes | None:
+        self._text.close()          # cierra también el gzip (vuelca el final)
+        data = None
+        if not self.overflow and self._file.tell() <= self._limit:
+            self._file.seek(0)
+            data = self._file.read()
+        self._file.close()
+        return data
+
+
+@lru_cache(maxsize=1024)
+def _week(day: str) -> str:
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+
+def render_historial(rows: Iterable[tuple], dias: int,
+                     max_chars: int = HISTORIAL_MAX_BODY_CHARS,
+                     max_attachment: int = HISTORIAL_MAX_ATTACHMENT_BYTES) -> Rendered:
+    """
+    `rows` son tuplas (producto | None, día, cambio) ordenadas por producto y día.
+    Ventanas de más de HISTORIAL_WEEKLY_AFTER_DAYS días se resumen por semana
+    (lunes). Si el cuerpo no muestra todo el detalle diario, se adjunta.
+    """
+    weekly = dias > HISTORIAL_WEEKLY_AFTER_DAYS
+    body = _Body(max_chars)
+    detail = _Detail(max_attachment)
+    indent = ""
+    current_product = bucket = None
+    total = 0
+    n = 0
+
+    def flush():
+        if bucket is not None:
+            label = f"semana del {bucket}" if weekly else bucket
+            body.add(f"{indent}• {label} → {total:+d}")
+
+    for product, day, change in rows:
+        n += 1
+        day = str(day)[:10]
+        detail.add(product, day, change)
+        if product != current_product:
+            flush()
+            bucket = None
+            current_product = product
+            if product is not None:
+                body.add(f"{product}:")
+                indent = "  "
+        key = _week(day) if weekly else day
+        if key != bucket:
+            flush()
+            bucket, total = key, 0
+        total += change
+    flush()
+    attachment = detail.close()
+
+    if n == 0:
+        return Rendered("No se encontraron datos para tu solicitud.")
+
+    title = "Historial de movimientos (por semana):" if weekly else "Historial de movimientos:"
+    lines = [title, body.text()]
+    if not (weekly or body.omitted):
+        return Rendered("\n".join(lines))
+
+    if body.omitted:
+        lines.append(f"… {body.omitted} líneas más no incluidas.")
+    if attachment is not None:
+        lines.append(f"Detalle diario completo ({n} filas) en el adjunto {ATTACHMENT_NAME}.")
+        return Rendered("\n".join(lines), Attachment(ATTACHMENT_NAME, "application/gzip", attachment))
+    lines.append("El detalle diario supera el tamaño máximo de adjunto; acota productos o días.")
+    return Rendered("\n".join(lines))
@@ -1,17 +1,39 @@
 import os
 import json
+import math
+import time
 import logging
 import asyncio
-import atexit
-import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field, ConfigDict
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
 
-from nl_to_sql import nl_to_sql_from_subject
-from db import execute_sql
-from email_io import fetch_new_emails, send_email
+from nl_to_sql import asql_for_request, parse_request, InventoryRequest, SqlQuery
+from db import run_query, stream_query, ensure_db
+from history_render import render_historial
+from processed_store import get_store
+from result_cache import cache as result_cache, ResultCache
+from pipeline import Pipeline, Stage
+import metrics
+import diagnostics
+from bulk_import import import_movements, import_products
+from movement_writer import get_movement_writer, close_movement_writer
+import forecast
+from auth import token_manager
+from email_io import (
+    fetch_new_emails, get_reply_queue, close_reply_queue, close_client, commit_sync_state,
+    pending_replies, get_client, fetch_email, reload_sync_state,
+)
+from work_queue import Lease, WorkQueue, Claimed, get_work_queue, raise_signal, take_signal
+from graph_notify import (
+    INGEST_MODE, NOTIFY_URL, NOTIFY_CLIENT_STATE, NOTIFY_FALLBACK_POLL_INTERVAL,
+    SubscriptionManager, parse_notifications,
+)
 
 # ------------------- logging y constantes --------------------------------------------
 logging.basicConfig(level=logging.INFO)
@@ -21,18 +43,17 @@ POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", 30))
 BACKOFF_BASE  = 2
 
 # ------------------- persistencia de IDs procesados ----------------------------------
-PROCESSED_FILE = "data/processed.json"
-os.makedirs(os.path.dirname(PROCESSED_FILE), exist_ok=True)
-processed_ids: set[str] = set()
-if os.path.exists(PROCESSED_FILE):
-    with open(PROCESSED_FILE, "r") as f:
-        processed_ids = set(json.load(f))
+COMPACT_INTERVAL = int(os.getenv("PROCESSED_COMPACT_INTERVAL", 3600))
 
-def _save_processed():
-    with open(PROCESSED_FILE, "w") as f:
-        json.dump(list(processed_ids), f)
+# ------------------- concurrencia del pipeline ---------------------------------------
+COMPILE_WORKERS     = int(os.getenv("PIPELINE_COMPILE_WORKERS", 4))
+QUERY_WORKERS       = int(os.getenv("PIPELINE_QUERY_WORKERS", 4))
+SEND_WORKERS        = int(os.getenv("PIPELINE_SEND_WORKERS", 20))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 100))
 
-atexit.register(_save_processed)
+# ------------------- procesamiento por lotes (/process-emails) -----------------------
+BULK_CONCURRENCY     = int(os.getenv("BULK_CONCURRENCY", 8))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", 64))
 
 # ------------------- FastAPI ----------------------------------------------------------
 app = FastAPI(
@@ -49,17 +70,24 @@ class EmailIn(BaseModel):
 
     model_config = ConfigDict(populate_by_name=True)
 
-# ------------------- helpers ----------------------------------------------------------
-def _extract_days(subject: str) -> int:
-    m = re.search(r"\d+", subject)
-    return int(m.group()) if m else 7
+MOVEMENTS_MAX_PER_REQUEST = int(os.getenv("MOVEMENTS_MAX_PER_REQUEST", 10_000))
+
+class MovementIn(BaseModel):
+    product: str = Field(..., min_length=1)
+    change:  int
+    date:    datetime | None = None     # None = ahora (UTC)
+
+class MovementsIn(BaseModel):
+    movements: list[MovementIn] = Field(..., min_length=1, max_length=MOVEMENTS_MAX_PER_REQUEST)
 
 # ------------------- formateo de respuesta -------------------------------------------
 def format_response(rows, dias: int) -> str:
     if not rows:
         return "No se encontraron datos para tu solicitud."
 
-    keys = set(rows[0])
+    # Filas de `run_query` (Row) o dicts: se accede a ambas por nombre de columna
+    rows = [getattr(r, "_mapping", r) for r in rows]
+    keys = set(rows[0]) - {"short_movement"}               # auxiliar de PROYECCIÓN
 
     if keys == {"quantity"}:                               # SALDO
         return f"Saldo disponible: {rows[0]['quantity']} unidades"
@@ -72,7 +100,7 @@ def format_response(rows, dias: int) -> str:
     if keys == {"current_stock", "net_movement"}:          # PROYECCIÓN
         r = rows[0]
         mov  = r["net_movement"]
-        left = round(r["current_stock"] / abs(mov / dias), 1) if mov < 0 else None
+        left = _days_left(r, dias)
         return "\n".join([
             f"Saldo actual: {r['current_stock']} unidades",
             f"Cambio neto en última semana: {mov:+d}",
@@ -81,33 +109,169 @@ def format_response(rows, dias: int) -> str:
             "Sin consumo neto, no se proyecta agotamiento."
         ])
 
+    if keys == {"product", "quantity"}:                    # SALDO (varios)
+        return _table("Saldo disponible:", ["Producto", "Unidades"],
+                      [(r["product"], r["quantity"]) for r in rows])
+
+    if keys == {"product", "change", "date"}:              # HISTORIAL (varios)
+        lines = ["Historial de movimientos:"]
+        current = None
+        for r in rows:
+            if r["product"] != current:
+                current = r["product"]
+                lines.append(f"{current}:")
+            lines.append(f"  • {r['date'][:10]} → {r['change']:+d}")
+        return "\n".join(lines)
+
+    if keys == {"product", "current_stock", "net_movement"}:   # PROYECCIÓN (varios)
+        table = []
+        for r in rows:
+            mov = r["net_movement"]
+            left = _days_left(r, dias)
+            table.append((r["product"], r["current_stock"], f"{mov:+d}", "—" if left is None else left))
+        return _table(f"Proyección ({dias} días):",
+                      ["Producto", "Saldo", "Neto", "Días hasta agotar"], table)
+
     # fallback
     return "\n".join(f"{k}: {v}" for k, v in rows[0].items())
 
-# ------------------- endpoint ---------------------------------------------------------
-@app.post("/process-email")
-def process_email(email: EmailIn):
-    try:
-        dias_req = _extract_days(email.subject)
+def _days_left(r, dias: int) -> float | None:
+    # la misma cuenta que stock_forecasts (forecast.days_to_stockout), con el
+    # stock y los movimientos en vivo; sin short_movement (SQL del LLM) solo la ventana
+    rate = -r["net_movement"] / dias
+    short = -r["short_movement"] / forecast.FORECAST_SHORT_WINDOW if "short_movement" in r else rate
+    left = float(forecast.days_to_stockout(r["current_stock"], rate, short))
+    return None if math.isnan(left) else round(left, 1)
+
+def _table(title: str, header: list[str], rows: list[tuple]) -> str:
+    """Tabla de texto alineada para respuestas con varios productos."""
+    cells = [header] + [[str(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+
+    def fmt(row):
+        return "  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip()
 
-        sql  = nl_to_sql_from_subject(email.subject)
-        logger.info("SQL generado: %s", sql)
+    lines = [title, fmt(cells[0]), fmt(["-" * w for w in widths])]
+    lines += [fmt(row) for row in cells[1:]]
+    return "\n".join(lines)
 
-        rows = execute_sql(sql)
-        logger.info("Filas devueltas: %s", rows)
+# ------------------- etapas del procesamiento ----------------------------------------
+@dataclass
+class InboxJob:
+    email:     EmailIn
+    dias:      int = 7
+    request:   InventoryRequest | None = None
+    cache_key: tuple | None = None
+    query:     SqlQuery | None = None
+    body:      str | None = None
+    attachments: tuple = ()
+    result:    dict | None = None
 
-        body_text = format_response(rows, dias_req)
+# SQLite es bloqueante: hilos propios, dimensionados como la etapa de consulta
+_sql_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="sqlite")
 
-        resp_subj = f"Re: {email.subject}"
-        send_email(email.sender, resp_subj, body_text)
+async def _stage_compile(job: InboxJob):
+    job.request = req = parse_request(job.email.subject, job.email.body)
+    job.dias = req.dias
+    job.cache_key = ResultCache.key(req.products, req.tipo, req.dias)
+    job.body = result_cache.get(job.cache_key)
+    if job.body is not None:
+        logger.debug("Respuesta desde cache: %s", job.cache_key)
+        return
+    job.query = await asql_for_request(req)
+    logger.debug("SQL generado (%s): %s %s", job.query.tipo, job.query.sql, job.query.params)
+
+# Historial: filas en streaming desde el cursor hasta el cuerpo y el adjunto
+_STREAMED = {"historial": False, "historial:multi": True}
+
+def _render_streamed(job: InboxJob):
+    rows = stream_query(job.query.name, job.query.params)
+    if not _STREAMED[job.query.name]:
+        rows = ((None, day, change) for change, day in rows)
+    return render_historial(rows, job.dias)
+
+async def _stage_query(job: InboxJob):
+    if job.body is not None:          # acierto de cache: no se toca SQLite
+        return
+    # antes de leer: si una escritura invalida estos productos durante la
+    # consulta, el resultado ya no se guarda
+    generation = result_cache.generation(job.request.products)
+    loop = asyncio.get_running_loop()
+    if job.query.name in _STREAMED:
+        rendered = await loop.run_in_executor(_sql_executor, _render_streamed, job)
+        job.body = rendered.body
+        if rendered.attachment is not None:
+            # los adjuntos no se cachean: pueden ocupar megas
+            job.attachments = (rendered.attachment,)
+            return
+    else:
+        rows = await loop.run_in_executor(_sql_executor, run_query, job.query.name, job.query.params)
+        logger.debug("Filas devueltas: %d", len(rows))
+        job.body = format_response(rows, job.dias)
+    result_cache.put(job.cache_key, job.body, products=job.request.products, generation=generation)
+
+async def _stage_send(job: InboxJob):
+    email = job.email
+    resp_subj = f"Re: {email.subject}"
+    sent = await get_reply_queue().send(email.sender, resp_subj, job.body, job.attachments)
+    if sent.ok:
         logger.info("Correo enviado a %s", email.sender)
+    else:
+        logger.error("No se pudo enviar a %s: %s %s", email.sender, sent.status, sent.error)
+
+    job.result = _job_result(job, "sent" if sent.ok else "send_failed")
+
+def _job_result(job: InboxJob, status: str) -> dict:
+    JOBS_TOTAL.inc(status=status)
+    result = {
+        "status":  status,
+        "to":      job.email.sender,
+        "subject": f"Re: {job.email.subject}",
+        "body":    job.body,
+    }
+    if job.attachments:
+        result["attachments"] = [a.name for a in job.attachments]
+    return result
 
-        return {
-            "status":  "sent",
-            "to":      email.sender,
-            "subject": resp_subj,
-            "body":    body_text,
-        }
+# ------------------- métricas ----------------------------------------------------------
+STAGE_SECONDS = metrics.histogram("inventario_stage_seconds", "Duración de cada etapa por correo")
+JOBS_TOTAL    = metrics.counter("inventario_jobs_total", "Correos procesados por resultado")
+POLL_SECONDS  = metrics.histogram("inventario_poll_cycle_seconds", "Duración de una vuelta de poll_inbox")
+POLL_LAG      = metrics.gauge("inventario_poll_lag_seconds",
+                              "Retraso del último despertar de poll_inbox respecto a lo previsto")
+
+def _timed_stage(name: str, handler, workers: int) -> Stage:
+    return Stage(name, metrics.timed(STAGE_SECONDS, stage=name)(handler), workers)
+
+STAGES = [
+    _timed_stage("compile", _stage_compile, COMPILE_WORKERS),
+    _timed_stage("query",   _stage_query,   QUERY_WORKERS),
+    _timed_stage("send",    _stage_send,    SEND_WORKERS),
+]
+pipeline = Pipeline(STAGES, queue_size=PIPELINE_QUEUE_SIZE)
+
+metrics.gauge("inventario_queue_depth", "Correos en cola por etapa del pipeline",
+              collect=pipeline.depths, label="stage")
+metrics.gauge("inventario_reply_queue_depth", "Respuestas pendientes de enviar en $batch",
+              collect=pending_replies)
+for _stat in ("size", "hits", "misses", "hit_rate", "evictions", "invalidations"):
+    metrics.gauge(f"inventario_result_cache_{_stat}", f"Cache de respuestas: {_stat}",
+                  collect=lambda stat=_stat: result_cache.stats()[stat])
+
+# ------------------- endpoints --------------------------------------------------------
+async def _run_job(job: InboxJob, send: bool = True) -> dict:
+    """Ejecuta las etapas en línea; con send=False se omite el envío (dry run)."""
+    for stage in STAGES:
+        if stage.name == "send" and not send:
+            job.result = _job_result(job, "dry_run")
+            break
+        await stage.handler(job)
+    return job.result
+
+@app.post("/process-email")
+async def process_email(email: EmailIn):
+    try:
+        return await _run_job(InboxJob(email))
 
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
@@ -115,38 +279,479 @@ def process_email(email: EmailIn):
         logger.exception("Error en process_email")
         raise HTTPException(status_code=500, detail="Error interno al procesar el correo")
 
-# ------------------- polling ---------------------------------------------------------
+def _read_payloads(raw: bytes, ndjson: bool):
+    """
+    Elementos del lote. En NDJSON se decodifica línea a línea y una línea
+    inválida se entrega como su excepción; un array JSON inválido lanza ValueError.
+    """
+    if not ndjson:
+        items = json.loads(raw or b"[]")
+        if not isinstance(items, list):
+            raise ValueError("Se esperaba un array JSON de correos")
+        return items
+
+    def lines():
+        for line in raw.splitlines():
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as exc:
+                    yield exc
+    return lines()
+
+async def _process_item(index: int, payload, send: bool) -> dict:
+    try:
+        if isinstance(payload, Exception):
+            raise payload
+        result = await _run_job(InboxJob(EmailIn.model_validate(payload)), send=send)
+        return {"index": index, **result}
+    except ValidationError as ve:
+        return {"index": index, "status": "error", "code": 422, "detail": str(ve)}
+    except ValueError as ve:
+        return {"index": index, "status": "error", "code": 400, "detail": str(ve)}
+    except Exception:
+        logger.exception("Error en process_emails (elemento %d)", index)
+        return {"index": index, "status": "error", "code": 500,
+                "detail": "Error interno al procesar el correo"}
+
+@app.post("/process-emails")
+async def process_emails(
+    request: Request,
+    concurrency: int = Query(BULK_CONCURRENCY, ge=1),
+    dry_run: bool = False,
+):
+    """
+    Procesa un lote de correos (array JSON o NDJSON con
+    Content-Type application/x-ndjson) con concurrencia acotada y devuelve
+    un resultado NDJSON por correo en cuanto termina (incluye su `index`).
+    Con `dry_run=true` no se envía ninguna respuesta.
+    """
+    concurrency = min(concurrency, BULK_MAX_CONCURRENCY)
+    raw = await request.body()
+    ndjson = "ndjson" in request.headers.get("content-type", "")
+    try:
+        payloads = _read_payloads(raw, ndjson)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    async def results():
+        done: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def worker(index, payload):
+            try:
+                await done.put(await _process_item(index, payload, send=not dry_run))
+            finally:
+                slots.release()
+
+        async def producer():
+            tasks = []
+            for index, payload in enumerate(payloads):
+                await slots.acquire()
+                tasks.append(asyncio.create_task(worker(index, payload)))
+            await asyncio.gather(*tasks)
+            await done.put(None)
+
+        feeder = asyncio.create_task(producer())
+        try:
+            while (item := await done.get()) is not None:
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            feeder.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+def get_metrics():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# ------------------- diagnóstico --------------------------------------------------------
+@app.middleware("http")
+async def _profile_request(request: Request, call_next):
+    """
+    Con la cabecera X-Profile, la petición se ejecuta bajo el perfilador por
+    muestreo. El muestreo acaba con el último trozo del cuerpo, no al empezar
+    la respuesta: así los StreamingResponse (/process-emails) quedan enteros.
+    """
+    if not request.headers.get("x-profile") or \
+            not diagnostics.authorized(request.headers.get("x-admin-token")):
+        return await call_next(request)
+    sampler = diagnostics.Sampler().start()
+    try:
+        response = await call_next(request)
+    except BaseException:
+        sampler.stop()
+        raise
+    profile_id = diagnostics.new_profile_id()
+    label = f"{request.method} {request.url.path}"
+    body = response.body_iterator
+
+    async def profiled_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            sampler.stop()
+            await asyncio.to_thread(diagnostics.save_profile, sampler.profile(label, profile_id))
+
+    response.body_iterator = profiled_body()
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+def _admin(request: Request):
+    if not diagnostics.authorized(request.headers.get("x-admin-token")):
+        raise HTTPException(status_code=403, detail="X-Admin-Token inválido")
+
+@app.get("/admin/profiles")
+def list_profiles(request: Request):
+    _admin(request)
+    return [p.summary() for p in reversed(diagnostics.profiles())]
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(request: Request, profile_id: str, format: str = Query("summary", pattern="^(summary|folded)$")):
+    """Resumen con las funciones más muestreadas, o las pilas plegadas para un flame graph."""
+    _admin(request)
+    profile = diagnostics.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Perfil desconocido: {profile_id}")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return {**profile.summary(), "top": profile.top()}
+
+@app.get("/admin/slow")
+def slow_log(request: Request):
+    """Últimas sentencias SQL y llamadas al LLM por encima de su umbral."""
+    _admin(request)
+    return {
+        "sql": {"threshold": diagnostics.SLOW_SQL_SECONDS, "entries": diagnostics.SLOW_SQL.entries()},
+        "llm": {"threshold": diagnostics.SLOW_LLM_SECONDS, "entries": diagnostics.SLOW_LLM.entries()},
+    }
+
+@app.delete("/admin/slow", status_code=204)
+def clear_slow_log(request: Request):
+    _admin(request)
+    diagnostics.SLOW_SQL.clear()
+    diagnostics.SLOW_LLM.clear()
+
+# ------------------- importación CSV --------------------------------------------------
+_IMPORTERS = {"movements": import_movements, "products": import_products}
+
+@app.post("/import/{kind}")
+async def import_csv(kind: str, request: Request, reconcile: bool = True):
+    """
+    Carga masiva desde CSV (ver bulk_import). El cuerpo se vuelca a un fichero
+    temporal según llega y se importa por bloques en un hilo aparte.
+    """
+    if kind not in _IMPORTERS:
+        raise HTTPException(status_code=404, detail=f"Importación desconocida: {kind}")
+    await asyncio.to_thread(ensure_db)
+    with tempfile.TemporaryFile() as tmp:
+        async for chunk in request.stream():
+            await asyncio.to_thread(tmp.write, chunk)
+        tmp.seek(0)
+        kwargs = {"reconcile": reconcile} if kind == "movements" else {}
+        try:
+            result = await asyncio.to_thread(_IMPORTERS[kind], tmp, **kwargs)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+    if kind == "movements":
+        # los movimientos cargados pueden ser de días pasados: la previsión cambia
+        await asyncio.to_thread(forecast.refresh_forecasts)
+    return {**result._asdict(), "rows_per_second": round(result.rows_per_second)}
+
+# ------------------- escritura de movimientos -----------------------------------------
+@app.post("/movements")
+async def post_movements(payload: MovementsIn):
+    """
+    Registra movimientos sueltos (p. ej. lecturas de almacén) y suma su cambio
+    a products.quantity. Responde tras el commit durable del grupo en que se
+    escribieron (ver movement_writer), con el stock resultante.
+    """
+    await asyncio.to_thread(ensure_db)
+    try:
+        result = await get_movement_writer().write(
+            (m.product.strip(), m.change, m.date) for m in payload.movements)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    return result._asdict()
+
+# ------------------- informes ----------------------------------------------------------
+@app.get("/reports/stockout")
+async def stockout_report(
+    window: int = Query(forecast.FORECAST_WINDOWS[0]),
+    horizon: float = Query(30, ge=0),
+    limit: int = Query(100, ge=1, le=10_000),
+):
+    """Productos que se agotan en `horizon` días según la última previsión (ver forecast)."""
+    if window not in forecast.FORECAST_WINDOWS:
+        raise HTTPException(status_code=400,
+                            detail=f"Ventana no calculada: {window} (disponibles: {list(forecast.FORECAST_WINDOWS)})")
+    await asyncio.to_thread(ensure_db)
+    rows = await asyncio.to_thread(forecast.stockout_report, window=window, horizon=horizon, limit=limit)
+    return {"window": window, "horizon": horizon, "products": rows}
+
+# ------------------- ingesta (polling, notificaciones y cola compartida) ------------------
+# Con varios procesos (uvicorn --workers N) solo el titular del lease "poller"
+# lee Graph; lo nuevo va a la cola work_items de inventory.db y todos los
+# procesos reclaman de ella, así cada correo se responde una sola vez.
+WORK_POLL_INTERVAL = float(os.getenv("WORK_POLL_INTERVAL", 1))
+WORK_MAX_INFLIGHT  = int(os.getenv("WORK_MAX_INFLIGHT", PIPELINE_QUEUE_SIZE))
+
+_lease: Lease | None = None
+_work_wake = asyncio.Event()
+_send_backoff = 0
+
+async def _enqueue(store, queue: WorkQueue, emails: list[dict]) -> int:
+    """Encola las consultas aún no procesadas; el resto se marca como procesado."""
+    fresh = []
+    for em in emails:
+        msg_id = em["id"]
+        if await asyncio.to_thread(store.is_processed, msg_id):
+            continue
+        subj = em.get("subject") or ""
+        if not subj.lower().startswith("consulta inventario:"):
+            logger.debug("Ignorado: %s", subj)
+            await asyncio.to_thread(store.mark_processed, msg_id)
+            continue
+        fresh.append(em)
+    added = await asyncio.to_thread(queue.enqueue, fresh)
+    if added:
+        _work_wake.set()
+    return added
+
+async def _track(store, msg_id: str, future: asyncio.Future) -> bool:
+    """Espera el resultado de un correo y lo confirma en el store. True si se respondió."""
+    try:
+        job = await future
+        ok = job.result["status"] == "sent"
+    except Exception:
+        logger.exception("Error procesando %s", msg_id)
+        ok = False
+    # Confirmación por mensaje: un reinicio no vuelve a responderlo
+    await asyncio.to_thread(store.mark_processed, msg_id)
+    return ok
+
+async def _handle_work(store, queue: WorkQueue, item: Claimed):
+    global _send_backoff
+    msg_id = item.message_id
+    try:
+        # ya respondido si el proceso anterior cayó entre enviar y confirmar
+        if not await asyncio.to_thread(store.is_processed, msg_id):
+            # submit espera si el pipeline está lleno (backpressure)
+            future = await pipeline.submit(InboxJob(EmailIn(**item.payload)))
+            ok = await _track(store, msg_id, future)
+            _send_backoff = 0 if ok else min(_send_backoff + 1, 5)
+        if not await asyncio.to_thread(queue.ack, msg_id):
+            logger.warning("%s se reasignó antes de confirmarlo", msg_id)
+    except Exception:
+        # sin ack: vuelve a la cola tras WORK_VISIBILITY_TIMEOUT
+        logger.exception("Error procesando el elemento %s (intento %d)", msg_id, item.attempts)
+    finally:
+        _work_wake.set()
+
+async def _wait_for_work(seconds: float):
+    try:
+        await asyncio.wait_for(_work_wake.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+    _work_wake.clear()
+
+async def consume_work():
+    """Reclama correos de la cola compartida y los pasa por el pipeline (en cada proceso)."""
+    store, queue = get_store(), get_work_queue()
+    running: set[asyncio.Task] = set()
+    try:
+        while True:
+            try:
+                if _send_backoff:
+                    await asyncio.sleep(BACKOFF_BASE**_send_backoff)
+                items = await asyncio.to_thread(queue.claim, WORK_MAX_INFLIGHT - len(running))
+                for item in items:
+                    task = asyncio.create_task(_handle_work(store, queue, item))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                if not items:
+                    await _wait_for_work(WORK_POLL_INTERVAL)
+            except Exception:
+                logger.exception("Fallo inesperado en consume_work")
+                await asyncio.sleep(WORK_POLL_INTERVAL)
+    finally:
+        for task in running:
+            task.cancel()
+
+# Una notificación 'missed' (o una suscripción perdida) adelanta el polling
+_poll_wake = asyncio.Event()
+
+def _poll_interval() -> int:
+    # Con notificaciones el polling solo recoge lo que se haya perdido
+    return NOTIFY_FALLBACK_POLL_INTERVAL if _subscriptions is not None else POLL_INTERVAL
+
+def _is_poller() -> bool:
+    return _lease is not None and _lease.held
+
+async def _sleep(seconds: float):
+    """
+    Espera `seconds` o hasta que se pida una resincronización, y registra
+    cuánto tarde despierta (event loop saturado).
+    """
+    start = time.monotonic()
+    # asyncio.wait y no wait_for: en 3.11 wait_for se traga la cancelación si
+    # el evento se activa a la vez (p. ej. una resincronización justo al parar)
+    wake = asyncio.ensure_future(_poll_wake.wait())
+    try:
+        done, _ = await asyncio.wait({wake}, timeout=seconds)
+    finally:
+        wake.cancel()
+    if done:
+        _poll_wake.clear()
+        return
+    POLL_LAG.set(max(0.0, time.monotonic() - start - seconds))
+
 async def poll_inbox():
-    backoff = 0
-    await asyncio.sleep(POLL_INTERVAL)
+    """Lee la bandeja y encola lo nuevo, solo mientras este proceso tenga el lease."""
+    store, queue = get_store(), get_work_queue()
+    last_compact = time.monotonic()
+    await _sleep(_poll_interval())
     while True:
+        cycle = time.perf_counter()
         try:
-            for em in fetch_new_emails():
-                msg_id = em.get("id") or em.get("from","") + em.get("subject","")
-                if msg_id in processed_ids:
-                    continue
-                processed_ids.add(msg_id)
+            if _is_poller():
+                await _enqueue(store, queue, await fetch_new_emails())
+                # Lo leído ya está en la cola persistente: se confirma el deltaLink
+                commit_sync_state()
 
-                subj = em.get("subject","")
-                if not subj.lower().startswith("consulta inventario:"):
-                    logger.debug("Ignorado: %s", subj)
-                    continue
+                if time.monotonic() - last_compact >= COMPACT_INTERVAL:
+                    await asyncio.to_thread(store.compact)
+                    await asyncio.to_thread(queue.compact)
+                    last_compact = time.monotonic()
+                POLL_SECONDS.observe(time.perf_counter() - cycle)
+            await _sleep(_poll_interval())
+        except Exception:
+            logger.exception("Fallo inesperado en poll_inbox")
+            await _sleep(_poll_interval())
 
-                try:
-                    process_email(EmailIn(**em))
-                    backoff = 0
-                except Exception:
-                    backoff = min(backoff + 1, 5)
-                    logger.exception("Error procesando %s", msg_id)
+# ------------------- notificaciones de cambio de Graph ---------------------------------
+_notified: asyncio.Queue[str] = asyncio.Queue()
+_subscriptions: SubscriptionManager | None = None
+_RENEW_SIGNAL = "subscription-renew"
+
+@app.post("/graph/notifications")
+async def graph_notifications(request: Request, validationToken: str | None = None):
+    """
+    Webhook de la suscripción de Graph. Al crearla, Graph lo valida con
+    `validationToken` y espera el mismo texto de vuelta; después envía aquí los
+    correos nuevos, que se encolan para procesarse fuera de la petición
+    (Graph exige respuesta en menos de 3 s).
+    """
+    if validationToken is not None:
+        return PlainTextResponse(validationToken)
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cuerpo JSON inválido")
+
+    batch = parse_notifications(payload, NOTIFY_CLIENT_STATE)
+    for msg_id in batch.message_ids:
+        _notified.put_nowait(msg_id)
+    if batch.renew and _subscriptions is not None:
+        # solo el titular del lease toca la suscripción; otro proceso se lo avisa por la base
+        if _is_poller():
+            _subscriptions.request_renewal()
+        else:
+            await asyncio.to_thread(raise_signal, _RENEW_SIGNAL)
+    if batch.resync:
+        _poll_wake.set()
+    return PlainTextResponse("", status_code=202)
 
-            await asyncio.sleep(BACKOFF_BASE**backoff if backoff else POLL_INTERVAL)
+async def consume_notifications():
+    """Lee cada correo notificado y lo encola en la cola compartida."""
+    store, queue = get_store(), get_work_queue()
+    while True:
+        msg_id = await _notified.get()
+        try:
+            if await asyncio.to_thread(queue.known, msg_id) or \
+                    await asyncio.to_thread(store.is_processed, msg_id):
+                continue
+            em = await fetch_email(msg_id)
+            if em is not None:
+                await _enqueue(store, queue, [em])
         except Exception:
-            logger.exception("Fallo inesperado en poll_inbox")
-            await asyncio.sleep(POLL_INTERVAL)
+            logger.exception("Error ingiriendo el correo notificado %s", msg_id)
+
+# ------------------- arranque ----------------------------------------------------------
+# El servidor acepta peticiones en cuanto arranca; base de datos y token de
+# Graph se preparan en segundo plano y /ready informa de su estado.
+_ready = {"db": False, "graph": False}
+_background: set[asyncio.Task] = set()
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+async def _warm_up():
+    await asyncio.to_thread(ensure_db)
+    await asyncio.to_thread(get_store().compact)
+    _ready["db"] = True
+
+    # Lease del poller: la primera toma es síncrona para saber ya si somos titulares
+    global _lease, _subscriptions
+    _lease = Lease("poller")
+    await asyncio.to_thread(_lease.acquire)
+    _spawn(_lease.run(on_acquired=reload_sync_state))
+    _spawn(forecast.run_refresher(active=_is_poller))
 
-@app.on_event("startup")
-def _startup():
     logger.info("🔑 Autenticando en Microsoft Graph…")
-    fetch_new_emails()
-    logger.info("✅ Autenticación lista. Polling cada %s s.", POLL_INTERVAL)
-    asyncio.create_task(poll_inbox())
+    # MSAL corre en un hilo: un Device Code Flow no bloquea al servidor
+    while not await get_client().authenticate():
+        logger.warning("Sin token de Graph; reintento en %s s", POLL_INTERVAL)
+        await asyncio.sleep(POLL_INTERVAL)
+    _ready["graph"] = True
+    _spawn(token_manager.run_refresher())
+    if INGEST_MODE == "notify" and NOTIFY_URL:
+        _subscriptions = SubscriptionManager(NOTIFY_URL, NOTIFY_CLIENT_STATE)
+        _spawn(_subscriptions.run(active=_is_poller,
+                                  renewal_requested=lambda: take_signal(_RENEW_SIGNAL)))
+        _spawn(consume_notifications())
+    elif INGEST_MODE == "notify":
+        logger.warning("INGEST_MODE=notify sin NOTIFY_URL: se sigue con polling")
+    logger.info("✅ Autenticación lista. Polling cada %s s (%s).", _poll_interval(),
+                "titular del lease" if _is_poller() else "en espera del lease")
+    _spawn(poll_inbox())
+    _spawn(consume_work())
+
+@app.get("/ready")
+def ready():
+    """200 cuando la base está migrada y hay token de Graph; 503 mientras tanto."""
+    body = {"ready": all(_ready.values()), **_ready}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.on_event("startup")
+async def _startup():
+    if INGEST_MODE == "notify" and NOTIFY_URL and not NOTIFY_CLIENT_STATE:
+        # un valor aleatorio por proceso haría descartar las notificaciones que
+        # lleguen a un proceso distinto del que creó la suscripción
+        raise RuntimeError("INGEST_MODE=notify requiere NOTIFY_CLIENT_STATE (el mismo en todos los procesos)")
+    global _poll_wake, _notified, _work_wake
+    # primitivas de asyncio ligadas al bucle de este arranque
+    _poll_wake, _notified, _work_wake = asyncio.Event(), asyncio.Queue(), asyncio.Event()
+    pipeline.start()
+    _spawn(_warm_up())
+
+@app.on_event("shutdown")
+async def _shutdown():
+    for task in list(_background):
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    global _subscriptions
+    if _subscriptions is not None:
+        await _subscriptions.delete()
+        _subscriptions = None
+    if _lease is not None:
+        # otro proceso toma el polling sin esperar a que caduque
+        await asyncio.to_thread(_lease.release)
+    await pipeline.stop()
+    await close_movement_writer()
+    await close_reply_queue()
+    await close_client()
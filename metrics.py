@@ -0,0 +1,201 @@
+# metrics.py
+# Métricas en proceso (contadores, histogramas y gauges) con salida en el
+# formato de texto de Prometheus, servidas en GET /metrics (ver main.py).
+# Sin dependencias: el volumen del servicio no justifica prometheus_client.
+
+import time
+import asyncio
+import threading
+import functools
+from typing import Callable
+
+# Buckets en segundos: de un SELECT en cache a un Device Code Flow
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(key: LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _fmt_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._lock = threading.Lock()
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # por etiquetas: [cuentas por bucket…, suma, total]
+        self._values: dict[LabelKey, list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def count(self, **labels) -> int:
+        data = self._values.get(_key(labels))
+        return int(data[-1]) if data else 0
+
+    def time(self, **labels) -> "timed":
+        return timed(self, **labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self._header()
+        for key, data in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, data):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, (('le', _fmt_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(key, (('le', '+Inf'),))} {int(data[-1])}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(data[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {int(data[-1])}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Valor instantáneo. Con `collect` el valor se lee al exportar: la función
+    devuelve un número o un dict {valor de la etiqueta `label`: número}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, collect: Callable | None = None, label: str | None = None):
+        super().__init__(name, help)
+        self._collect, self._label = collect, label
+        self._values: dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_key(labels)] = value
+
+    def render(self) -> list[str]:
+        if self._collect is None:
+            with self._lock:
+                items = sorted(self._values.items())
+        else:
+            data = self._collect()
+            if not isinstance(data, dict):
+                data = {(): data}
+            items = sorted(
+                (k if isinstance(k, tuple) else ((self._label, str(k)),), v) for k, v in data.items()
+            )
+        return self._header() + [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+
+# ------------------- registro -----------------------------------------------------------
+_REGISTRY: dict[str, _Metric] = {}
+
+def _register(metric: _Metric) -> _Metric:
+    # idempotente: volver a importar un módulo no duplica la métrica
+    return _REGISTRY.setdefault(metric.name, metric)
+
+def counter(name: str, help: str) -> Counter:
+    return _register(Counter(name, help))
+
+def histogram(name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, buckets))
+
+def gauge(name: str, help: str, collect: Callable | None = None, label: str | None = None) -> Gauge:
+    if collect is not None:
+        _REGISTRY.pop(name, None)       # el último colector registrado manda
+    return _register(Gauge(name, help, collect, label))
+
+def render() -> str:
+    """Todas las métricas en formato de exposición de texto de Prometheus 0.0.4."""
+    lines: list[str] = []
+    for metric in list(_REGISTRY.values()):
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ------------------- medición de tiempos ------------------------------------------------
+class timed:
+    """
+    Observa la duración en un histograma. Sirve como `with` y como decorador
+    de funciones síncronas o asíncronas:
+
+        @timed(SQL_SECONDS, query="adhoc")
+        def execute_sql(...): ...
+    """
+
+    def __init__(self, hist: Histogram, **labels):
+        self.hist, self.labels = hist, labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self._start, **self.labels)
+        return False
+
+    def __call__(self, fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timed(self.hist, **self.labels):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(self.hist, **self.labels):
+                return fn(*args, **kwargs)
+        return wrapper
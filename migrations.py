@@ -0,0 +1,98 @@
+# migrations.py
+# Migraciones versionadas del esquema SQLite. La versión aplicada se guarda en
+# `PRAGMA user_version`, así un inventory.db existente se actualiza en sitio.
+
+import logging
+from sqlalchemy import Engine
+
+logger = logging.getLogger(__name__)
+
+# Triggers que mantienen movement_daily al día con cada escritura en movements.
+# También se crean junto con la tabla movements (ver models.py).
+_ROLLUP_ADD = (
+    "INSERT INTO movement_daily (product_id, day, net_change, n_movements) "
+    "VALUES (NEW.product_id, date(NEW.date), NEW.change, 1) "
+    "ON CONFLICT (product_id, day) DO UPDATE SET "
+    "net_change = net_change + excluded.net_change, n_movements = n_movements + 1;"
+)
+_ROLLUP_SUB = (
+    "UPDATE movement_daily SET net_change = net_change - OLD.change, n_movements = n_movements - 1 "
+    "WHERE product_id = OLD.product_id AND day = date(OLD.date); "
+    "DELETE FROM movement_daily "
+    "WHERE product_id = OLD.product_id AND day = date(OLD.date) AND n_movements <= 0;"
+)
+# bulk_import lo desactiva durante las cargas masivas
+ROLLUP_INSERT_TRIGGER = "trg_movements_daily_ins"
+ROLLUP_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS {ROLLUP_INSERT_TRIGGER} AFTER INSERT ON movements "
+    f"WHEN NEW.date IS NOT NULL BEGIN {_ROLLUP_ADD} END",
+    "CREATE TRIGGER IF NOT EXISTS trg_movements_daily_del AFTER DELETE ON movements "
+    f"WHEN OLD.date IS NOT NULL BEGIN {_ROLLUP_SUB} END",
+    "CREATE TRIGGER IF NOT EXISTS trg_movements_daily_upd_old AFTER UPDATE OF product_id, change, date ON movements "
+    f"WHEN OLD.date IS NOT NULL BEGIN {_ROLLUP_SUB} END",
+    "CREATE TRIGGER IF NOT EXISTS trg_movements_daily_upd_new AFTER UPDATE OF product_id, change, date ON movements "
+    f"WHEN NEW.date IS NOT NULL BEGIN {_ROLLUP_ADD} END",
+]
+
+# (versión, descripción, sentencias). Las sentencias deben ser idempotentes:
+# una base recién creada ya trae el esquema actual desde los modelos.
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (1, "índice compuesto (product_id, date) cubriendo change en movements", [
+        "CREATE INDEX IF NOT EXISTS ix_movements_product_date "
+        "ON movements (product_id, date, change)",
+        "ANALYZE movements",
+    ]),
+    (2, "agregado diario movement_daily, triggers incrementales y backfill", [
+        "CREATE TABLE IF NOT EXISTS movement_daily ("
+        " product_id INTEGER NOT NULL REFERENCES products (id),"
+        " day VARCHAR(10) NOT NULL,"
+        " net_change INTEGER NOT NULL,"
+        " n_movements INTEGER NOT NULL,"
+        " PRIMARY KEY (product_id, day))",
+        *ROLLUP_TRIGGERS,
+        "DELETE FROM movement_daily",
+        "INSERT INTO movement_daily (product_id, day, net_change, n_movements) "
+        "SELECT product_id, date(date), SUM(change), COUNT(*) FROM movements "
+        "WHERE date IS NOT NULL GROUP BY product_id, date(date)",
+    ]),
+    (3, "elimina ix_movements_id, redundante con la clave primaria", [
+        "DROP INDEX IF EXISTS ix_movements_id",
+    ]),
+    (4, "tabla stock_forecasts e índice por día de movement_daily para la previsión", [
+        "CREATE TABLE IF NOT EXISTS stock_forecasts ("
+        " product_id INTEGER NOT NULL REFERENCES products (id),"
+        " window_days INTEGER NOT NULL,"
+        " as_of VARCHAR(10) NOT NULL,"
+        " current_stock INTEGER NOT NULL,"
+        " net_change INTEGER NOT NULL,"
+        " daily_rate FLOAT NOT NULL,"
+        " short_rate FLOAT NOT NULL,"
+        " days_to_stockout FLOAT,"
+        " PRIMARY KEY (product_id, window_days))",
+        "CREATE INDEX IF NOT EXISTS ix_stock_forecasts_window_stockout "
+        "ON stock_forecasts (window_days, days_to_stockout)",
+        "CREATE INDEX IF NOT EXISTS ix_movement_daily_day "
+        "ON movement_daily (day, product_id, net_change)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar_one()
+
+def migrate(engine: Engine) -> int:
+    """Aplica las migraciones pendientes, cada una en su transacción. Devuelve la versión final."""
+    version = current_version(engine)
+    for number, description, statements in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            for stmt in statements:
+                conn.exec_driver_sql(stmt)
+            conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+        logger.info("Migración %d aplicada: %s", number, description)
+        version = number
+    return version
@@ -1,18 +1,42 @@
 # models.py
+import os
 from sqlalchemy import (
-    create_engine, Column, Integer, String, DateTime, ForeignKey
+    create_engine, event, Engine, DDL, Column, Integer, String, DateTime, Float, ForeignKey, Index
 )
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from datetime import datetime
 
-# Ruta a tu SQLite local
-DATABASE_URL = "sqlite:///./data/inventory.db"
+from migrations import migrate, ROLLUP_TRIGGERS
+
+# Ruta a tu SQLite local (DATABASE_URL permite usar otra, p. ej. en tests o benchmarks)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/inventory.db")
+
+# Perfil de almacenamiento SQLite (se aplica a cada conexión nueva del pool)
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),       # lectores no bloquean al escritor
+    "synchronous":  os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),     # seguro con WAL, menos fsync
+    "cache_size":   int(os.getenv("SQLITE_CACHE_SIZE", -64000)),   # negativo = KiB (≈64 MB)
+    "mmap_size":    int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    "temp_store":   "MEMORY",
+    "foreign_keys": "ON",
+}
+
+def apply_storage_profile(engine: Engine, pragmas: dict = SQLITE_PRAGMAS) -> Engine:
+    """Registra los PRAGMA del perfil para que se ejecuten al abrir cada conexión."""
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return engine
 
 # Crea el motor y la sesión
-engine = create_engine(
+engine = apply_storage_profile(create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False}
-)
+))
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
@@ -34,7 +58,7 @@ class Product(Base):
 class Movement(Base):
     __tablename__ = "movements"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     change = Column(Integer, nullable=False)
     date = Column(DateTime, default=datetime.utcnow)
@@ -42,11 +66,102 @@ class Movement(Base):
     # Relación inversa
     product = relationship("Product", back_populates="movements")
 
+    # Índice compuesto que cubre historial/proyección sin leer la tabla
+    __table_args__ = (
+        Index("ix_movements_product_date", "product_id", "date", "change"),
+    )
+
+class MovementDaily(Base):
+    """
+    Agregado diario de movements por producto. Lo mantienen los triggers de
+    ROLLUP_TRIGGERS en cada INSERT/UPDATE/DELETE sobre movements.
+    """
+    __tablename__ = "movement_daily"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    day = Column(String(10), primary_key=True)          # 'YYYY-MM-DD'
+    net_change = Column(Integer, nullable=False)
+    n_movements = Column(Integer, nullable=False)
+
+    # Ventanas recientes de todo el catálogo (forecast.py) sin recorrer la tabla
+    __table_args__ = (
+        Index("ix_movement_daily_day", "day", "product_id", "net_change"),
+    )
+
+for _trigger in ROLLUP_TRIGGERS:
+    event.listen(Movement.__table__, "after_create", DDL(_trigger))
+
+class StockForecast(Base):
+    """
+    Previsión de agotamiento por producto y ventana (ver forecast.py). Se
+    recalcula entera en cada pasada; `net_change` cubre los `window_days` días
+    completos anteriores a `as_of` (el día en curso se suma en la consulta).
+    """
+    __tablename__ = "stock_forecasts"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    window_days = Column(Integer, primary_key=True)
+    as_of = Column(String(10), nullable=False)          # 'YYYY-MM-DD' (UTC)
+    current_stock = Column(Integer, nullable=False)     # stock al calcular
+    net_change = Column(Integer, nullable=False)
+    daily_rate = Column(Float, nullable=False)          # consumo medio/día en la ventana
+    short_rate = Column(Float, nullable=False)          # consumo medio/día reciente
+    days_to_stockout = Column(Float)                    # NULL: sin consumo neto
+
+    __table_args__ = (
+        Index("ix_stock_forecasts_window_stockout", "window_days", "days_to_stockout"),
+    )
+
+class ProcessedMessage(Base):
+    """Mensajes de Graph ya atendidos (clave: id del mensaje)."""
+    __tablename__ = "processed_messages"
+
+    message_id = Column(String, primary_key=True)
+    processed_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class ExtractCacheEntry(Base):
+    """Resultados de extract_query por texto normalizado (nivel en disco de su cache)."""
+    __tablename__ = "extract_cache"
+
+    key = Column(String(64), primary_key=True)          # sha256 del texto normalizado
+    result = Column(String, nullable=False)             # JSON {product, request_type, days}
+    used_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class WorkerLease(Base):
+    """Lease renovable entre procesos: solo su titular vigente hace el trabajo único (polling)."""
+    __tablename__ = "worker_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(Float, nullable=False)         # epoch (time.time())
+
+class WorkItem(Base):
+    """
+    Correo pendiente de responder, compartido por todos los procesos. Se
+    reclama y confirma de forma atómica (ver work_queue.py); `visible_at` es
+    cuándo puede reclamarse (de nuevo, si quien lo tenía no lo confirmó).
+    """
+    __tablename__ = "work_items"
+
+    message_id = Column(String, primary_key=True)
+    payload = Column(String, nullable=False)            # JSON {'id','from','subject','body'}
+    status = Column(String(10), nullable=False)         # pending | claimed | done
+    attempts = Column(Integer, nullable=False)
+    claimed_by = Column(String)
+    visible_at = Column(Float, nullable=False)          # epoch
+
+    __table_args__ = (
+        Index("ix_work_items_status_visible", "status", "visible_at"),
+    )
+
 def init_db():
     """
-    Crea las tablas 'products' y 'movements' si no existen.
+    Crea las tablas ('products', 'movements', 'movement_daily', 'stock_forecasts',
+    'processed_messages', 'extract_cache', 'worker_leases', 'work_items') si no existen
+    y aplica las migraciones de esquema pendientes.
     """
     Base.metadata.create_all(bind=engine)
+    migrate(engine)
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,250 @@
+# movement_writer.py
+# Escritura de movimientos sueltos (lecturas de almacén) con group commit:
+# las peticiones se acumulan hasta MOVEMENT_BATCH_ROWS movimientos o
+# MOVEMENT_BATCH_DELAY s y se escriben en una sola transacción BEGIN IMMEDIATE
+# que inserta los movimientos (los triggers mantienen movement_daily) y suma su
+# cambio neto a products.quantity. Mientras un grupo se confirma, el siguiente
+# se va llenando, así el coste del fsync se reparte entre todas las peticiones.
+# Cada `write()` responde solo tras el commit durable de su grupo. La previsión
+# (stock_forecasts) de los productos tocados se recalcula aparte, agrupada cada
+# MOVEMENT_FORECAST_DELAY s, sin retrasar el commit del grupo siguiente.
+
+import os
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterable, NamedTuple
+
+from sqlalchemy import Engine, select
+
+import metrics
+import forecast
+from models import engine as default_engine, Product, SQLITE_PRAGMAS
+from result_cache import cache as result_cache
+
+logger = logging.getLogger(__name__)
+
+MOVEMENT_BATCH_ROWS  = int(os.getenv("MOVEMENT_BATCH_ROWS", 5000))
+MOVEMENT_BATCH_DELAY = float(os.getenv("MOVEMENT_BATCH_DELAY", 0.005))
+# synchronous del commit de cada grupo: FULL hace fsync del WAL en cada commit
+MOVEMENT_SYNCHRONOUS = os.getenv("MOVEMENT_SYNCHRONOUS", "FULL")
+MOVEMENT_FORECAST_DELAY = float(os.getenv("MOVEMENT_FORECAST_DELAY", 1.0))
+
+_products = Product.__table__
+_INSERT_MOVEMENTS = "INSERT INTO movements (product_id, change, date) VALUES (?, ?, ?)"
+_ADD_STOCK = "UPDATE products SET quantity = quantity + ? WHERE id = ?"
+
+# ------------------- métricas ----------------------------------------------------------
+COMMIT_SECONDS = metrics.histogram(
+    "inventario_movement_commit_seconds", "Transacciones de group commit de movimientos")
+GROUP_ROWS = metrics.histogram(
+    "inventario_movement_group_rows", "Movimientos por transacción de group commit",
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 20000))
+WRITTEN = metrics.counter(
+    "inventario_movements_written_total", "Movimientos escritos por la API")
+
+
+class StockWrite(NamedTuple):
+    """Resultado de un `write()`."""
+    movements: int              # movimientos de esta petición
+    group:     int              # movimientos confirmados en la misma transacción
+    stock:     dict[str, int]   # cantidad de cada producto tocado tras el commit
+
+
+class _Pending:
+    __slots__ = ("values", "names", "future")
+
+    def __init__(self, values: list[tuple[int, int, str]], names: set[str], future: asyncio.Future):
+        self.values, self.names, self.future = values, names, future
+
+
+def _stamp(date: datetime) -> str:
+    # movements guarda UTC sin zona, con el formato de texto de DateTime en SQLite
+    if date.tzinfo:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date.isoformat(" ", "microseconds")
+
+
+class MovementWriter:
+    """
+    Cola de movimientos con un único escritor. Un grupo se confirma al
+    llegar a `max_rows` movimientos o cuando el más antiguo lleva
+    `max_delay` s esperando; una petición nunca se reparte entre grupos.
+    """
+
+    def __init__(self, engine: Engine = default_engine, max_rows: int = MOVEMENT_BATCH_ROWS,
+                 max_delay: float = MOVEMENT_BATCH_DELAY, synchronous: str = MOVEMENT_SYNCHRONOUS,
+                 forecast_delay: float = MOVEMENT_FORECAST_DELAY):
+        self.engine = engine
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.synchronous = synchronous
+        self.forecast_delay = forecast_delay
+        self._loop = asyncio.get_running_loop()
+        self._pending: deque[_Pending] = deque()
+        self._rows = 0
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._closed = False
+        self._ids: dict[str, int] = {}      # los productos no se borran: la cache no caduca
+        self._names: dict[int, str] = {}
+        self._stale: set[int] = set()       # productos con la previsión por recalcular
+        self._has_stale = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+        self._forecast_task = self._loop.create_task(self._refresh_forecasts())
+
+    def __len__(self):
+        return self._rows
+
+    async def write(self, movements: Iterable[tuple[str, int, datetime | None]]) -> StockWrite:
+        """
+        Movimientos (producto, cambio, fecha o None = ahora). Todos los productos
+        deben existir: si alguno no, ValueError y no se escribe ninguno.
+        """
+        if self._closed:
+            raise RuntimeError("MovementWriter cerrado")
+        rows = list(movements)
+        names = {name for name, _, _ in rows}
+        await self._resolve(names)
+        now = datetime.utcnow()
+        values = [(self._ids[name], change, _stamp(date or now)) for name, change, date in rows]
+        item = _Pending(values, names, self._loop.create_future())
+        self._pending.append(item)
+        self._rows += len(values)
+        self._has_items.set()
+        if self._rows >= self.max_rows:
+            self._full.set()
+        return await item.future
+
+    async def _resolve(self, names: set[str]):
+        missing = names - self._ids.keys()
+        if not missing:
+            return
+        found = await asyncio.to_thread(self._lookup, missing)
+        self._ids.update(found)
+        self._names.update((pid, name) for name, pid in found.items())
+        unknown = missing - found.keys()
+        if unknown:
+            raise ValueError(f"Productos desconocidos: {', '.join(sorted(unknown))}")
+
+    def _lookup(self, names: set[str]) -> dict[str, int]:
+        with self.engine.connect() as conn:
+            return dict(conn.execute(select(_products.c.name, _products.c.id)
+                                     .where(_products.c.name.in_(names))).all())
+
+    # ------------------- grupos --------------------------------------------------------
+    def _take(self) -> list[_Pending]:
+        batch, rows = [], 0
+        while self._pending and (not batch or rows + len(self._pending[0].values) <= self.max_rows):
+            item = self._pending.popleft()
+            batch.append(item)
+            rows += len(item.values)
+        self._rows -= rows
+        self._full.clear()
+        if self._rows >= self.max_rows:
+            self._full.set()
+        if not self._pending:
+            self._has_items.clear()
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if self._rows < self.max_rows and not self._closed:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._take()
+            if batch:
+                # secuencial: el grupo siguiente se llena mientras este se confirma
+                await self._flush(batch)
+            if self._closed and not self._pending:
+                return
+
+    async def _flush(self, batch: list[_Pending]):
+        try:
+            stock = await asyncio.to_thread(self._commit, batch)
+        except Exception as exc:
+            logger.exception("Error confirmando %d peticiones de movimientos", len(batch))
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(exc)
+            return
+        group = sum(len(item.values) for item in batch)
+        for item in batch:
+            if not item.future.done():
+                item.future.set_result(StockWrite(
+                    len(item.values), group, {name: stock[name] for name in sorted(item.names)}))
+        self._stale.update(self._ids[name] for name in stock)
+        self._has_stale.set()
+
+    def _commit(self, batch: list[_Pending]) -> dict[str, int]:
+        """Una transacción para todo el grupo; devuelve el stock resultante por producto."""
+        values = [v for item in batch for v in item.values]
+        net: dict[int, int] = {}
+        for pid, change, _ in values:
+            net[pid] = net.get(pid, 0) + change
+        with COMMIT_SECONDS.time(), self.engine.connect() as conn:
+            conn.exec_driver_sql(f"PRAGMA synchronous={self.synchronous}")
+            conn.commit()           # cierra el autobegin de SQLAlchemy (el PRAGMA no abre transacción)
+            try:
+                with conn.begin():
+                    conn.exec_driver_sql("BEGIN IMMEDIATE")
+                    conn.exec_driver_sql(_INSERT_MOVEMENTS, values)
+                    deltas = [(d, pid) for pid, d in net.items() if d]
+                    if deltas:
+                        conn.exec_driver_sql(_ADD_STOCK, deltas)
+                    stock = conn.execute(select(_products.c.id, _products.c.quantity)
+                                         .where(_products.c.id.in_(net))).all()
+            finally:
+                # la conexión vuelve al pool con el perfil normal
+                conn.exec_driver_sql(f"PRAGMA synchronous={SQLITE_PRAGMAS['synchronous']}")
+        GROUP_ROWS.observe(len(values))
+        WRITTEN.inc(len(values))
+        names = [self._names[pid] for pid in net]
+        result_cache.invalidate_products(names)
+        return {self._names[pid]: quantity for pid, quantity in stock}
+
+    # ------------------- previsión --------------------------------------------------------
+    async def _refresh_forecasts(self):
+        """Recalcula juntos los productos tocados en los últimos `forecast_delay` s."""
+        while True:
+            await self._has_stale.wait()
+            # espera a que se acumulen más grupos (o a que el escritor se cierre)
+            await asyncio.wait({self._task}, timeout=self.forecast_delay)
+            self._has_stale.clear()
+            product_ids, self._stale = sorted(self._stale), set()
+            if product_ids:
+                try:
+                    await asyncio.to_thread(forecast.refresh_forecasts, self.engine,
+                                            product_ids=product_ids)
+                except Exception:
+                    logger.exception("Error recalculando la previsión tras escribir movimientos")
+            if self._task.done() and not self._stale:
+                return
+
+    async def aclose(self):
+        """Confirma lo pendiente, recalcula su previsión y detiene el escritor."""
+        self._closed = True
+        self._has_items.set()
+        await self._task
+        self._has_stale.set()
+        await self._forecast_task
+
+
+_writer: MovementWriter | None = None
+
+def get_movement_writer() -> MovementWriter:
+    """Escritor compartido, ligado al event loop en curso."""
+    global _writer
+    if _writer is None or _writer._loop is not asyncio.get_running_loop():
+        _writer = MovementWriter()
+    return _writer
+
+async def close_movement_writer():
+    global _writer
+    if _writer is not None:
+        await _writer.aclose()
+        _writer = None
@@ -1,74 +1,377 @@
 """
 Convierte el asunto del correo en SQL.
 
-• saldo / historial → consultas fijas
-• proyección       → LLM devuelve current_stock y net_movement
+• saldo / historial / proyección → plantillas compiladas y parametrizadas
+• varios productos o comodines    → una sola consulta agrupada por tipo
+• otros tipos                    → LLM (una sola vez por (tipo, días), luego cache
+                                   LRU), validado y acotado por sql_guard
 """
 
+import os
 import re
-from langchain_openai import OpenAI
-from langchain.prompts import PromptTemplate
-from langchain.schema.runnable import RunnableSequence
+import json
+import asyncio
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import NamedTuple
 
-_PROMPT = PromptTemplate(
-    input_variables=["producto", "dias"],
-    template="""\
+import metrics
+from db import register_query, unregister_query, explain
+from sql_guard import Budget, UnsafeQuery, check_statement, check_plan
+from diagnostics import llm_call
+from forecast import FORECAST_SHORT_WINDOW
+
+# LangChain/OpenAI solo se importan al primer tipo sin plantilla (ver _chain)
+_PROMPT_TEMPLATE = """\
 Eres experto en SQLite. Tablas:
   products(id, name, quantity)
   movements(id, product_id, change, date)
+  movement_daily(product_id, day, net_change, n_movements)  -- suma diaria de movements, day='YYYY-MM-DD'
+  stock_forecasts(product_id, window_days, as_of, current_stock, net_change, daily_rate, short_rate, days_to_stockout)
 
-Devuelve SOLO la sentencia SQL terminada en ';' que obtenga:
-  current_stock , net_movement
-donde
-
-  current_stock = quantity actual del producto
-  net_movement  = SUM(change) últimos {dias} días (0 si no hay filas)
+Devuelve SOLO la sentencia SQL terminada en ';' que responda a una consulta
+de inventario de tipo "{tipo}" para un producto en los últimos {dias} días.
 
 REGLAS:
-1. Usa CTE o LEFT JOIN para que net_movement sea 0 cuando no existan movimientos.
-2. Orden de columnas: current_stock , net_movement
+1. El nombre del producto NO va literal: usa el parámetro :producto
+   (por ejemplo: WHERE name = :producto).
+2. Usa CTE o LEFT JOIN para que los agregados sean 0 cuando no existan movimientos.
 3. Sin comentarios ni columnas extra.
 
 Datos:
-- producto = "{producto}"
-- rango    = {dias} días
+- tipo  = "{tipo}"
+- rango = {dias} días
 """
+
+_CHAIN = None
+
+def _chain():
+    """Cadena prompt | OpenAI, creada en el primer uso."""
+    global _CHAIN
+    if _CHAIN is None:
+        from langchain_openai import OpenAI
+        from langchain.prompts import PromptTemplate
+        prompt = PromptTemplate(input_variables=["tipo", "dias"], template=_PROMPT_TEMPLATE)
+        _CHAIN = prompt | OpenAI(temperature=0)
+    return _CHAIN
+
+# ------------------- consulta compilada ----------------------------------------------
+class SqlQuery(NamedTuple):
+    """
+    Sentencia SQL con sus parámetros enlazados (:producto, :dias) y el nombre
+    con el que está registrada en `db` (ver `db.run_query`).
+    """
+    tipo:   str
+    sql:    str
+    params: dict
+    name:   str
+
+
+class InventoryRequest(NamedTuple):
+    """Consulta ya interpretada: productos (pueden llevar '*'), tipo y días."""
+    products: tuple[str, ...]
+    tipo:     str
+    dias:     int
+
+    @property
+    def is_multi(self) -> bool:
+        return len(self.products) > 1 or any("*" in p for p in self.products)
+
+
+# ------------------- registro de plantillas ------------------------------------------
+_ALLOWED_PARAMS = {"producto", "productos", "patrones", "dias"}
+_TEMPLATES: dict[str, str] = {}
+_MULTI_SUFFIX = ":multi"
+
+def register_template(tipo: str, sql: str, multi: bool = False) -> None:
+    """
+    Registra la plantilla SQL de un tipo de consulta, validándola antes:
+    una única sentencia SELECT/WITH completa y solo parámetros conocidos.
+    Las plantillas `multi` reciben :productos y :patrones como listas JSON.
+    """
+    if multi:
+        tipo += _MULTI_SUFFIX
+    sql = check_statement(sql, f"Plantilla {tipo}", _ALLOWED_PARAMS)
+    _TEMPLATES[tipo] = sql
+    register_query(tipo, sql)
+
+register_template("saldo", "SELECT quantity FROM products WHERE name = :producto;")
+
+# historial y proyección leen el agregado diario: como mucho una fila por día
+register_template("historial", (
+    "SELECT net_change AS change, day AS date "
+    "FROM movement_daily "
+    "WHERE product_id = (SELECT id FROM products WHERE name = :producto) "
+    "AND day >= date('now', '-' || :dias || ' days') "
+    "ORDER BY day;"
+))
+
+# Proyección: si forecast.py ya calculó hoy esa ventana, el neto es su suma de
+# días completos más la fila de hoy (búsquedas por clave); si no, agregado en vivo
+_NET_MOVEMENT = (
+    "CASE WHEN f.product_id IS NOT NULL THEN f.net_change + COALESCE("
+    "(SELECT t.net_change FROM movement_daily t WHERE t.product_id = p.id AND t.day = f.as_of), 0) "
+    "ELSE (SELECT COALESCE(SUM(d.net_change), 0) FROM movement_daily d "
+    "WHERE d.product_id = p.id AND d.day >= date('now', '-' || :dias || ' days')) "
+    "END AS net_movement "
+)
+# Consumo reciente (FORECAST_SHORT_WINDOW días más hoy): con él, la respuesta
+# calcula los días hasta agotar con forecast.days_to_stockout, como la previsión
+_SHORT_MOVEMENT = (
+    ", (SELECT COALESCE(SUM(s.net_change), 0) FROM movement_daily s "
+    f"WHERE s.product_id = p.id AND s.day >= date('now', '-{FORECAST_SHORT_WINDOW} days')) "
+    "AS short_movement "
+)
+_FORECAST_JOIN = (
+    "LEFT JOIN stock_forecasts f ON f.product_id = p.id "
+    "AND f.window_days = :dias AND f.as_of = date('now') "
+)
+
+register_template("proyección", (
+    "SELECT p.quantity AS current_stock, " + _NET_MOVEMENT + _SHORT_MOVEMENT +
+    "FROM products p " + _FORECAST_JOIN +
+    "WHERE p.name = :producto;"
+))
+
+# ------------------- plantillas para varios productos --------------------------------
+# :productos → nombres exactos; :patrones → patrones LIKE ('AB%'), ambos JSON.
+_SELECTED = (
+    "WITH sel AS ("
+    "SELECT id FROM products WHERE name IN (SELECT value FROM json_each(:productos)) "
+    "UNION "
+    "SELECT p.id FROM products p JOIN json_each(:patrones) j ON p.name LIKE j.value ESCAPE '\\'"
+    ") "
 )
 
-_CHAIN: RunnableSequence = _PROMPT | OpenAI(temperature=0)
+register_template("saldo", (
+    _SELECTED +
+    "SELECT p.name AS product, p.quantity "
+    "FROM sel JOIN products p ON p.id = sel.id "
+    "ORDER BY p.name;"
+), multi=True)
+
+register_template("historial", (
+    _SELECTED +
+    "SELECT p.name AS product, d.day AS date, d.net_change AS change "
+    "FROM sel JOIN products p ON p.id = sel.id "
+    "JOIN movement_daily d ON d.product_id = p.id "
+    "AND d.day >= date('now', '-' || :dias || ' days') "
+    "ORDER BY p.name, d.day;"
+), multi=True)
+
+register_template("proyección", (
+    _SELECTED +
+    "SELECT p.name AS product, p.quantity AS current_stock, " + _NET_MOVEMENT + _SHORT_MOVEMENT +
+    "FROM sel JOIN products p ON p.id = sel.id " + _FORECAST_JOIN +
+    "ORDER BY p.name;"
+), multi=True)
+
+# Alias sin tilde / abreviados que se aceptan en el asunto
+_ALIASES = {
+    "saldo":      "saldo",
+    "historial":  "historial",
+    "proyección": "proyección",
+    "proyeccion": "proyección",
+}
+
+def _resolve_tipo(tipo_raw: str) -> str:
+    # el tipo es texto libre y forma parte de la clave del SQL del LLM
+    tipo = " ".join(unicodedata.normalize("NFC", tipo_raw).split()).lower()
+    for alias, canonical in _ALIASES.items():
+        if alias in tipo:
+            return canonical
+    return tipo
+
+# ------------------- métricas ----------------------------------------------------------
+NL_TO_SQL_SECONDS = metrics.histogram(
+    "inventario_nl_to_sql_seconds", "Traducción de la consulta a SQL (source=template|multi|llm)")
+LLM_SECONDS = metrics.histogram("inventario_llm_seconds", "Llamadas reales al LLM (sin cache)")
 
-def _sql_saldo(prod: str) -> str:
-    return f"SELECT quantity FROM products WHERE name = '{prod}';"
+# ------------------- fallback LLM (cacheado por tipo y días) -------------------------
+# (tipo, días) es texto libre del asunto: la cache es LRU y, al desalojar, la
+# consulta registrada en db también se borra
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 256))
 
-def _sql_historial(prod: str, dias: int) -> str:
-    return (
-        "SELECT change, date "
-        "FROM movements "
-        f"WHERE product_id = (SELECT id FROM products WHERE name = '{prod}') "
-        f"AND date >= date('now', '-{dias} days');"
-    )
+_LLM_CACHE: OrderedDict[tuple[str, int], str] = OrderedDict()
+_llm_lock = threading.Lock()
+_llm_inflight: dict[tuple[str, int], Future] = {}
 
-def nl_to_sql_from_subject(subject: str) -> str:
+def _prompt_chars(tipo: str, dias: int) -> int:
+    return len(_PROMPT_TEMPLATE.format(tipo=tipo, dias=dias))
+
+def _llm_query_name(tipo: str, dias: int) -> str:
+    return f"llm:{tipo}:{dias}"
+
+def _clean_llm_sql(tipo: str, dias: int, result) -> str:
+    """
+    Lo generado pasa por sql_guard antes de registrarse: solo lectura, una
+    sentencia, parámetros conocidos y sin recorrer movements entera.
+    """
+    sql = next(iter(result.values())).strip() if isinstance(result, dict) else str(result).strip()
+    sql = sql if sql.endswith(";") else sql + ";"
+    if ":producto" not in sql:
+        raise ValueError(f"El LLM no generó una consulta parametrizada para '{tipo}'")
+    label = _llm_query_name(tipo, dias)
+    sql = check_statement(sql, label, {"producto", "dias"})
+    try:
+        plan = explain(sql, {"producto": "", "dias": dias})
+    except Exception as exc:
+        raise UnsafeQuery(f"'{label}' no es SQL válido para SQLite: {exc}") from None
+    check_plan(sql, plan, label)
+    return sql
+
+def _register_llm_sql(tipo: str, dias: int, result) -> str:
+    sql = _clean_llm_sql(tipo, dias, result)
+    # se ejecuta con presupuesto de tiempo y filas (ver db.run_query)
+    register_query(_llm_query_name(tipo, dias), sql, budget=Budget())
+    with _llm_lock:
+        _LLM_CACHE[(tipo, dias)] = sql
+        _LLM_CACHE.move_to_end((tipo, dias))
+        while len(_LLM_CACHE) > LLM_CACHE_SIZE:
+            old, _ = _LLM_CACHE.popitem(last=False)
+            unregister_query(_llm_query_name(*old))
+    return sql
+
+def _claim(key: tuple[str, int]) -> tuple[str | Future, bool]:
+    """
+    SQL ya generado, o el Future de quien lo está generando. Si nadie lo
+    está haciendo, devuelve uno nuevo y True: quien llama debe resolverlo
+    con _settle (así un mismo (tipo, días) solo llama al LLM una vez).
+    """
+    with _llm_lock:
+        if key in _LLM_CACHE:
+            _LLM_CACHE.move_to_end(key)
+            return _LLM_CACHE[key], False
+        if key in _llm_inflight:
+            return _llm_inflight[key], False
+        future = _llm_inflight[key] = Future()
+        return future, True
+
+def _settle(key: tuple[str, int], future: Future, sql: str | None = None, exc: BaseException | None = None):
+    # un fallo no se cachea: la siguiente petición vuelve a intentarlo
+    with _llm_lock:
+        _llm_inflight.pop(key, None)
+    if exc is None:
+        future.set_result(sql)
+    else:
+        future.set_exception(exc)
+
+def _sql_from_llm(tipo: str, dias: int) -> str:
+    key = (tipo, dias)
+    found, mine = _claim(key)
+    if isinstance(found, str):
+        return found
+    if not mine:
+        return found.result()
+    try:
+        with LLM_SECONDS.time(), llm_call(f"nl_to_sql:{tipo}", _prompt_chars(tipo, dias)):
+            result = _chain().invoke({"tipo": tipo, "dias": dias})
+        sql = _register_llm_sql(tipo, dias, result)
+    except BaseException as exc:
+        _settle(key, found, exc=exc)
+        raise
+    _settle(key, found, sql)
+    return sql
+
+async def _asql_from_llm(tipo: str, dias: int) -> str:
+    key = (tipo, dias)
+    found, mine = _claim(key)
+    if isinstance(found, str):
+        return found
+    if not mine:
+        return await asyncio.wrap_future(found)
+    try:
+        with LLM_SECONDS.time(), llm_call(f"nl_to_sql:{tipo}", _prompt_chars(tipo, dias)):
+            result = await _chain().ainvoke({"tipo": tipo, "dias": dias})
+        sql = await asyncio.to_thread(_register_llm_sql, tipo, dias, result)
+    except BaseException as exc:
+        _settle(key, found, exc=exc)
+        raise
+    _settle(key, found, sql)
+    return sql
+
+# ------------------- API ---------------------------------------------------------------
+_FORMAT = "Formato: 'Consulta inventario: <Producto>[, <Producto>…], <Tipo>, <n días>'"
+_BODY_PRODUCTS = re.compile(r"^\s*productos?\s*:\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+
+def _split_products(text: str) -> list[str]:
+    return [p.strip() for p in re.split(r"[,;]", text) if p.strip()]
+
+def parse_request(subject: str, body: str | None = None) -> InventoryRequest:
+    """
+    Interpreta 'Consulta inventario: <Producto>[, <Producto>…], <Tipo>, <n días>'.
+    Los dos últimos campos son tipo y días; lo anterior, productos (admiten '*'
+    como comodín, p. ej. 'AB*'). Una línea 'Productos: A, B, C' en el cuerpo
+    añade más productos a la lista.
+    """
     try:
         prefix, rest = subject.split(":", 1)
     except ValueError:
-        raise ValueError("Formato: 'Consulta inventario: <Producto>, <Tipo>, <n días>'")
+        raise ValueError(_FORMAT)
     if prefix.strip().lower() != "consulta inventario":
         raise ValueError("Debe empezar con 'Consulta inventario:'")
 
-    prod, tipo_raw, dias_raw = [p.strip() for p in rest.split(",")]
+    parts = [p.strip() for p in rest.split(",")]
+    if len(parts) < 3:
+        raise ValueError(_FORMAT)
+    *products, tipo_raw, dias_raw = parts
     m = re.search(r"\d+", dias_raw)
     if not m:
         raise ValueError("Número de días no encontrado")
-    dias = int(m.group())
 
-    tipo = tipo_raw.lower()
-    if "saldo" in tipo:
-        return _sql_saldo(prod)
-    if "historial" in tipo:
-        return _sql_historial(prod, dias)
+    products = [p for p in products if p]
+    for line in _BODY_PRODUCTS.findall(body or ""):
+        products += _split_products(line)
+    if not products:
+        raise ValueError(_FORMAT)
+    # sin duplicados, conservando el orden
+    return InventoryRequest(tuple(dict.fromkeys(products)), _resolve_tipo(tipo_raw), int(m.group()))
 
-    # proyección via LLM
-    result = _CHAIN.invoke({"producto": prod, "dias": dias})
-    sql = next(iter(result.values())).strip() if isinstance(result, dict) else str(result).strip()
-    return sql if sql.endswith(";") else sql + ";"
+def _like_pattern(product: str) -> str:
+    escaped = product.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%")
+
+def _multi_query(req: InventoryRequest) -> SqlQuery:
+    name = req.tipo + _MULTI_SUFFIX
+    if name not in _TEMPLATES:
+        raise ValueError(f"Las consultas de varios productos no admiten el tipo '{req.tipo}'")
+    params = {
+        "productos": json.dumps([p for p in req.products if "*" not in p]),
+        "patrones":  json.dumps([_like_pattern(p) for p in req.products if "*" in p]),
+        "dias":      req.dias,
+    }
+    return SqlQuery(req.tipo, _TEMPLATES[name], params, name)
+
+def _source(req: InventoryRequest) -> str:
+    return "multi" if req.is_multi else "template" if req.tipo in _TEMPLATES else "llm"
+
+def sql_for_request(req: InventoryRequest) -> SqlQuery:
+    source = _source(req)
+    with NL_TO_SQL_SECONDS.time(source=source):
+        if source == "multi":
+            return _multi_query(req)
+        params = {"producto": req.products[0], "dias": req.dias}
+
+        if source == "template":
+            return SqlQuery(req.tipo, _TEMPLATES[req.tipo], params, req.tipo)
+
+        # tipo no registrado → LLM, una sola vez por (tipo, días)
+        sql = _sql_from_llm(req.tipo, req.dias)
+        return SqlQuery(req.tipo, sql, params, _llm_query_name(req.tipo, req.dias))
+
+async def asql_for_request(req: InventoryRequest) -> SqlQuery:
+    """Variante asíncrona: el fallback LLM no ocupa un hilo mientras espera."""
+    if _source(req) != "llm":
+        return sql_for_request(req)
+    with NL_TO_SQL_SECONDS.time(source="llm"):
+        sql = await _asql_from_llm(req.tipo, req.dias)
+    params = {"producto": req.products[0], "dias": req.dias}
+    return SqlQuery(req.tipo, sql, params, _llm_query_name(req.tipo, req.dias))
+
+def nl_to_sql_from_subject(subject: str, body: str | None = None) -> SqlQuery:
+    return sql_for_request(parse_request(subject, body))
+
+async def anl_to_sql_from_subject(subject: str, body: str | None = None) -> SqlQuery:
+    return await asql_for_request(parse_request(subject, body))
@@ -0,0 +1,89 @@
+# pipeline.py
+# Pipeline por etapas con colas acotadas: cada etapa tiene su propio número de
+# workers y, cuando la cola siguiente se llena, la anterior espera (backpressure).
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class Stage(NamedTuple):
+    """Etapa del pipeline: `handler(job)` modifica el trabajo en sitio."""
+    name:    str
+    handler: Callable[[Any], Awaitable[None]]
+    workers: int = 1
+
+
+class Pipeline:
+    """
+    Encadena etapas mediante `asyncio.Queue(maxsize=queue_size)`. `submit()`
+    devuelve un future que se resuelve con el trabajo al salir de la última
+    etapa, o con la excepción de la etapa que falló.
+    """
+
+    def __init__(self, stages: list[Stage], queue_size: int = 100):
+        if not stages:
+            raise ValueError("El pipeline necesita al menos una etapa")
+        self.stages = stages
+        self.queue_size = queue_size
+        self._queues: list[asyncio.Queue] = []
+        self._workers: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        if self.running:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for i, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                task = asyncio.create_task(self._worker(i), name=f"{stage.name}-{n}")
+                self._workers.append(task)
+
+    async def submit(self, job) -> asyncio.Future:
+        """Encola un trabajo; espera si la primera etapa está llena."""
+        if not self.running:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[0].put((job, future))
+        return future
+
+    def depths(self) -> dict[str, int]:
+        """Trabajos esperando en la cola de cada etapa (0 si aún no arrancó)."""
+        if not self._queues:
+            return {stage.name: 0 for stage in self.stages}
+        return {stage.name: q.qsize() for stage, q in zip(self.stages, self._queues)}
+
+    async def join(self):
+        for q in self._queues:
+            await q.join()
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self, index: int):
+        stage, queue = self.stages[index], self._queues[index]
+        is_last = index == len(self.stages) - 1
+        while True:
+            job, future = await queue.get()
+            try:
+                await stage.handler(job)
+            except Exception as exc:
+                logger.debug("Etapa %s falló: %s", stage.name, exc)
+                if not future.done():
+                    future.set_exception(exc)
+            else:
+                if is_last:
+                    if not future.done():
+                        future.set_result(job)
+                else:
+                    await self._queues[index + 1].put((job, future))
+            finally:
+                queue.task_done()
@@ -0,0 +1,81 @@
+# processed_store.py
+# Registro persistente de mensajes ya procesados (deduplicación del polling).
+# Vive en una tabla de inventory.db: cada mensaje se confirma al momento,
+# las búsquedas van por clave primaria y la tabla se compacta por TTL y tamaño.
+
+import os
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import Engine, delete, select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import engine as default_engine, ProcessedMessage
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_TTL_DAYS = int(os.getenv("PROCESSED_TTL_DAYS", 30))
+PROCESSED_MAX_ROWS = int(os.getenv("PROCESSED_MAX_ROWS", 100_000))
+
+_table = ProcessedMessage.__table__
+
+
+class ProcessedStore:
+    def __init__(self, engine: Engine = default_engine,
+                 ttl_days: int = PROCESSED_TTL_DAYS, max_rows: int = PROCESSED_MAX_ROWS):
+        self.engine = engine
+        self.ttl = timedelta(days=ttl_days)
+        self.max_rows = max_rows
+        _table.create(engine, checkfirst=True)
+
+    def is_processed(self, message_id: str) -> bool:
+        with self.engine.connect() as conn:
+            stmt = select(_table.c.message_id).where(_table.c.message_id == message_id)
+            return conn.execute(stmt).first() is not None
+
+    def mark_processed(self, message_id: str, when: datetime | None = None) -> bool:
+        """
+        Registra el mensaje en su propia transacción. Devuelve False si ya
+        estaba registrado.
+        """
+        stmt = sqlite_insert(_table).values(
+            message_id=message_id, processed_at=when or datetime.utcnow(),
+        ).on_conflict_do_nothing(index_elements=[_table.c.message_id])
+        with self.engine.begin() as conn:
+            return conn.execute(stmt).rowcount == 1
+
+    def compact(self, now: datetime | None = None) -> int:
+        """
+        Borra los registros más antiguos que el TTL y, si aún se supera
+        `max_rows`, los más antiguos hasta quedar en el límite.
+        Devuelve cuántas filas se eliminaron.
+        """
+        cutoff = (now or datetime.utcnow()) - self.ttl
+        with self.engine.begin() as conn:
+            removed = conn.execute(delete(_table).where(_table.c.processed_at < cutoff)).rowcount
+            total = conn.execute(select(func.count()).select_from(_table)).scalar_one()
+            if total > self.max_rows:
+                oldest = (
+                    select(_table.c.message_id)
+                    .order_by(_table.c.processed_at)
+                    .limit(total - self.max_rows)
+                )
+                removed += conn.execute(
+                    delete(_table).where(_table.c.message_id.in_(oldest))
+                ).rowcount
+        if removed:
+            logger.info("Compactados %d mensajes procesados", removed)
+        return removed
+
+    def __len__(self):
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(_table)).scalar_one()
+
+
+_store: ProcessedStore | None = None
+
+def get_store() -> ProcessedStore:
+    global _store
+    if _store is None:
+        _store = ProcessedStore()
+    return _store
@@ -0,0 +1,179 @@
+# result_cache.py
+# Cache en proceso de respuestas de inventario, por (producto, tipo, días).
+# Expulsión LRU + TTL e invalidación por producto cuando se confirma una
+# escritura de movements/products que lo afecta. Cada invalidación sube la
+# generación del producto: una lectura que empezó antes no vuelve a guardar
+# datos viejos (ver generation/put). La cache es por proceso: con varios
+# workers, una escritura solo invalida la del proceso que la hizo.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import Product, Movement
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_TTL  = float(os.getenv("RESULT_CACHE_TTL", 300))
+
+CacheKey = tuple[str, str, int]
+
+
+class ResultCache:
+    """
+    Cada entrada se indexa por los productos que abarca. Las que usan comodines
+    se indexan bajo "*" y cualquier escritura las invalida.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data: OrderedDict[CacheKey, tuple[float, object, tuple[str, ...]]] = OrderedDict()
+        self._by_product: dict[str, set[CacheKey]] = {}
+        # generación por producto y global (la de las entradas con comodín)
+        self._generations: dict[str, int] = {}
+        self._writes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @staticmethod
+    def _norm(product: str) -> str:
+        # las consultas comparan el nombre exacto (name = :producto); solo los
+        # comodines van por LIKE, que no distingue mayúsculas
+        product = product.strip()
+        return product.lower() if "*" in product else product
+
+    @classmethod
+    def key(cls, product: str | tuple[str, ...], tipo: str, dias: int) -> CacheKey:
+        if not isinstance(product, str):
+            product = ",".join(sorted({cls._norm(p) for p in product}))
+        return (cls._norm(product), tipo.strip().lower(), int(dias))
+
+    def get(self, key: CacheKey):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _index(self, products: tuple[str, ...]) -> tuple[str, ...]:
+        return tuple("*" if "*" in p else self._norm(p) for p in products)
+
+    def _generation(self, index: tuple[str, ...]) -> tuple[int, ...]:
+        # con el lock tomado
+        return tuple(self._writes if name == "*" else self._generations.get(name, 0) for name in index)
+
+    def generation(self, products: tuple[str, ...]) -> tuple[int, ...]:
+        """Se toma antes de leer la base y se pasa a `put` con el resultado."""
+        index = self._index(products)
+        with self._lock:
+            return self._generation(index)
+
+    def put(self, key: CacheKey, value, products: tuple[str, ...] | None = None,
+            generation: tuple[int, ...] | None = None):
+        """
+        Guarda `value`; `products` son los productos que abarca (por defecto, el
+        de la clave). Con `generation` (de `generation(products)`), no guarda
+        nada si alguno se invalidó mientras tanto: el valor puede ser anterior.
+        """
+        index = self._index(products or (key[0],))
+        with self._lock:
+            if generation is not None and generation != self._generation(index):
+                return
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (self._clock() + self.ttl, value, index)
+            for name in index:
+                self._by_product.setdefault(name, set()).add(key)
+            while len(self._data) > self.max_entries:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate_product(self, product: str) -> int:
+        """Elimina las respuestas cacheadas que incluyen el producto (y las de comodín)."""
+        with self._lock:
+            name = self._norm(product)
+            self._generations[name] = self._generations.get(name, 0) + 1
+            self._writes += 1
+            keys = self._by_product.get(name, set()) | self._by_product.get("*", set())
+            for key in keys:
+                self._drop(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def invalidate_products(self, products) -> int:
+        return sum(self.invalidate_product(p) for p in products)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_product.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size":          len(self._data),
+                "hits":          self.hits,
+                "misses":        self.misses,
+                "hit_rate":      self.hits / total if total else 0.0,
+                "evictions":     self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _drop(self, key: CacheKey):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for name in entry[2]:
+            keys = self._by_product.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_product[name]
+
+
+cache = ResultCache()
+
+# ------------------- invalidación por escrituras ORM ---------------------------------
+# Se anotan los productos tocados en cada flush y se invalidan al confirmar,
+# así ninguna lectura concurrente vuelve a cachear datos aún sin commit.
+_DIRTY_KEY = "result_cache_dirty"
+
+@event.listens_for(Session, "after_flush")
+def _collect_dirty_products(session: Session, _ctx):
+    names: set[str] = session.info.setdefault(_DIRTY_KEY, set())
+    product_ids: set[int] = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Product):
+            names.add(obj.name)
+        elif isinstance(obj, Movement):
+            product_ids.add(obj.product_id)
+    if product_ids:
+        rows = session.connection().execute(
+            select(Product.name).where(Product.id.in_(product_ids))
+        )
+        names.update(name for (name,) in rows)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session):
+    names = session.info.pop(_DIRTY_KEY, None)
+    if names:
+        cache.invalidate_products(names)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session: Session):
+    session.info.pop(_DIRTY_KEY, None)
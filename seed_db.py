@@ -1,42 +1,27 @@
 # seed_db.py
 import os
 import random
+import argparse
 from datetime import datetime, timedelta
 
-from sqlalchemy import (
-    create_engine, Column, Integer, String, DateTime, ForeignKey
-)
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import insert
 
 # Carpeta y fichero
 os.makedirs("data", exist_ok=True)
-DATABASE_URL = "sqlite:///data/inventory.db"
 
-# Base y engine
-Base = declarative_base()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-Session = sessionmaker(bind=engine)
+# Mismos modelos, motor y perfil SQLite que la aplicación
+from models import Base, engine, SessionLocal as Session, Product, Movement, MovementDaily, StockForecast, init_db
 
-class Product(Base):
-    __tablename__ = "products"
-    id = Column(Integer, primary_key=True)
-    name = Column(String, unique=True, nullable=False)
-    quantity = Column(Integer, nullable=False)
-    movements = relationship("Movement", back_populates="product")
+# Tablas de inventario que el seed reinicia (el resto del esquema se conserva)
+SEED_TABLES = [StockForecast.__table__, MovementDaily.__table__, Movement.__table__, Product.__table__]
 
-class Movement(Base):
-    __tablename__ = "movements"
-    id = Column(Integer, primary_key=True)
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
-    change = Column(Integer, nullable=False)
-    date = Column(DateTime, default=datetime.utcnow)
-    product = relationship("Product", back_populates="movements")
+def _reset():
+    Base.metadata.drop_all(engine, tables=SEED_TABLES)
+    init_db()
 
 def seed():
     # Reinicia
-    Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
+    _reset()
     session = Session()
 
     # 1) Definimos 5 productos de ejemplo con stock inicial
@@ -64,5 +49,44 @@ def seed():
     session.close()
     print("✔ Base de datos seed creada en data/inventory.db con 5 productos y 30 días de movimientos.")
 
+def seed_synthetic(n_products: int = 1_000, n_movements: int = 1_000_000, days: int = 365,
+                   chunk_size: int = 50_000, rng_seed: int = 42):
+    """
+    Base sintética para benchmarks: `n_products` productos SKU000000… y
+    `n_movements` movimientos repartidos al azar en los últimos `days` días.
+    Inserta por lotes con executemany de Core (sin objetos ORM).
+    """
+    rng = random.Random(rng_seed)
+    _reset()
+    with engine.begin() as conn:
+        conn.execute(insert(Product.__table__), [
+            {"id": i + 1, "name": f"SKU{i:06d}", "quantity": rng.randint(0, 5_000)}
+            for i in range(n_products)
+        ])
+
+    now = datetime.utcnow()
+    window = days * 86_400
+    changes = [-10, -5, -2, -1, 1, 2, 5, 10]
+    for start in range(0, n_movements, chunk_size):
+        rows = [
+            {
+                "product_id": rng.randint(1, n_products),
+                "change":     rng.choice(changes),
+                "date":       now - timedelta(seconds=rng.randrange(window)),
+            }
+            for _ in range(min(chunk_size, n_movements - start))
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert(Movement.__table__), rows)
+    print(f"✔ Base sintética: {n_products} productos y {n_movements} movimientos en {days} días.")
+
 if __name__ == "__main__":
-    seed()
+    parser = argparse.ArgumentParser(description="Genera la base SQLite de ejemplo")
+    parser.add_argument("--products", type=int, help="base sintética con N productos")
+    parser.add_argument("--movements", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+    if args.products:
+        seed_synthetic(args.products, args.movements, args.days)
+    else:
+        seed()
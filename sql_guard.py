@@ -0,0 +1,138 @@
+# sql_guard.py
+# Barreras para el SQL que no escribió una persona (fallback LLM de nl_to_sql):
+#
+# 1. Antes de registrarlo: una única sentencia SELECT/WITH con parámetros
+#    conocidos, y su EXPLAIN QUERY PLAN sin recorridos completos (SCAN) de las
+#    tablas grandes (GUARD_NO_SCAN_TABLES, por defecto movements).
+# 2. Al ejecutarlo (db.run_query con presupuesto): autorizador de SQLite que
+#    solo deja leer, y progress handler que interrumpe la consulta al pasar
+#    GUARD_MAX_SECONDS; más de GUARD_MAX_ROWS filas también se rechaza.
+
+import os
+import re
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from typing import Iterable, NamedTuple
+
+from sqlalchemy import text
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+GUARD_MAX_SECONDS    = float(os.getenv("GUARD_MAX_SECONDS", 2.0))
+GUARD_MAX_ROWS       = int(os.getenv("GUARD_MAX_ROWS", 10_000))
+GUARD_PROGRESS_STEPS = int(os.getenv("GUARD_PROGRESS_STEPS", 10_000))   # instrucciones de la VM
+GUARD_NO_SCAN_TABLES = tuple(
+    t.strip().lower() for t in os.getenv("GUARD_NO_SCAN_TABLES", "movements").split(",") if t.strip())
+
+REJECTED = metrics.counter(
+    "inventario_sql_guard_rejected_total", "Consultas rechazadas por el guardián (reason=statement|plan|time|rows|write)")
+
+
+class UnsafeQuery(ValueError):
+    """La sentencia no es de solo lectura o su plan recorre una tabla grande entera."""
+
+class QueryBudgetExceeded(ValueError):
+    """La consulta superó su presupuesto de tiempo o de filas y se canceló."""
+
+
+class Budget(NamedTuple):
+    seconds: float = GUARD_MAX_SECONDS
+    rows:    int = GUARD_MAX_ROWS
+
+
+def _reject(reason: str, exc: type[ValueError], message: str):
+    REJECTED.inc(reason=reason)
+    logger.warning("SQL rechazado (%s): %s", reason, message)
+    raise exc(message)
+
+# ------------------- comprobación estática ----------------------------------------------
+def check_statement(sql: str, label: str, allowed_params: Iterable[str]) -> str:
+    """
+    Una única sentencia SELECT/WITH completa, terminada en ';', que solo usa
+    parámetros de `allowed_params`. Devuelve la sentencia sin espacios extremos.
+    """
+    sql = sql.strip()
+    if not sql.upper().startswith(("SELECT", "WITH")):
+        _reject("statement", UnsafeQuery, f"'{label}' debe ser SELECT o WITH")
+    if not sqlite3.complete_statement(sql) or sql.rstrip(";").count(";"):
+        _reject("statement", UnsafeQuery, f"'{label}' debe ser una única sentencia terminada en ';'")
+    # los mismos parámetros que enlazará db.register_query (text()), que no
+    # confunde '12:30' dentro de un literal con un parámetro
+    unknown = set(text(sql).compile().params) - set(allowed_params)
+    if unknown:
+        _reject("statement", UnsafeQuery, f"'{label}' usa parámetros desconocidos: {sorted(unknown)}")
+    return sql
+
+# Palabras que pueden seguir al nombre de una tabla y no son un alias
+_NOT_ALIAS = {
+    "where", "join", "left", "right", "inner", "outer", "cross", "natural", "on", "using",
+    "group", "order", "limit", "union", "except", "intersect", "window", "having", "as", "indexed", "not",
+}
+
+def _scan_names(sql: str, tables: tuple[str, ...]) -> set[str]:
+    """Nombres con los que el plan puede citar cada tabla vigilada: la tabla y sus alias."""
+    names = set(tables)
+    for table in tables:
+        for m in re.finditer(rf"\b{re.escape(table)}\b\s+(?:as\s+)?(\w+)", sql, re.IGNORECASE):
+            if m.group(1).lower() not in _NOT_ALIAS:
+                names.add(m.group(1).lower())
+    return names
+
+def check_plan(sql: str, plan: list[str], label: str, tables: tuple[str, ...] = GUARD_NO_SCAN_TABLES):
+    """Rechaza planes con 'SCAN <tabla o alias>' sobre las tablas vigiladas (con o sin índice)."""
+    names = _scan_names(sql, tables)
+    for step in plan:
+        m = re.match(r"SCAN (\w+)", step.strip())
+        if m and m.group(1).lower() in names:
+            _reject("plan", UnsafeQuery, f"'{label}' recorre la tabla entera: {step.strip()}")
+
+# ------------------- ejecución con presupuesto -----------------------------------------
+_READ_ONLY = {
+    sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE,
+}
+
+@contextmanager
+def guarded(dbapi_conn: sqlite3.Connection, budget: Budget, label: str):
+    """
+    Mientras dura el bloque, la conexión solo puede leer y cualquier
+    sentencia se interrumpe al pasar `budget.seconds`. Los errores de esas
+    dos barreras salen como UnsafeQuery / QueryBudgetExceeded.
+    """
+    deadline = time.perf_counter() + budget.seconds
+    state = {"expired": False, "denied": None}
+
+    def progress():
+        if time.perf_counter() > deadline:
+            state["expired"] = True
+            return 1            # != 0: SQLite interrumpe la sentencia
+        return 0
+
+    def authorize(action, arg1, arg2, db_name, trigger):
+        if action in _READ_ONLY:
+            return sqlite3.SQLITE_OK
+        state["denied"] = action
+        return sqlite3.SQLITE_DENY
+
+    dbapi_conn.set_authorizer(authorize)
+    dbapi_conn.set_progress_handler(progress, GUARD_PROGRESS_STEPS)
+    try:
+        yield
+    except Exception:
+        if state["expired"]:
+            _reject("time", QueryBudgetExceeded, f"'{label}' superó {budget.seconds:g} s y se canceló")
+        if state["denied"] is not None:
+            _reject("write", UnsafeQuery, f"'{label}' intentó una operación no permitida ({state['denied']})")
+        raise
+    finally:
+        dbapi_conn.set_progress_handler(None, 0)
+        dbapi_conn.set_authorizer(None)
+
+def check_rows(rows: list, budget: Budget, label: str) -> list:
+    """`rows` debe venir de fetchmany(budget.rows + 1)."""
+    if len(rows) > budget.rows:
+        _reject("rows", QueryBudgetExceeded, f"'{label}' devuelve más de {budget.rows} filas")
+    return rows
@@ -1,11 +1,12 @@
-from email_io import fetch_new_emails, send_email
+import asyncio
+from email_io import fetch_new_emails, send_email, close_client
 
-def main():
-    mails = fetch_new_emails()
+async def main():
+    mails = await fetch_new_emails()
     print("Correos leídos:", mails)
     if mails:
         remitente = mails[0]["from"]
-        ok = send_email(
+        ok = await send_email(
             remitente,
             "Prueba final via Device Code",
             "¡Correo enviado correctamente!"
@@ -13,6 +14,7 @@ def main():
         print("Envío completado:", ok)
     else:
         print("No hay correos en la bandeja para pruebas.")
+    await close_client()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
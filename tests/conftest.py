@@ -3,13 +3,23 @@ import os, sys
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
+# Lotes de respuesta inmediatos en tests
+os.environ.setdefault("GRAPH_BATCH_DELAY", "0.01")
+# Base temporal: los tests no tocan data/inventory.db
+import tempfile
+from collections import OrderedDict
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='inventory-test-')}/inventory.db")
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from main import app
-from db import SessionLocal, init_db
+from db import SessionLocal, execute_sql, init_db
 from seed_db import seed
+import email_io
+import nl_to_sql
+from bench.fake_graph import FakeGraph
+from bench.fake_llm import FakeLLM
 
 # Fixture para TestClient de FastAPI
 @pytest.fixture(scope="module")
@@ -18,11 +28,39 @@ def client():
 
 # Fixture para inicializar la base fresh
 @pytest.fixture(scope="module", autouse=True)
-def setup_db(tmp_path_factory):
-    # redirige la DB a un archivo temporal
-    db_file = tmp_path_factory.mktemp("data") / "test_inventory.db"
-    os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
-    # seed completo
+def setup_db():
+    # seed completo (sobre la base temporal de DATABASE_URL)
     seed()
     yield
     # cleanup opcional
+
+# Graph en memoria: ningún test envía correo real
+@pytest.fixture(autouse=True)
+def graph_outbox():
+    graph = FakeGraph()
+    email_io.set_client(graph.client())
+    yield graph.sent
+    email_io.set_client(None)
+
+# LLM local: ningún test llama a OpenAI
+@pytest.fixture(autouse=True)
+def fake_llm(monkeypatch):
+    llm = FakeLLM()
+    monkeypatch.setattr(nl_to_sql, "_CHAIN", llm)
+    monkeypatch.setattr(nl_to_sql, "_LLM_CACHE", OrderedDict())
+    return llm
+
+# Lecturas de la base para comprobar escrituras: stock_of("ABC"), movement_count("ABC")
+@pytest.fixture
+def stock_of():
+    def read(name):
+        return execute_sql("SELECT quantity FROM products WHERE name = :n", {"n": name})[0]["quantity"]
+    return read
+
+@pytest.fixture
+def movement_count():
+    def read(name):
+        return execute_sql(
+            "SELECT COUNT(*) AS n FROM movements m JOIN products p ON p.id = m.product_id "
+            "WHERE p.name = :n", {"n": name})[0]["n"]
+    return read
@@ -0,0 +1,87 @@
+# tests/test_auth.py
+import time
+import asyncio
+import threading
+
+from auth import TokenManager, save_cache
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class _Acquire:
+    def __init__(self, expires_in=3600, delay=0.0):
+        self.calls, self.expires_in, self.delay = [], expires_in, delay
+    def __call__(self, interactive=True, force_refresh=False):
+        self.calls.append((interactive, force_refresh))
+        time.sleep(self.delay)
+        return {"access_token": f"tok-{len(self.calls)}", "expires_in": self.expires_in}
+
+def test_token_en_memoria_hasta_cerca_de_caducar():
+    clock, acquire = _Clock(), _Acquire(expires_in=3600)
+    tm = TokenManager(acquire, refresh_margin=300, expiry_skew=60, clock=clock)
+    assert tm.get() == "tok-1"
+    clock.now += 3500
+    assert tm.get() == "tok-1" and len(acquire.calls) == 1
+    clock.now += 60                      # dentro del margen de seguridad
+    assert tm.cached() is None
+    assert tm.get() == "tok-2"
+    assert acquire.calls[-1] == (True, False)
+
+def test_renovaciones_concurrentes_una_sola_llamada():
+    acquire = _Acquire(delay=0.05)
+    tm = TokenManager(acquire)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tm.get())) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["tok-1"] * 10
+    assert len(acquire.calls) == 1
+
+def test_refresco_en_segundo_plano_sin_device_flow():
+    acquire = _Acquire(expires_in=0.2)
+    tm = TokenManager(acquire, refresh_margin=0.1, expiry_skew=0)
+    tm.get()
+
+    async def run():
+        task = asyncio.create_task(tm.run_refresher())
+        await asyncio.sleep(0.35)
+        task.cancel()
+
+    asyncio.run(run())
+    assert len(acquire.calls) >= 2
+    assert all(call == (False, True) for call in acquire.calls[1:])
+    assert tm.cached() is not None
+
+class _Cache:
+    def __init__(self):
+        self.has_state_changed = False
+    def serialize(self):
+        self.has_state_changed = False
+        return "{}"
+
+def test_cache_msal_solo_se_escribe_si_cambia(tmp_path):
+    path, cache = tmp_path / "cache.bin", _Cache()
+    assert save_cache(cache, str(path)) is False and not path.exists()
+    cache.has_state_changed = True
+    assert save_cache(cache, str(path)) is True and path.read_text() == "{}"
+    assert save_cache(cache, str(path)) is False
+
+def test_cliente_graph_usa_token_en_memoria(monkeypatch):
+    import email_io
+    acquire = _Acquire()
+    tm = TokenManager(acquire)
+    client = email_io.GraphClient(token_provider=tm)
+
+    async def run():
+        for _ in range(5):
+            assert await client.authenticate()
+
+    monkeypatch.setattr(asyncio, "to_thread", None)   # el camino caliente no usa hilos…
+    tm.get()                                          # …una vez hay token en memoria
+    asyncio.run(run())
+    assert len(acquire.calls) == 1
@@ -0,0 +1,19 @@
+# tests/test_bench.py
+from bench.run_bench import check_budgets, percentile, run, STAGES
+
+def test_percentil_rango_mas_cercano():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 95) == 0.0
+
+def test_benchmark_extremo_a_extremo_con_429():
+    report = run(requests=40, concurrency=8, products=20, movements=2_000, days=60,
+                 graph_latency=0, throttle_rate=0.2, llm_latency=0, llm_share=0.1)
+    assert report["sent"] == 40                      # los 429 se reintentan
+    assert report["graph_throttled"] > 0
+    assert report["llm_calls"] <= 3                  # una vez por (tipo, días)
+    for per_stage in report["stages"].values():
+        assert set(per_stage) == set(STAGES)
+    assert check_budgets(report, {"parse": 1e9}) == []
+    assert check_budgets(report, {"sql": -1})
@@ -0,0 +1,72 @@
+# tests/test_bulk_import.py
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from bulk_import import ImportResult, import_movements, import_products
+from db import execute_sql
+from result_cache import cache, ResultCache
+
+def test_importa_movimientos_por_bloques_y_concilia_stock(stock_of, movement_count):
+    before_abc, before_n = stock_of("ABC"), movement_count("ABC")
+    csv = (
+        "product,change,date\n"
+        "ABC,5,2024-01-01T10:00:00\n"
+        "ABC,-2,2024-01-02\n"
+        "NUEVO1,7,2024-01-02T08:30:00Z\n"
+    ).encode()
+    cache.put(ResultCache.key("ABC", "saldo", 1), "viejo")
+    res = import_movements(csv, chunk_size=2)
+    assert (res.rows, res.products, res.created) == (3, 2, 1)
+    assert stock_of("ABC") == before_abc + 3
+    assert movement_count("ABC") == before_n + 2
+    assert stock_of("NUEVO1") == 7
+    assert cache.get(ResultCache.key("ABC", "saldo", 1)) is None
+    # el agregado diario se mantiene con la carga masiva
+    day = execute_sql(
+        "SELECT net_change FROM movement_daily d JOIN products p ON p.id = d.product_id "
+        "WHERE p.name = 'NUEVO1' AND d.day = '2024-01-02'")
+    assert day == [{"net_change": 7}]
+
+def test_sin_conciliar_no_toca_el_stock(stock_of):
+    before = stock_of("XYZ")
+    import_movements(b"product,change,date\nXYZ,10,2024-02-01\n", reconcile=False)
+    assert stock_of("XYZ") == before
+
+def test_lineas_en_blanco_se_saltan(stock_of):
+    before = stock_of("PQR")
+    res = import_movements(b"product,change,date\nPQR,5,2024-01-01\n\nPQR,1,2024-01-02\n\n")
+    assert res.rows == 2 and stock_of("PQR") == before + 6
+    with pytest.raises(ValueError, match="Línea 4"):
+        import_movements(b"product,change,date\nPQR,5,2024-01-01\n\nPQR\n")
+
+def test_upsert_de_productos(stock_of):
+    res = import_products(b"name,quantity\nDEF,999\nNUEVO2,3\n")
+    assert res.rows == 2
+    assert stock_of("DEF") == 999 and stock_of("NUEVO2") == 3
+
+@pytest.mark.parametrize("csv,msg", [
+    (b"product,change\nABC,1\n", "Faltan columnas"),
+    (b"product,change,date\nABC,uno,2024-01-01\n", "Línea 2"),
+    (b"product,change,date\nABC,1,ayer\n", "fecha"),
+])
+def test_csv_invalido(csv, msg):
+    with pytest.raises(ValueError, match=msg):
+        import_movements(csv)
+
+def test_endpoint_importacion(client: TestClient, stock_of):
+    before = stock_of("MNO")
+    resp = client.post("/import/movements", content=b"product,change,date\nMNO,-5,2024-03-01\n")
+    assert resp.status_code == 200
+    assert resp.json()["rows"] == 1
+    assert stock_of("MNO") == before - 5
+    assert client.post("/import/otra", content=b"").status_code == 404
+    assert client.post("/import/products", content=b"name\nX\n").status_code == 400
+
+def test_importacion_prepara_la_base_antes_de_cargar(client: TestClient, monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "ensure_db", lambda: calls.append("ensure_db"))
+    monkeypatch.setattr(main, "_IMPORTERS", {"products": lambda tmp: calls.append("import") or
+                                             ImportResult(0, 0, 0, 1.0)})
+    assert client.post("/import/products", content=b"name,quantity\n").status_code == 200
+    assert calls == ["ensure_db", "import"]
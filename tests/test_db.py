@@ -1,4 +1,5 @@
-from db import execute_sql
+import pytest
+from db import execute_sql, run_query
 
 def test_db_seeded_products():
     rows = execute_sql("SELECT name, quantity FROM products;")
@@ -11,3 +12,24 @@ def test_db_movements_count():
     rows = execute_sql("SELECT COUNT(*) AS cnt FROM movements;")
     # 5 productos × 30 días = 150 movimientos
     assert rows[0]["cnt"] == 150
+
+def test_run_query_con_parametros_enlazados():
+    rows = run_query("saldo", {"producto": "ABC"})
+    assert rows == [(120,)]
+    assert rows[0].quantity == 120
+    # el valor va enlazado: no hay inyección posible
+    assert run_query("saldo", {"producto": "ABC' OR '1'='1"}) == []
+
+def test_run_query_desconocida():
+    with pytest.raises(ValueError):
+        run_query("no-existe")
+
+def test_agregado_diario_coincide_con_movimientos():
+    raw = execute_sql(
+        "SELECT product_id, date(date) AS day, SUM(change) AS net FROM movements "
+        "GROUP BY product_id, date(date) ORDER BY 1, 2;"
+    )
+    daily = execute_sql(
+        "SELECT product_id, day, net_change AS net FROM movement_daily ORDER BY 1, 2;"
+    )
+    assert daily == raw and len(daily) == 150
@@ -0,0 +1,87 @@
+# tests/test_diagnostics.py
+import time
+import threading
+
+from fastapi.testclient import TestClient
+
+import db
+import diagnostics
+from db import execute_sql
+from nl_to_sql import nl_to_sql_from_subject
+
+def _busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def test_sampler_captura_pilas_de_otros_hilos():
+    worker = threading.Thread(target=_busy_loop, args=(0.3,), name="ocupado")
+    with diagnostics.Sampler(interval=0.002) as sampler:
+        worker.start()
+        worker.join()
+    profile = sampler.profile("test")
+    assert profile.samples > 10
+    busy = sum(n for stack, n in profile.stacks.items()
+               if stack.startswith("ocupado;") and "_busy_loop" in stack)
+    assert busy > 10
+    assert profile.top(1)[0]["function"].startswith("_busy_loop")
+    assert profile.folded().count("ocupado;") == sum(1 for s in profile.stacks if s.startswith("ocupado;"))
+
+def test_sql_lento_guarda_su_plan(monkeypatch):
+    monkeypatch.setattr(db, "SLOW_SQL_SECONDS", 0)
+    diagnostics.SLOW_SQL.clear()
+    execute_sql("SELECT quantity FROM products WHERE name = :p", {"p": "ABC"})
+    entry = diagnostics.SLOW_SQL.entries()[-1]
+    assert entry["query"] == "adhoc" and entry["params"] == {"p": "'ABC'"}
+    assert any("products" in step for step in entry["plan"])
+
+def test_llm_lento_guarda_tamano_del_prompt(monkeypatch, fake_llm):
+    monkeypatch.setattr(diagnostics, "SLOW_LLM_SECONDS", 0)
+    diagnostics.SLOW_LLM.clear()
+    nl_to_sql_from_subject("Consulta inventario: ABC, rotación, 30 días")
+    entry = diagnostics.SLOW_LLM.entries()[-1]
+    assert entry["call"] == "nl_to_sql:rotación" and entry["prompt_chars"] > 100
+
+def test_buffer_circular_acotado():
+    log = diagnostics.SlowLog("sql", size=3)
+    for i in range(5):
+        log.record(1.0, query=f"q{i}")
+    assert [e["query"] for e in log.entries()] == ["q2", "q3", "q4"]
+
+def test_sin_admin_token_cerrado_por_defecto(client: TestClient, monkeypatch):
+    monkeypatch.setattr(diagnostics, "ADMIN_TOKEN", "")
+    monkeypatch.setattr(diagnostics, "ADMIN_OPEN", False)
+    payload = {"from": "ana@foo.com", "subject": "Consulta inventario: ABC, saldo, 1 día"}
+    assert client.get("/admin/slow").status_code == 403
+    assert client.get("/admin/profiles").status_code == 403
+    assert client.delete("/admin/slow").status_code == 403
+    resp = client.post("/process-email", json=payload, headers={"X-Profile": "1"})
+    assert resp.status_code == 200 and "X-Profile-Id" not in resp.headers
+
+def test_perfil_por_cabecera_y_endpoints_admin(client: TestClient, monkeypatch):
+    monkeypatch.setattr(diagnostics, "ADMIN_OPEN", True)       # ADMIN_OPEN=1 (desarrollo)
+    payload = {"from": "ana@foo.com", "subject": "Consulta inventario: ABC, saldo, 1 día"}
+    resp = client.post("/process-email", json=payload, headers={"X-Profile": "1"})
+    assert resp.status_code == 200
+    profile_id = resp.headers["X-Profile-Id"]
+    summary = client.get(f"/admin/profiles/{profile_id}").json()
+    assert summary["request"] == "POST /process-email" and "top" in summary
+    assert client.get(f"/admin/profiles/{profile_id}", params={"format": "folded"}).status_code == 200
+    assert client.get("/admin/profiles").json()[0]["id"] == profile_id
+    assert "X-Profile-Id" not in client.post("/process-email", json=payload).headers
+    assert set(client.get("/admin/slow").json()) == {"sql", "llm"}
+
+    monkeypatch.setattr(diagnostics, "ADMIN_TOKEN", "secreto")
+    assert client.get("/admin/slow").status_code == 403
+    assert client.get("/admin/slow", headers={"X-Admin-Token": "secreto"}).status_code == 200
+    resp = client.post("/process-email", json=payload, headers={"X-Profile": "1"})
+    assert "X-Profile-Id" not in resp.headers
+
+def test_perfil_de_respuesta_en_streaming_cubre_todo_el_cuerpo(client: TestClient, monkeypatch, fake_llm):
+    monkeypatch.setattr(diagnostics, "ADMIN_OPEN", True)
+    fake_llm.latency = 0.2                          # el cuerpo NDJSON tarda en producirse
+    items = [{"from": "ana@foo.com", "subject": "Consulta inventario: ABC, rotación, 30 días"}]
+    resp = client.post("/process-emails?dry_run=true", json=items, headers={"X-Profile": "1"})
+    assert resp.status_code == 200 and resp.text
+    summary = client.get(f"/admin/profiles/{resp.headers['X-Profile-Id']}").json()
+    assert summary["request"] == "POST /process-emails" and summary["seconds"] >= 0.2
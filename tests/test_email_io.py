@@ -0,0 +1,184 @@
+# tests/test_email_io.py
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import email_io
+from auth import TokenManager
+from email_io import GraphClient, fetch_new_emails, send_email
+
+def _graph(handler):
+    """Instala un GraphClient con transporte en memoria y token fijo."""
+    client = GraphClient(token_provider=lambda: "tok", transport=httpx.MockTransport(handler))
+    email_io.set_client(client)
+    return client
+
+@pytest.fixture(autouse=True)
+def _reset_client():
+    yield
+    email_io.set_client(None)
+
+@pytest.fixture
+def delta_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(email_io, "DELTA_STATE_FILE", str(tmp_path / "delta.json"))
+    monkeypatch.setattr(email_io, "_delta_links", None)
+    monkeypatch.setattr(email_io, "_pending_delta", {})
+
+def _msg(mid, subject):
+    return {"id": mid, "subject": subject, "sender": {"emailAddress": {"address": f"{mid}@b.com"}}}
+
+def test_fetch_delta_pagina_filtra_y_baja_solo_cuerpos_relevantes(delta_state):
+    seen = []
+    def handler(request: httpx.Request):
+        assert request.headers["Authorization"] == "Bearer tok"
+        seen.append(str(request.url))
+        path = request.url.path
+        if path.endswith("/messages/delta") and "page2" not in str(request.url):
+            return httpx.Response(200, json={
+                "value": [_msg("m1", "Consulta inventario: ABC, saldo, 1 día"), _msg("m2", "Newsletter")],
+                "@odata.nextLink": "https://graph.microsoft.com/v1.0/me/mailFolders/Inbox/messages/delta?page2=1",
+            })
+        if "page2" in str(request.url):
+            return httpx.Response(200, json={
+                "value": [_msg("m3", "consulta inventario: XYZ, historial, 3 días"), {"id": "m4", "@removed": {}}],
+                "@odata.deltaLink": "https://graph.microsoft.com/v1.0/me/mailFolders/Inbox/messages/delta?token=T1",
+            })
+        if path.startswith("/v1.0/me/messages/"):
+            return httpx.Response(200, json={"body": {"content": f"cuerpo {path.rsplit('/', 1)[1]}"}})
+        raise AssertionError(f"petición inesperada {request.url}")
+    _graph(handler)
+
+    emails = asyncio.run(fetch_new_emails())
+    assert [(e["id"], e["body"]) for e in emails] == [("m1", "cuerpo m1"), ("m3", "cuerpo m3")]
+    assert not any("/me/messages/m2" in u for u in seen)
+
+    # Tras confirmar, la siguiente lectura parte del deltaLink guardado
+    email_io.commit_sync_state()
+    seen.clear()
+    def handler2(request: httpx.Request):
+        seen.append(str(request.url))
+        return httpx.Response(200, json={"value": [], "@odata.deltaLink": "https://x/delta?token=T2"})
+    _graph(handler2)
+    assert asyncio.run(fetch_new_emails()) == []
+    assert seen == ["https://graph.microsoft.com/v1.0/me/mailFolders/Inbox/messages/delta?token=T1"]
+    email_io.commit_sync_state()
+    assert json.load(open(email_io.DELTA_STATE_FILE)) == {"Inbox": "https://x/delta?token=T2"}
+
+def test_delta_caducado_reinicia_sincronizacion(delta_state):
+    email_io._load_delta_links()["Inbox"] = "https://graph.microsoft.com/v1.0/old-delta"
+    def handler(request: httpx.Request):
+        if "old-delta" in str(request.url):
+            return httpx.Response(410, json={"error": {"code": "SyncStateNotFound"}})
+        assert "receivedDateTime" in request.url.params["$filter"]
+        return httpx.Response(200, json={"value": [], "@odata.deltaLink": "https://x/delta?token=new"})
+    _graph(handler)
+    assert asyncio.run(fetch_new_emails()) == []
+    assert email_io._pending_delta == {"Inbox": "https://x/delta?token=new"}
+
+def test_send_email_usa_cliente_compartido():
+    sent = []
+    def handler(request: httpx.Request):
+        sent.append(json.loads(request.content))
+        return httpx.Response(202)
+    client = _graph(handler)
+
+    async def run():
+        oks = await asyncio.gather(*(send_email(f"u{i}@b.com", "Re", "x") for i in range(3)))
+        return oks, email_io.get_client()
+    oks, shared = asyncio.run(run())
+    assert oks == [True, True, True]
+    assert shared is client
+    assert {m["message"]["toRecipients"][0]["emailAddress"]["address"] for m in sent} == {"u0@b.com", "u1@b.com", "u2@b.com"}
+
+def test_errores_de_transporte_no_propagan(delta_state):
+    def handler(request: httpx.Request):
+        raise httpx.ConnectError("sin red")
+    _graph(handler)
+    assert asyncio.run(fetch_new_emails()) == []
+    assert asyncio.run(send_email("a@b.com", "Re", "x")) is False
+
+def test_reply_queue_agrupa_y_reintenta_429():
+    batches, throttled = [], []
+    def handler(request: httpx.Request):
+        assert request.url.path == "/v1.0/$batch"
+        reqs = json.loads(request.content)["requests"]
+        batches.append(len(reqs))
+        responses = []
+        for r in reqs:
+            to = r["body"]["message"]["toRecipients"][0]["emailAddress"]["address"]
+            if to == "lento@b.com" and not throttled:
+                throttled.append(to)
+                responses.append({"id": r["id"], "status": 429, "headers": {"Retry-After": "0"}})
+            elif to == "malo@b.com":
+                responses.append({"id": r["id"], "status": 400, "body": {"error": {"message": "inválido"}}})
+            else:
+                responses.append({"id": r["id"], "status": 202})
+        return httpx.Response(200, json={"responses": responses})
+    _graph(handler)
+
+    async def run():
+        queue = email_io.ReplyQueue(max_batch=20, max_delay=0.05)
+        tos = [f"u{i}@b.com" for i in range(23)] + ["lento@b.com", "malo@b.com"]
+        results = await asyncio.gather(*(queue.send(to, "Re", "x") for to in tos))
+        await queue.aclose()
+        return dict(zip(tos, results))
+    results = asyncio.run(run())
+
+    assert batches[:2] == [20, 5] and batches[2:] == [1]
+    assert results["lento@b.com"].ok
+    assert results["malo@b.com"] == email_io.SendResult(False, 400, "inválido")
+    assert all(r.ok for to, r in results.items() if to.startswith("u"))
+
+def test_reply_queue_corta_lotes_por_tamano_y_envia_solos_los_grandes():
+    batches, alone = [], []
+    def handler(request: httpx.Request):
+        body = json.loads(request.content)
+        if request.url.path == "/v1.0/me/sendMail":
+            alone.append(len(request.content))
+            return httpx.Response(202)
+        assert len(request.content) < 4000
+        batches.append(len(body["requests"]))
+        return httpx.Response(200, json={"responses": [{"id": r["id"], "status": 202}
+                                                       for r in body["requests"]]})
+    _graph(handler)
+
+    async def run():
+        queue = email_io.ReplyQueue(max_batch=20, max_delay=0.05, max_bytes=2500)
+        big = email_io.Attachment("informe.csv", "text/csv", b"x" * 3000)
+        sends = [queue.send(f"u{i}@b.com", "Re", "y" * 1000) for i in range(5)]
+        sends.append(queue.send("grande@b.com", "Re", "z", (big,)))
+        results = await asyncio.gather(*sends)
+        await queue.aclose()
+        return results
+    results = asyncio.run(run())
+
+    assert all(r.ok for r in results)
+    assert sorted(batches) == [1, 2, 2]             # ~1,1 KB por correo: dos por lote
+    assert len(alone) == 1 and alone[0] > 2500      # el del adjunto no entra en ningún lote
+
+def test_401_invalida_el_token_y_reintenta_una_vez():
+    acquired, seen = [], []
+    def acquire(interactive=True, force_refresh=False):
+        acquired.append(force_refresh)
+        return {"access_token": f"tok-{len(acquired)}", "expires_in": 3600}
+    def handler(request: httpx.Request):
+        seen.append(request.headers["Authorization"])
+        # tok-1 está revocado; /siempre-401 rechaza cualquier token: un solo reintento
+        ok = request.headers["Authorization"] == "Bearer tok-2" and "siempre-401" not in request.url.path
+        return httpx.Response(200 if ok else 401, json={})
+
+    tm = TokenManager(acquire)
+    client = GraphClient(token_provider=tm, transport=httpx.MockTransport(handler))
+
+    async def run():
+        first = await client.request("GET", "/me")
+        again = await client.request("GET", "/me/siempre-401")
+        return first, again
+
+    first, again = asyncio.run(run())
+    assert first.status_code == 200 and again.status_code == 401
+    assert seen == ["Bearer tok-1", "Bearer tok-2", "Bearer tok-2", "Bearer tok-3"]
+    # la renovación tras el 401 ignora el access token cacheado por MSAL
+    assert acquired == [False, True, True]
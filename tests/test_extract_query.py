@@ -0,0 +1,86 @@
+# tests/test_extract_query.py
+import json
+import time
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+
+from extract_query import ExtractCache, normalize
+
+class _Chain:
+    """Sustituye a la cadena: registra cada llamada batch y tarda `delay` s."""
+    def __init__(self, delay=0.0):
+        self.calls, self.delay = [], delay
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        time.sleep(self.delay)
+        out = []
+        for t in texts:
+            product = t.split()[-1].strip("?¿!").upper()
+            out.append("no sé" if product == "NADA" else
+                       json.dumps({"product": product, "request_type": "saldo", "days": 1}))
+        return out
+
+@pytest.fixture
+def engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+
+def test_normaliza_solo_espacios_y_tildes():
+    assert normalize("  saldo \t ABC \n") == "saldo ABC"
+    assert normalize("Proyecci\u006f\u0301n AB*") == normalize("Proyección AB*") == "Proyección AB*"
+    # el producto conserva mayúsculas y puntuación
+    assert normalize("saldo ABC-1") != normalize("saldo abc 1")
+    assert normalize("saldo ABC") != normalize("saldo abc")
+
+def test_textos_casi_iguales_una_sola_llamada(engine):
+    chain = _Chain()
+    cache = ExtractCache(engine, run_chain=chain)
+    for text in ("saldo ABC", "saldo  ABC", " saldo\tABC "):
+        assert cache.get(text)["product"] == "ABC"
+    assert len(chain.calls) == 1
+    cache.get("saldo abc")
+    assert len(chain.calls) == 2
+
+def test_nivel_en_disco_sobrevive_reinicio_y_lru(engine):
+    chain = _Chain()
+    ExtractCache(engine, run_chain=chain).get("saldo ABC")
+    fresh = ExtractCache(engine, max_entries=1, run_chain=chain)   # "reinicio"
+    assert fresh.get("saldo  ABC")["product"] == "ABC"
+    assert len(chain.calls) == 1
+
+    fresh.get("saldo XYZ")                      # expulsa ABC de memoria
+    assert len(fresh._memory) == 1
+    small = ExtractCache(engine, max_rows=2, run_chain=chain)
+    small.get_many(["saldo DEF", "saldo GHI"])
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM extract_cache").scalar_one() == 2
+
+def test_peticiones_simultaneas_single_flight(engine):
+    chain = _Chain(delay=0.1)
+    cache = ExtractCache(engine, run_chain=chain)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("saldo ABC")))
+               for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 10 and len(chain.calls) == 1
+
+def test_lote_una_llamada_batch_por_preguntas_distintas(engine):
+    chain = _Chain()
+    cache = ExtractCache(engine, run_chain=chain)
+    cache.get("saldo ABC")
+    out = cache.get_many(["saldo  ABC", "saldo XYZ", "saldo XYZ ", "saldo DEF"])
+    assert [o["product"] for o in out] == ["ABC", "XYZ", "XYZ", "DEF"]
+    assert chain.calls[1] == ["saldo XYZ", "saldo DEF"]
+
+def test_salida_invalida_no_se_cachea(engine):
+    chain = _Chain()
+    cache = ExtractCache(engine, run_chain=chain)
+    with pytest.raises(ValueError):
+        cache.get("saldo NADA")
+    with pytest.raises(ValueError):
+        cache.get("saldo NADA")
+    assert len(chain.calls) == 2
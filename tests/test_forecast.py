@@ -0,0 +1,77 @@
+# tests/test_forecast.py
+import numpy as np
+from fastapi.testclient import TestClient
+
+import forecast
+from db import run_query
+from main import format_response
+from models import engine
+from seed_db import seed
+
+def test_calculo_vectorizado_por_ventana():
+    # columnas: del día más antiguo a ayer
+    daily = np.array([
+        [0, 0, 0, -1, -1, -1, -1, -1, -1, -1],     # consumo constante
+        [-10, -10, -10, 0, 0, 0, 0, 0, 0, 0],      # consumo antiguo, parado ahora
+        [5, 5, 5, 5, 5, 5, 5, 5, 5, 5],            # solo entradas
+        [0, 0, 0, 0, 0, 0, 0, 0, -4, -4],          # aceleración reciente
+    ])
+    stock = np.array([14, 30, 10, -3])
+    short, long_ = forecast.compute(stock, daily, windows=(2, 10), short_window=2)
+
+    assert short.net_change.tolist() == [-2, 0, 10, -8]
+    assert long_.net_change.tolist() == [-7, -30, 50, -8]
+    assert np.allclose(long_.daily_rate, [0.7, 3.0, -5.0, 0.8])
+    assert np.allclose(long_.short_rate, [1.0, 0.0, -5.0, 4.0])
+    # se usa el mayor de los dos consumos; sin consumo → NaN; stock negativo → 0
+    assert np.allclose(long_.days_to_stockout, [14.0, 10.0, np.nan, 0.0], equal_nan=True)
+
+def test_proyeccion_igual_con_y_sin_prevision():
+    seed()
+    params = {"producto": "ABC", "dias": 7}
+    live = run_query("proyección", params)[0]
+    assert forecast.refresh_forecasts(windows=(7, 14)) == 5
+    assert run_query("proyección", params)[0] == live
+    multi = {"productos": '["ABC", "XYZ"]', "patrones": "[]", "dias": 14}
+    with_forecast = run_query("proyección:multi", multi)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM stock_forecasts")
+    assert run_query("proyección:multi", multi) == with_forecast
+
+def test_respuesta_de_proyeccion_usa_la_formula_de_la_prevision():
+    seed()
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO products (name, quantity) VALUES ('ACEL', 40)")
+        # consumo antiguo bajo y aceleración ayer: manda el consumo reciente
+        conn.exec_driver_sql(
+            "INSERT INTO movements (product_id, change, date) "
+            "SELECT id, -2, datetime('now', '-12 days') FROM products WHERE name = 'ACEL' UNION ALL "
+            "SELECT id, -8, datetime('now', '-1 day') FROM products WHERE name = 'ACEL'")
+    forecast.refresh_forecasts(windows=(14,))
+    with engine.connect() as conn:
+        stored = conn.exec_driver_sql(
+            "SELECT f.days_to_stockout FROM stock_forecasts f JOIN products p ON p.id = f.product_id "
+            "WHERE p.name = 'ACEL' AND f.window_days = 14").scalar_one()
+    assert stored == 35.0                           # 40 / (8 / 7), no 40 / (10 / 14)
+    reply = format_response(run_query("proyección", {"producto": "ACEL", "dias": 14}), 14)
+    assert f"Días hasta agotar stock: {stored}" in reply
+
+def test_informe_de_roturas(client: TestClient):
+    seed()
+    with engine.begin() as conn:
+        # consumo que ningún movimiento aleatorio del seed (±10 al día) compensa
+        conn.exec_driver_sql(
+            "INSERT INTO movements (product_id, change, date) "
+            "SELECT id, -1000, datetime('now', '-1 day') FROM products WHERE name = 'XYZ'")
+        conn.exec_driver_sql("UPDATE products SET quantity = 5 WHERE name = 'XYZ'")
+    forecast.refresh_forecasts()
+
+    resp = client.get("/reports/stockout", params={"window": 7, "horizon": 10})
+    assert resp.status_code == 200
+    products = resp.json()["products"]
+    assert products[0]["product"] == "XYZ"
+    assert products[0]["days_to_stockout"] <= 10
+    days = [p["days_to_stockout"] for p in products]
+    assert days == sorted(days)
+
+    assert client.get("/reports/stockout", params={"window": 3}).status_code == 400
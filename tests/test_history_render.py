@@ -0,0 +1,66 @@
+# tests/test_history_render.py
+import csv
+import gzip
+import io
+import types
+import base64
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+from db import execute_sql
+from history_render import render_historial
+
+def _days(n, start=date(2025, 1, 6)):      # lunes
+    return [(start + timedelta(days=i)).isoformat() for i in range(n)]
+
+def _detail(rendered):
+    with gzip.open(io.BytesIO(rendered.attachment.data), "rt", newline="") as f:
+        return list(csv.reader(f))
+
+def test_ventana_corta_por_dia_sin_adjunto():
+    rows = [(None, d, 1) for d in _days(3)]
+    out = render_historial(iter(rows), dias=3)
+    assert out.body.splitlines() == [
+        "Historial de movimientos:",
+        "• 2025-01-06 → +1", "• 2025-01-07 → +1", "• 2025-01-08 → +1",
+    ]
+    assert out.attachment is None
+
+def test_ventana_larga_por_semana_con_detalle_adjunto():
+    rows = [(p, d, -1) for p in ("ABC", "XYZ") for d in _days(14)]
+    out = render_historial((r for r in rows), dias=90)
+    lines = out.body.splitlines()
+    assert lines[:4] == [
+        "Historial de movimientos (por semana):",
+        "ABC:", "  • semana del 2025-01-06 → -7", "  • semana del 2025-01-13 → -7",
+    ]
+    assert out.attachment.name == "historial.csv.gz"
+    detail = _detail(out)
+    assert detail[0] == ["product", "date", "change"] and len(detail) == 1 + 28
+    assert detail[-1] == ["XYZ", "2025-01-19", "-1"]
+
+def test_cuerpo_recortado_y_adjunto_con_tope():
+    rows = [(f"P{i:04d}", d, 3) for i in range(200) for d in _days(5)]
+    out = render_historial(iter(rows), dias=5, max_chars=500)
+    assert len(out.body) < 700
+    assert "líneas más no incluidas" in out.body
+    assert len(_detail(out)) == 1 + 1000
+
+    big = render_historial(iter(rows), dias=5, max_chars=500, max_attachment=200)
+    assert big.attachment is None
+    assert "supera el tamaño máximo de adjunto" in big.body
+
+def test_execute_sql_en_streaming_devuelve_tuplas():
+    rows = execute_sql("SELECT name, quantity FROM products WHERE name = :p", {"p": "ABC"}, stream=True)
+    assert isinstance(rows, types.GeneratorType)
+    assert list(rows) == [("ABC", 120)]
+
+def test_historial_largo_se_envia_con_adjunto(client: TestClient, graph_outbox):
+    payload = {"from": "ana@foo.com", "subject": "Consulta inventario: ABC, historial, 365 días"}
+    result = client.post("/process-email", json=payload).json()
+    assert result["body"].startswith("Historial de movimientos (por semana):")
+    assert result["attachments"] == ["historial.csv.gz"]
+    message = graph_outbox[-1]["message"]
+    data = base64.b64decode(message["attachments"][0]["contentBytes"])
+    assert gzip.decompress(data).decode().startswith("product,date,change")
@@ -1,6 +1,10 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
 
+import main
+from models import engine
+
 def test_process_email_saldo(client: TestClient):
     payload = {
         "sender": "test@foo.com",
@@ -23,6 +27,24 @@ def test_process_email_historial(client: TestClient):
     assert resp.status_code == 200
     assert "Historial de movimientos" in resp.json()["body"]
 
+def test_proyeccion_con_sku_numerico_usa_los_dias_del_asunto(client: TestClient):
+    # los dígitos del SKU no se confunden con el número de días
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT OR IGNORE INTO products (name, quantity) VALUES ('SKU000123', 30)")
+        conn.exec_driver_sql(
+            "INSERT INTO movements (product_id, change, date) "
+            "SELECT id, -30, datetime('now', '-20 days') FROM products WHERE name = 'SKU000123'")
+    payload = {"sender": "test@foo.com", "subject": "Consulta inventario: SKU000123, proyección, 30 días"}
+    try:
+        resp = client.post("/process-email", json=payload)
+        assert resp.status_code == 200
+        assert "Días hasta agotar stock: 30.0" in resp.json()["body"]
+    finally:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM movements WHERE product_id = "
+                                 "(SELECT id FROM products WHERE name = 'SKU000123')")
+            conn.exec_driver_sql("DELETE FROM products WHERE name = 'SKU000123'")
+
 def test_process_email_invalid(client: TestClient):
     payload = {
         "sender": "test@foo.com",
@@ -31,3 +53,80 @@ def test_process_email_invalid(client: TestClient):
     }
     resp = client.post("/process-email", json=payload)
     assert resp.status_code == 400
+
+def test_process_email_reporta_envio(client: TestClient, graph_outbox):
+    payload = {
+        "from": "ana@foo.com",
+        "subject": "Consulta inventario: XYZ, saldo, 1 día",
+    }
+    resp = client.post("/process-email", json=payload)
+    assert resp.json()["status"] == "sent"
+    assert graph_outbox[-1]["message"]["toRecipients"][0]["emailAddress"]["address"] == "ana@foo.com"
+
+def test_consulta_repetida_sale_de_cache(client: TestClient, monkeypatch):
+    main.result_cache.clear()
+    payload = {"from": "ana@foo.com", "subject": "Consulta inventario: DEF, saldo, 1 día"}
+    first = client.post("/process-email", json=payload).json()["body"]
+
+    def _no_sqlite(*args, **kwargs):
+        raise AssertionError("no debería consultar SQLite")
+    monkeypatch.setattr(main, "run_query", _no_sqlite)
+    assert client.post("/process-email", json=payload).json()["body"] == first
+    assert main.result_cache.stats()["hits"] >= 1
+
+def test_cache_distingue_mayusculas_del_producto(client: TestClient):
+    main.result_cache.clear()
+    ask = lambda name: client.post("/process-email", json={
+        "from": "ana@foo.com", "subject": f"Consulta inventario: {name}, saldo, 1 día"}).json()["body"]
+    assert ask("def") == "No se encontraron datos para tu solicitud."
+    assert ask("DEF") != "No se encontraron datos para tu solicitud."
+
+def test_consulta_varios_productos_una_respuesta(client: TestClient, graph_outbox):
+    payload = {
+        "from": "planner@foo.com",
+        "subject": "Consulta inventario: ABC, XYZ, M*, saldo, 1 día",
+        "body": "Productos: PQR",
+    }
+    body = client.post("/process-email", json=payload).json()["body"]
+    lines = body.splitlines()
+    assert lines[0] == "Saldo disponible:"
+    assert [l.split()[0] for l in lines[3:]] == ["ABC", "MNO", "PQR", "XYZ"]
+    assert "120" in lines[3]
+    assert len(graph_outbox) >= 1
+
+def test_proyeccion_varios_productos(client: TestClient):
+    payload = {"from": "planner@foo.com", "subject": "Consulta inventario: *, proyección, 7 días"}
+    body = client.post("/process-email", json=payload).json()["body"]
+    assert body.startswith("Proyección (7 días):")
+    assert len(body.splitlines()) == 3 + 5
+
+def test_process_emails_lote_ndjson(client: TestClient, graph_outbox):
+    items = [
+        {"from": "a@foo.com", "subject": "Consulta inventario: ABC, saldo, 1 día"},
+        {"from": "b@foo.com", "subject": "Hola mundo"},
+        {"subject": "sin remitente"},
+        {"from": "c@foo.com", "subject": "Consulta inventario: XYZ, historial, 3 días"},
+    ]
+    resp = client.post("/process-emails?concurrency=2", json=items)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    results = {r["index"]: r for r in map(json.loads, resp.text.splitlines())}
+    assert results[0]["status"] == "sent" and "120 unidades" in results[0]["body"]
+    assert results[1]["code"] == 400
+    assert results[2]["code"] == 422
+    assert results[3]["status"] == "sent"
+
+def test_process_emails_dry_run_no_envia(client: TestClient, graph_outbox):
+    ndjson = "\n".join([
+        json.dumps({"from": "a@foo.com", "subject": "Consulta inventario: DEF, saldo, 1 día"}),
+        "{no es json",
+    ])
+    resp = client.post("/process-emails?dry_run=true", content=ndjson,
+                       headers={"Content-Type": "application/x-ndjson"})
+    results = sorted(map(json.loads, resp.text.splitlines()), key=lambda r: r["index"])
+    assert results[0]["status"] == "dry_run" and "200 unidades" in results[0]["body"]
+    assert results[1]["code"] == 400
+    assert graph_outbox == []
+
+def test_process_emails_cuerpo_invalido(client: TestClient):
+    assert client.post("/process-emails", json={"from": "a@foo.com"}).status_code == 400
@@ -0,0 +1,61 @@
+# tests/test_metrics.py
+import asyncio
+from fastapi.testclient import TestClient
+
+import metrics
+from metrics import Counter, Gauge, Histogram, timed
+
+def test_histograma_en_formato_prometheus():
+    h = Histogram("t_seconds", "prueba", buckets=(0.1, 1))
+    h.observe(0.05, stage="a")
+    h.observe(0.5, stage="a")
+    h.observe(5, stage="a")
+    text = "\n".join(h.render())
+    assert "# TYPE t_seconds histogram" in text
+    assert 't_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 't_seconds_count{stage="a"} 3' in text
+    assert 't_seconds_sum{stage="a"} 5.55' in text
+
+def test_contador_y_gauge_con_colector():
+    c = Counter("t_total", "prueba")
+    c.inc(status="ok")
+    c.inc(2, status="ok")
+    assert 't_total{status="ok"} 3' in c.render()
+    g = Gauge("t_depth", "prueba", collect=lambda: {"compile": 2, "send": 0}, label="stage")
+    assert g.render()[-2:] == ['t_depth{stage="compile"} 2', 't_depth{stage="send"} 0']
+
+def test_timed_decora_funciones_sync_y_async():
+    h = Histogram("t_timed", "prueba")
+
+    @timed(h, kind="sync")
+    def f():
+        return 1
+
+    @timed(h, kind="async")
+    async def g():
+        return 2
+
+    assert f() == 1 and asyncio.run(g()) == 2
+    assert h.count(kind="sync") == 1 and h.count(kind="async") == 1
+
+def test_endpoint_metrics(client: TestClient):
+    client.post("/process-email", json={
+        "from": "ana@foo.com", "subject": "Consulta inventario: ABC, saldo, 1 día", "body": "",
+    })
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = resp.text
+    for name in (
+        'inventario_stage_seconds_count{stage="compile"}',
+        'inventario_nl_to_sql_seconds_count{source="template"}',
+        'inventario_sql_seconds_count{query="saldo"}',
+        'inventario_send_seconds_count{mode="batch"}',
+        'inventario_jobs_total{status="sent"}',
+        'inventario_queue_depth{stage="compile"} 0',
+        "inventario_reply_queue_depth",
+        "inventario_result_cache_hit_rate",
+    ):
+        assert name in text, name
@@ -0,0 +1,64 @@
+# tests/test_migrations.py
+import sqlite3
+
+from sqlalchemy import create_engine
+
+from migrations import migrate, current_version, LATEST_VERSION
+from models import engine, apply_storage_profile
+
+def _indexes(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA index_list({table})")}
+
+def test_perfil_sqlite_aplicado():
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar_one() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar_one() == 1      # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar_one() == 5000
+    assert current_version(engine) == LATEST_VERSION
+
+def test_migra_base_existente_en_sitio(tmp_path):
+    path = tmp_path / "legacy.db"
+    legacy = sqlite3.connect(path)
+    legacy.executescript("""
+        CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE NOT NULL, quantity INTEGER NOT NULL);
+        CREATE TABLE movements (id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, change INTEGER NOT NULL, date DATETIME);
+    """)
+    legacy.close()
+
+    eng = apply_storage_profile(create_engine(f"sqlite:///{path}"))
+    assert current_version(eng) == 0
+    assert migrate(eng) == LATEST_VERSION
+    assert migrate(eng) == LATEST_VERSION          # segunda vez: nada que hacer
+
+    conn = sqlite3.connect(path)
+    assert "ix_movements_product_date" in _indexes(conn, "movements")
+    plan = " ".join(r[3] for r in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT SUM(change) FROM movements WHERE product_id = 1 AND date >= '2025-01-01'"
+    ))
+    assert "COVERING INDEX ix_movements_product_date" in plan
+
+def test_migracion_crea_y_rellena_agregado_diario(tmp_path):
+    path = tmp_path / "legacy.db"
+    legacy = sqlite3.connect(path)
+    legacy.executescript("""
+        CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE NOT NULL, quantity INTEGER NOT NULL);
+        CREATE TABLE movements (id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, change INTEGER NOT NULL, date DATETIME);
+        INSERT INTO products VALUES (1, 'ABC', 10);
+        INSERT INTO movements (product_id, change, date) VALUES
+            (1, 5, '2025-01-01 08:00:00.000000'), (1, -2, '2025-01-01 17:30:00.000000'),
+            (1, 3, '2025-01-02 09:00:00.000000');
+    """)
+    legacy.commit()
+    legacy.close()
+
+    migrate(apply_storage_profile(create_engine(f"sqlite:///{path}")))
+    conn = sqlite3.connect(path)
+    daily = lambda: conn.execute(
+        "SELECT day, net_change, n_movements FROM movement_daily ORDER BY day").fetchall()
+    assert daily() == [("2025-01-01", 3, 2), ("2025-01-02", 3, 1)]
+
+    # los triggers mantienen el agregado con cada escritura
+    conn.execute("INSERT INTO movements (product_id, change, date) VALUES (1, -4, '2025-01-02 10:00:00')")
+    conn.execute("UPDATE movements SET date = '2025-01-03 00:00:00' WHERE change = 3")
+    conn.execute("DELETE FROM movements WHERE change = 5")
+    assert daily() == [("2025-01-01", -2, 1), ("2025-01-02", -4, 1), ("2025-01-03", 3, 1)]
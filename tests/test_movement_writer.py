@@ -0,0 +1,117 @@
+# tests/test_movement_writer.py
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import forecast
+from db import execute_sql
+from movement_writer import MovementWriter
+from result_cache import cache, ResultCache
+
+def test_escrituras_simultaneas_en_pocas_transacciones(stock_of, movement_count):
+    before_abc, before_xyz, before_n = stock_of("ABC"), stock_of("XYZ"), movement_count("ABC")
+
+    async def run():
+        writer = MovementWriter(max_rows=1000, max_delay=0.05)
+        results = await asyncio.gather(*[
+            writer.write([("ABC", 1, None), ("XYZ", -1, None)]) for _ in range(200)])
+        await writer.aclose()
+        return results
+
+    results = asyncio.run(run())
+    assert stock_of("ABC") == before_abc + 200
+    assert stock_of("XYZ") == before_xyz - 200
+    assert movement_count("ABC") == before_n + 200
+    # 400 movimientos agrupados en transacciones de hasta 1000
+    assert all(r.movements == 2 for r in results)
+    assert max(r.group for r in results) > 2
+    assert {r.stock["ABC"] for r in results} <= set(range(before_abc + 1, before_abc + 201))
+    assert max(r.stock["ABC"] for r in results) == before_abc + 200
+
+def test_grupo_respeta_el_maximo_de_filas():
+    async def run():
+        writer = MovementWriter(max_rows=3, max_delay=0.05)
+        results = await asyncio.gather(*[writer.write([("ABC", 0, None)] * 2) for _ in range(4)])
+        await writer.aclose()
+        return results
+    # una petición no se reparte: 2 + 2 > 3, cada grupo lleva una sola
+    assert [r.group for r in asyncio.run(run())] == [2, 2, 2, 2]
+
+def test_producto_desconocido_no_escribe_nada(movement_count):
+    before = movement_count("ABC")
+
+    async def run():
+        writer = MovementWriter()
+        try:
+            with pytest.raises(ValueError, match="NOEXISTE"):
+                await writer.write([("ABC", 1, None), ("NOEXISTE", 1, None)])
+        finally:
+            await writer.aclose()
+
+    asyncio.run(run())
+    assert movement_count("ABC") == before
+
+def test_fecha_con_zona_se_guarda_en_utc_y_agrega_el_dia():
+    async def run():
+        writer = MovementWriter()
+        date = datetime(2023, 3, 1, 23, 30, tzinfo=timezone.utc).astimezone()
+        await writer.write([("XYZ", 4, date)])
+        await writer.aclose()
+
+    asyncio.run(run())
+    day = execute_sql(
+        "SELECT net_change FROM movement_daily d JOIN products p ON p.id = d.product_id "
+        "WHERE p.name = 'XYZ' AND d.day = '2023-03-01'")
+    assert day == [{"net_change": 4}]
+
+def test_endpoint_movimientos(client: TestClient, stock_of):
+    before = stock_of("ABC")
+    cache.put(ResultCache.key("ABC", "saldo", 1), "viejo")
+    with client:
+        resp = client.post("/movements", json={"movements": [
+            {"product": "ABC", "change": -3},
+            {"product": "ABC", "change": 1, "date": "2024-05-01T10:00:00Z"},
+        ]})
+        assert resp.status_code == 200
+        assert resp.json()["stock"] == {"ABC": before - 2}
+        assert client.post("/movements", json={"movements": [
+            {"product": "NOEXISTE", "change": 1}]}).status_code == 400
+        assert client.post("/movements", json={"movements": []}).status_code == 422
+    assert stock_of("ABC") == before - 2
+    assert cache.get(ResultCache.key("ABC", "saldo", 1)) is None
+
+def test_escritura_recalcula_la_prevision_de_lo_tocado():
+    forecast.refresh_forecasts()
+    query = ("SELECT f.current_stock FROM stock_forecasts f JOIN products p ON p.id = f.product_id "
+             "WHERE p.name = :n AND f.window_days = :w")
+    before = execute_sql(query, {"n": "ABC", "w": forecast.FORECAST_WINDOWS[0]})[0]["current_stock"]
+
+    async def run():
+        writer = MovementWriter(max_delay=0.01)
+        await writer.write([("ABC", -3, None)])
+        await writer.aclose()
+
+    asyncio.run(run())
+    assert execute_sql(query, {"n": "ABC", "w": forecast.FORECAST_WINDOWS[0]})[0]["current_stock"] == before - 3
+
+def test_prevision_fuera_del_camino_del_commit(monkeypatch):
+    release, refreshed = threading.Event(), []
+    def slow_refresh(engine, product_ids):
+        release.wait(5)
+        refreshed.append(product_ids)
+    monkeypatch.setattr(forecast, "refresh_forecasts", slow_refresh)
+
+    async def run():
+        writer = MovementWriter(max_delay=0.01, forecast_delay=0)
+        await writer.write([("ABC", 1, None)])
+        await asyncio.sleep(0.05)                   # la previsión de ABC queda bloqueada
+        # el grupo siguiente se confirma sin esperar a la previsión
+        await asyncio.wait_for(writer.write([("XYZ", 1, None)]), 1)
+        release.set()
+        await writer.aclose()
+
+    asyncio.run(run())
+    assert [len(ids) for ids in refreshed] == [1, 1] and refreshed[0] != refreshed[1]
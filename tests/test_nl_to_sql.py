@@ -1,6 +1,12 @@
 # tests/test_nl_to_sql.py
+import json
+import asyncio
+from collections import OrderedDict
 import pytest
-from nl_to_sql import nl_to_sql_from_subject
+import db
+import nl_to_sql
+from bench.fake_llm import FakeLLM
+from nl_to_sql import anl_to_sql_from_subject, nl_to_sql_from_subject, parse_request, register_template
 
 @pytest.mark.parametrize("subject,product", [
     ("Consulta inventario: ABC, saldo, 7 días", "ABC"),
@@ -8,13 +14,15 @@ from nl_to_sql import nl_to_sql_from_subject
     ("Consulta inventario: DEF, proyección, 5 días", "DEF"),
 ])
 def test_nl_to_sql_basic_minimal(subject, product):
-    sql = nl_to_sql_from_subject(subject).strip()
+    query = nl_to_sql_from_subject(subject)
+    sql = query.sql.strip()
     # 1) termina en ';'
     assert sql.endswith(";"), f"No termina en ';': {sql}"
     # 2) empieza con SELECT o WITH
     assert sql.upper().startswith(("SELECT", "WITH")), f"No empieza con SELECT/ WITH: {sql}"
-    # 3) menciona el producto
-    assert product in sql, f"No contiene '{product}': {sql}"
+    # 3) el producto va como parámetro, no interpolado
+    assert query.params["producto"] == product
+    assert product not in sql, f"Producto interpolado en el SQL: {sql}"
 
 def test_nl_to_sql_invalid_prefix():
     with pytest.raises(ValueError):
@@ -23,3 +31,76 @@ def test_nl_to_sql_invalid_prefix():
 def test_nl_to_sql_missing_parts():
     with pytest.raises(ValueError):
         nl_to_sql_from_subject("Consulta inventario: ABC, saldo")
+
+class _FakeChain:
+    def __init__(self, sql):
+        self.sql, self.calls = sql, 0
+    def invoke(self, inputs):
+        self.calls += 1
+        return self.sql
+
+def test_proyeccion_no_llama_al_llm(monkeypatch):
+    fake = _FakeChain("SELECT 1;")
+    monkeypatch.setattr(nl_to_sql, "_CHAIN", fake)
+    query = nl_to_sql_from_subject("Consulta inventario: DEF, proyeccion, 14 días")
+    assert query.tipo == "proyección"
+    assert query.params == {"producto": "DEF", "dias": 14}
+    assert fake.calls == 0
+
+def test_llm_fallback_cacheado_por_tipo_y_dias(monkeypatch):
+    fake = _FakeChain("SELECT quantity FROM products WHERE name = :producto")
+    monkeypatch.setattr(nl_to_sql, "_CHAIN", fake)
+    monkeypatch.setattr(nl_to_sql, "_LLM_CACHE", OrderedDict())
+    q1 = nl_to_sql_from_subject("Consulta inventario: ABC, rotación, 30 días")
+    q2 = nl_to_sql_from_subject("Consulta inventario: XYZ, rotación, 30 días")
+    assert fake.calls == 1
+    assert q1.sql == q2.sql and q1.sql.endswith(";")
+    assert q2.params["producto"] == "XYZ"
+
+def test_llm_cache_acotada_y_tipo_normalizado(monkeypatch, fake_llm):
+    monkeypatch.setattr(nl_to_sql, "LLM_CACHE_SIZE", 2)
+    q1 = nl_to_sql_from_subject("Consulta inventario: ABC, Rotación  media, 30 días")
+    assert nl_to_sql_from_subject("Consulta inventario: ABC, rotación media, 30 días").name == q1.name
+    assert len(fake_llm.calls) == 1
+    for tipo in ("cobertura", "ventas"):
+        nl_to_sql_from_subject(f"Consulta inventario: ABC, {tipo}, 30 días")
+    # la más antigua sale de la cache y de las consultas registradas
+    assert list(nl_to_sql._LLM_CACHE) == [("cobertura", 30), ("ventas", 30)]
+    assert q1.name not in db._QUERIES and q1.name not in db._BUDGETS
+
+def test_llm_una_sola_llamada_para_peticiones_simultaneas(monkeypatch):
+    llm = FakeLLM(latency=0.05)
+    monkeypatch.setattr(nl_to_sql, "_CHAIN", llm)
+
+    async def run():
+        return await asyncio.gather(*[
+            anl_to_sql_from_subject(f"Consulta inventario: P{i}, rotación, 30 días") for i in range(10)])
+
+    queries = asyncio.run(run())
+    assert len(llm.calls) == 1
+    assert {q.sql for q in queries} == {queries[0].sql}
+    assert nl_to_sql._llm_inflight == {}
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM products WHERE name = :producto;",
+    "SELECT 1; SELECT 2;",
+    "SELECT * FROM products WHERE name = :otro;",
+])
+def test_register_template_rechaza_invalidas(sql):
+    with pytest.raises(ValueError):
+        register_template("mala", sql)
+
+def test_varios_productos_y_comodines():
+    req = parse_request(
+        "Consulta inventario: ABC, XYZ, D*, saldo, 1 día",
+        "Hola,\nProductos: MNO; ABC\ngracias",
+    )
+    assert req.products == ("ABC", "XYZ", "D*", "MNO")
+    query = nl_to_sql_from_subject("Consulta inventario: ABC, XYZ, D*, saldo, 1 día")
+    assert query.name == "saldo:multi"
+    assert json.loads(query.params["productos"]) == ["ABC", "XYZ"]
+    assert json.loads(query.params["patrones"]) == ["D%"]
+
+def test_varios_productos_tipo_no_soportado():
+    with pytest.raises(ValueError):
+        nl_to_sql_from_subject("Consulta inventario: ABC, XYZ, rotación, 7 días")
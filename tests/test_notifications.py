@@ -0,0 +1,129 @@
+# tests/test_notifications.py
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import email_io
+import graph_notify
+from bench.fake_graph import FakeGraph
+
+@pytest.fixture
+def graph():
+    graph = FakeGraph()
+    email_io.set_client(graph.client())
+    return graph
+
+def _wait(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+def test_validacion_de_suscripcion_devuelve_el_token(client: TestClient):
+    resp = client.post("/graph/notifications?validationToken=abc%20123")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert resp.text == "abc 123"
+
+def test_client_state_incorrecto_se_descarta():
+    payload = {"value": [
+        {"clientState": "otro", "changeType": "created", "resourceData": {"id": "m1"}},
+        {"clientState": "secreto", "changeType": "created", "resourceData": {"id": "m2"}},
+        {"clientState": "secreto", "lifecycleEvent": "missed"},
+    ]}
+    batch = graph_notify.parse_notifications(payload, "secreto")
+    assert batch.message_ids == ["m2"]
+    assert batch.resync and not batch.renew
+
+def test_suscripcion_se_crea_renueva_y_recrea(graph):
+    subs = graph_notify.SubscriptionManager("https://example.com/graph/notifications",
+                                            "secreto", minutes=60, renew_margin=600)
+
+    async def run():
+        assert await subs.create()
+        first = subs.subscription_id
+        assert graph.subscriptions[first]["resource"] == "me/mailFolders('Inbox')/messages"
+        assert 2900 < subs.seconds_until_renewal() <= 3000
+
+        subs.minutes = 120
+        assert await subs.renew() and subs.subscription_id == first
+        assert subs.expires_at > datetime.now(timezone.utc) + timedelta(minutes=110)
+
+        graph.subscriptions.clear()                 # Graph la ha eliminado
+        assert await subs.renew() and subs.subscription_id != first
+        await subs.delete()
+        assert graph.subscriptions == {}
+
+    asyncio.run(run())
+
+def test_modo_notify_sin_client_state_no_arranca(monkeypatch):
+    monkeypatch.setattr(main, "INGEST_MODE", "notify")
+    monkeypatch.setattr(main, "NOTIFY_URL", "https://example.com/graph/notifications")
+    monkeypatch.setattr(main, "NOTIFY_CLIENT_STATE", "")
+    with pytest.raises(RuntimeError, match="NOTIFY_CLIENT_STATE"):
+        with TestClient(main.app):
+            pass
+    assert graph_notify.parse_notifications(
+        {"value": [{"clientState": "", "resourceData": {"id": "m1"}}]}, "").message_ids == []
+
+def test_renovacion_pedida_por_otro_proceso(monkeypatch, graph):
+    subs = graph_notify.SubscriptionManager("https://example.com/graph/notifications", "secreto")
+    monkeypatch.setattr(main, "_subscriptions", subs)
+    monkeypatch.setattr(main, "_is_poller", lambda: False)       # este proceso no es el titular
+    monkeypatch.setattr(main, "NOTIFY_CLIENT_STATE", "secreto")
+    monkeypatch.setattr(graph_notify, "NOTIFY_SIGNAL_CHECK", 0.05)
+    payload = {"value": [{"clientState": "secreto", "lifecycleEvent": "reauthorizationRequired"}]}
+    with TestClient(main.app) as client:
+        assert client.post("/graph/notifications", json=payload).status_code == 202
+    # no crea una suscripción duplicada: solo deja el aviso en la base
+    assert graph.subscriptions == {}
+
+    email_io.set_client(graph.client())              # el apagado cerró el cliente compartido
+    renewals = []
+    renew = subs.renew
+    async def counted_renew():
+        renewals.append(1)
+        return await renew()
+    subs.renew = counted_renew
+
+    async def leader():
+        # el titular: crea la suscripción, ve el aviso y renueva sin esperar al margen
+        task = asyncio.create_task(subs.run(renewal_requested=lambda: main.take_signal(main._RENEW_SIGNAL)))
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if renewals:
+                break
+        task.cancel()
+    asyncio.run(leader())
+    assert renewals and len(graph.subscriptions) == 1
+    assert not main.take_signal(main._RENEW_SIGNAL)
+
+def test_notificacion_responde_sin_esperar_al_polling(monkeypatch, graph):
+    monkeypatch.setattr(main, "INGEST_MODE", "notify")
+    monkeypatch.setattr(main, "NOTIFY_URL", "https://example.com/graph/notifications")
+    monkeypatch.setattr(main, "NOTIFY_CLIENT_STATE", "secreto")
+    with TestClient(main.app) as client:
+        assert _wait(lambda: graph.subscriptions), "no se creó la suscripción"
+        sub = next(iter(graph.subscriptions.values()))
+        assert sub["notificationUrl"] == "https://example.com/graph/notifications"
+
+        graph.add_message("Consulta inventario: ABC, saldo, 1 día", sender="ana@foo.com")
+        msg_id = graph.inbox[-1]["id"] = f"notificado-{time.time_ns()}"
+        bad = client.post("/graph/notifications", json=graph.notification(msg_id, client_state="x"))
+        assert bad.status_code == 202
+        time.sleep(0.1)
+        assert graph.sent == []
+
+        resp = client.post("/graph/notifications", json=graph.notification(msg_id))
+        assert resp.status_code == 202
+        assert _wait(lambda: graph.sent), "la notificación no generó respuesta"
+        # repetir la notificación no vuelve a responder
+        client.post("/graph/notifications", json=graph.notification(msg_id))
+        time.sleep(0.1)
+    assert len(graph.sent) == 1
+    assert graph.subscriptions == {}                # se borra al parar
+    main._ready.update(db=False, graph=False)
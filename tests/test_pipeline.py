@@ -0,0 +1,48 @@
+# tests/test_pipeline.py
+import asyncio
+import time
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+def test_etapas_en_orden_y_concurrentes():
+    async def run():
+        async def slow(job):
+            await asyncio.sleep(0.05)
+            job.append("slow")
+        async def fast(job):
+            job.append("fast")
+        p = Pipeline([Stage("slow", slow, workers=10), Stage("fast", fast)], queue_size=10)
+        start = time.perf_counter()
+        futures = [await p.submit([]) for _ in range(10)]
+        jobs = await asyncio.gather(*futures)
+        elapsed = time.perf_counter() - start
+        await p.stop()
+        return jobs, elapsed
+    jobs, elapsed = asyncio.run(run())
+    assert all(job == ["slow", "fast"] for job in jobs)
+    assert elapsed < 0.3          # 10 × 50 ms en serie serían 0.5 s
+
+def test_backpressure_y_errores():
+    async def run():
+        gate = asyncio.Event()
+        async def blocked(job):
+            await gate.wait()
+            if job == "malo":
+                raise ValueError("malo")
+        p = Pipeline([Stage("blocked", blocked, workers=1)], queue_size=1)
+        first = await p.submit("ok")          # lo toma el worker
+        await asyncio.sleep(0)
+        second = await p.submit("malo")       # ocupa la cola
+        third = asyncio.create_task(p.submit("ok"))
+        await asyncio.sleep(0.01)
+        assert not third.done()               # cola llena: submit espera
+        assert p.depths() == {"blocked": 1}
+        gate.set()
+        assert await first == "ok"
+        with pytest.raises(ValueError):
+            await second
+        assert await (await third) == "ok"
+        await p.stop()
+    asyncio.run(run())
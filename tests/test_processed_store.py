@@ -0,0 +1,33 @@
+# tests/test_processed_store.py
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+from processed_store import ProcessedStore
+
+@pytest.fixture
+def store(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'processed.db'}")
+    return ProcessedStore(engine, ttl_days=7, max_rows=3)
+
+def test_mark_processed_es_idempotente(store):
+    assert not store.is_processed("AAMk-1")
+    assert store.mark_processed("AAMk-1") is True
+    assert store.mark_processed("AAMk-1") is False
+    assert store.is_processed("AAMk-1")
+
+def test_persistente_entre_instancias(store):
+    store.mark_processed("AAMk-2")
+    assert ProcessedStore(store.engine).is_processed("AAMk-2")
+
+def test_compact_por_ttl_y_tamano(store):
+    now = datetime(2025, 6, 1)
+    store.mark_processed("viejo", when=now - timedelta(days=30))
+    for i in range(5):
+        store.mark_processed(f"m{i}", when=now - timedelta(minutes=10 - i))
+    assert store.compact(now=now) == 3
+    assert len(store) == 3
+    assert not store.is_processed("viejo")
+    assert not store.is_processed("m0") and not store.is_processed("m1")
+    assert store.is_processed("m4")
@@ -0,0 +1,80 @@
+# tests/test_result_cache.py
+from models import SessionLocal, Product, Movement
+from result_cache import ResultCache, cache
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def test_lru_ttl_y_contadores():
+    clock = _Clock()
+    c = ResultCache(max_entries=2, ttl=10, clock=clock)
+    a, b, d = c.key(" ABC ", "saldo", 1), c.key("XYZ", "saldo", 1), c.key("DEF", "saldo", 1)
+    assert a == ("ABC", "saldo", 1) != c.key("abc", "saldo", 1)
+    assert c.get(a) is None
+    c.put(a, "A"); c.put(b, "B")
+    assert c.get(a) == "A"           # a pasa a ser el más reciente
+    c.put(d, "D")                    # expulsa b (LRU)
+    assert c.get(b) is None and c.get(d) == "D"
+    clock.now = 11
+    assert c.get(a) is None          # caducado por TTL
+    assert c.stats()["hits"] == 2 and c.stats()["misses"] == 3 and c.stats()["evictions"] == 1
+
+def test_invalidacion_precisa_por_producto():
+    c = ResultCache()
+    c.put(c.key("ABC", "saldo", 1), "A1")
+    c.put(c.key("ABC", "historial", 7), "A7")
+    c.put(c.key("XYZ", "saldo", 1), "X1")
+    assert c.invalidate_product("abc") == 0       # otro producto
+    assert c.invalidate_product("ABC") == 2
+    assert c.get(c.key("XYZ", "saldo", 1)) == "X1"
+    assert len(c) == 1
+
+def test_lectura_anterior_a_una_escritura_no_se_guarda():
+    c = ResultCache()
+    abc, multi = c.key("ABC", "saldo", 1), c.key(("AB*",), "saldo", 1)
+    before_abc, before_multi = c.generation(("ABC",)), c.generation(("AB*",))
+    c.invalidate_product("ABC")                 # la escritura confirma durante la lectura
+    c.put(abc, "viejo", generation=before_abc)
+    c.put(multi, "viejo", products=("AB*",), generation=before_multi)
+    assert c.get(abc) is None and c.get(multi) is None
+    # otro producto no afecta y una lectura posterior sí se guarda
+    xyz = c.key("XYZ", "saldo", 1)
+    c.put(xyz, "X1", generation=c.generation(("XYZ",)))
+    c.put(abc, "nuevo", generation=c.generation(("ABC",)))
+    assert c.get(xyz) == "X1" and c.get(abc) == "nuevo"
+
+def test_escritura_orm_invalida_al_confirmar():
+    cache.clear()
+    cache.put(cache.key("ABC", "saldo", 1), "viejo")
+    cache.put(cache.key("XYZ", "saldo", 1), "intacto")
+    session = SessionLocal()
+    try:
+        abc = session.query(Product).filter_by(name="ABC").one()
+        session.add(Movement(product_id=abc.id, change=0))
+        session.flush()
+        assert cache.get(cache.key("ABC", "saldo", 1)) == "viejo"    # aún sin commit
+        session.rollback()
+        assert cache.get(cache.key("ABC", "saldo", 1)) == "viejo"
+
+        session.add(Movement(product_id=abc.id, change=0))
+        session.commit()
+        assert cache.get(cache.key("ABC", "saldo", 1)) is None
+        assert cache.get(cache.key("XYZ", "saldo", 1)) == "intacto"
+    finally:
+        session.close()
+        cache.clear()
+
+def test_entradas_multiproducto_y_comodin():
+    c = ResultCache()
+    multi = c.key(("XYZ", "ABC"), "saldo", 1)
+    assert multi == ("ABC,XYZ", "saldo", 1) == c.key((" ABC", "XYZ"), "saldo", 1)
+    assert c.key(("ab*",), "saldo", 1) == c.key(("AB*",), "saldo", 1)   # LIKE
+    c.put(multi, "AX", products=("ABC", "XYZ"))
+    c.put(c.key(("AB*",), "saldo", 1), "AB*", products=("AB*",))
+    c.put(c.key("DEF", "saldo", 1), "D")
+    assert c.invalidate_product("XYZ") == 2          # la multiproducto y la de comodín
+    assert c.get(c.key("DEF", "saldo", 1)) == "D"
+    assert len(c) == 1
@@ -0,0 +1,94 @@
+# tests/test_sql_guard.py
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import nl_to_sql
+from db import explain, register_query, run_query
+from nl_to_sql import nl_to_sql_from_subject
+from sql_guard import Budget, QueryBudgetExceeded, UnsafeQuery, check_plan, check_statement, guarded
+
+_PARAMS = {"producto", "dias"}
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM movements WHERE product_id = :producto;",
+    "SELECT 1; DROP TABLE products;",
+    "SELECT * FROM products WHERE name = :otro;",
+    "PRAGMA table_info(products);",
+])
+def test_solo_una_sentencia_de_lectura(sql):
+    with pytest.raises(UnsafeQuery):
+        check_statement(sql, "llm:x", _PARAMS)
+
+def test_literales_con_dos_puntos_no_son_parametros():
+    sql = "SELECT COUNT(*) FROM movements WHERE time(date) >= '12:30' AND product_id = :producto;"
+    assert check_statement(sql, "llm:x", _PARAMS) == sql
+    with pytest.raises(UnsafeQuery, match="desconocidos"):
+        check_statement("SELECT 1 FROM products WHERE name = :otro AND '1:2' <> '';", "llm:x", _PARAMS)
+
+@pytest.mark.parametrize("sql", [
+    "SELECT SUM(change) FROM movements;",
+    "SELECT SUM(m.change) FROM products p, movements AS m WHERE p.name = :producto;",
+    "SELECT COUNT(*) FROM movements mv WHERE mv.date >= date('now', '-' || :dias || ' days');",
+    "WITH x AS (SELECT * FROM movements) SELECT COUNT(*) FROM x;",
+])
+def test_plan_rechaza_recorrer_movements(sql):
+    with pytest.raises(UnsafeQuery, match="recorre la tabla entera"):
+        check_plan(sql, explain(sql, {"producto": "ABC", "dias": 7}), "llm:x")
+
+def test_plan_acepta_busquedas_por_indice():
+    sql = (
+        "SELECT p.quantity, COALESCE(SUM(m.change), 0) FROM products p "
+        "LEFT JOIN movements m ON m.product_id = p.id AND m.date >= date('now', '-7 days') "
+        "WHERE p.name = :producto GROUP BY p.id;"
+    )
+    check_plan(sql, explain(sql, {"producto": "ABC"}), "llm:x")
+
+def test_llm_con_recorrido_completo_se_rechaza_y_no_se_cachea(monkeypatch):
+    class Chain:
+        calls = 0
+        def invoke(self, inputs):
+            Chain.calls += 1
+            return "SELECT SUM(change) AS total FROM movements WHERE change > :producto"
+    monkeypatch.setattr(nl_to_sql, "_CHAIN", Chain())
+    for _ in range(2):
+        with pytest.raises(UnsafeQuery):
+            nl_to_sql_from_subject("Consulta inventario: ABC, rotación, 30 días")
+    assert Chain.calls == 2
+
+def test_presupuesto_de_tiempo_cancela_la_consulta():
+    register_query("guard:lenta", (
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+        "SELECT MAX(i) FROM n;"), budget=Budget(seconds=0.1, rows=10))
+    start = time.perf_counter()
+    with pytest.raises(QueryBudgetExceeded):
+        run_query("guard:lenta")
+    assert time.perf_counter() - start < 2
+    # la conexión vuelve al pool sin el progress handler
+    assert run_query("saldo", {"producto": "ABC"})[0].quantity is not None
+
+def test_presupuesto_de_filas():
+    register_query("guard:filas", (
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 50) "
+        "SELECT i FROM n;"), budget=Budget(seconds=1, rows=10))
+    with pytest.raises(QueryBudgetExceeded, match="más de 10 filas"):
+        run_query("guard:filas")
+
+def test_autorizador_solo_lectura():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    with pytest.raises(UnsafeQuery):
+        with guarded(conn, Budget(), "llm:x"):
+            conn.execute("INSERT INTO t VALUES (1)")
+    with guarded(conn, Budget(), "llm:x"):
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+    conn.execute("INSERT INTO t VALUES (1)")        # fuera del bloque, sin restricciones
+
+def test_endpoint_rechaza_sql_peligroso(client: TestClient, fake_llm):
+    fake_llm.sql = "SELECT SUM(change) AS net_movement FROM movements WHERE :producto IS NOT NULL;"
+    payload = {"from": "ana@foo.com", "subject": "Consulta inventario: ABC, rotura, 9 días"}
+    resp = client.post("/process-email", json=payload)
+    assert resp.status_code == 400
+    assert "recorre la tabla entera" in resp.json()["detail"]
@@ -0,0 +1,46 @@
+# tests/test_startup.py
+import os
+import sys
+import json
+import time
+import subprocess
+from fastapi.testclient import TestClient
+
+import main
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+IMPORT_BUDGET = float(os.getenv("IMPORT_BUDGET_SECONDS", 1.5))
+
+_PROBE = """
+import sys, time, json
+t = time.perf_counter()
+import main
+elapsed = time.perf_counter() - t
+import auth, db, nl_to_sql, extract_query
+print(json.dumps({
+    "elapsed": elapsed,
+    "heavy": [m for m in ("langchain", "langchain_openai", "openai") if m in sys.modules],
+    "msal_app": auth.app is not None,
+    "db_init": db._initialized,
+    "chains": [nl_to_sql._CHAIN is not None, extract_query._extract_chain is not None],
+}))
+"""
+
+def test_importar_main_es_rapido_y_sin_efectos():
+    out = subprocess.run([sys.executable, "-c", _PROBE], cwd=ROOT, capture_output=True,
+                         text=True, check=True, env=os.environ.copy())
+    probe = json.loads(out.stdout.strip().splitlines()[-1])
+    assert probe["heavy"] == []
+    assert probe["msal_app"] is False
+    assert probe["db_init"] is False
+    assert probe["chains"] == [False, False]
+    assert probe["elapsed"] < IMPORT_BUDGET, f"import main tardó {probe['elapsed']:.2f} s"
+
+def test_ready_tras_preparar_db_y_graph():
+    assert TestClient(main.app).get("/ready").status_code == 503
+    with TestClient(main.app) as client:
+        deadline = time.monotonic() + 5
+        while (resp := client.get("/ready")).status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert resp.json() == {"ready": True, "db": True, "graph": True}
+    main._ready.update(db=False, graph=False)
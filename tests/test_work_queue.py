@@ -0,0 +1,105 @@
+# tests/test_work_queue.py
+import sys
+import json
+import threading
+import subprocess
+
+import pytest
+from sqlalchemy import create_engine
+
+from work_queue import Lease, WorkQueue
+
+class _Clock:
+    def __init__(self, t=1000.0):
+        self.t = t
+    def __call__(self):
+        return self.t
+
+@pytest.fixture
+def engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'work.db'}")
+
+def _emails(n):
+    return [{"id": f"m{i}", "from": "ana@foo.com", "subject": "Consulta inventario: ABC"}
+            for i in range(n)]
+
+def test_lease_exclusivo_y_caduca(engine):
+    clock = _Clock()
+    a = Lease("poller", holder="a", ttl=30, engine=engine, clock=clock)
+    b = Lease("poller", holder="b", ttl=30, engine=engine, clock=clock)
+    assert a.acquire() and a.held
+    assert not b.acquire() and not b.held
+    clock.t += 20                   # a deja de actuar antes de que caduque
+    assert not a.held
+    assert not b.acquire()
+    clock.t += 11                   # caducado: b lo toma
+    assert b.acquire() and not a.acquire()
+    b.release()
+    assert a.acquire()
+
+def test_encolar_es_idempotente(engine):
+    q = WorkQueue(engine, worker="w1")
+    assert q.enqueue(_emails(3)) == 3
+    assert q.enqueue(_emails(4)) == 1
+    assert q.known("m3") and not q.known("m9")
+    assert q.depths() == {"pending": 4, "claimed": 0, "done": 0}
+
+def test_reclamos_concurrentes_sin_duplicados(engine):
+    WorkQueue(engine).enqueue(_emails(200))
+    claimed: dict[str, list[str]] = {}
+    def worker(name):
+        q = WorkQueue(engine, worker=name)
+        mine = claimed.setdefault(name, [])
+        while batch := q.claim(7):
+            mine.extend(c.message_id for c in batch)
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ids = [m for ms in claimed.values() for m in ms]
+    assert len(ids) == len(set(ids)) == 200
+
+def test_reclamos_desde_varios_procesos(engine, tmp_path):
+    WorkQueue(engine).enqueue(_emails(120))
+    script = (
+        "import sys, json\n"
+        "from sqlalchemy import create_engine\n"
+        "from work_queue import WorkQueue\n"
+        f"q = WorkQueue(create_engine('sqlite:///{tmp_path / 'work.db'}', "
+        "connect_args={'timeout': 30}), worker=sys.argv[1])\n"
+        "ids = []\n"
+        "while batch := q.claim(5):\n"
+        "    ids += [c.message_id for c in batch]\n"
+        "print(json.dumps(ids))\n"
+    )
+    procs = [subprocess.Popen([sys.executable, "-c", script, f"p{i}"], stdout=subprocess.PIPE, text=True)
+             for i in range(3)]
+    ids = [m for p in procs for m in json.loads(p.communicate(timeout=60)[0])]
+    assert len(ids) == len(set(ids)) == 120
+
+def test_sin_ack_vuelve_a_la_cola_hasta_el_maximo(engine):
+    clock = _Clock()
+    w1 = WorkQueue(engine, worker="w1", visibility=60, max_attempts=2, clock=clock)
+    w2 = WorkQueue(engine, worker="w2", visibility=60, max_attempts=2, clock=clock)
+    w1.enqueue(_emails(1))
+    assert [c.attempts for c in w1.claim(10)] == [1]
+    assert w2.claim(10) == []
+    clock.t += 61                   # w1 "cayó": otro lo reclama
+    assert [c.attempts for c in w2.claim(10)] == [2]
+    assert not w1.ack("m0")         # ya no es de w1
+    clock.t += 61
+    assert w1.claim(10) == []       # agotado
+    assert w2.compact(older_than=0) == 1
+
+def test_ack_y_compactacion(engine):
+    clock = _Clock()
+    q = WorkQueue(engine, worker="w1", clock=clock)
+    q.enqueue(_emails(2))
+    q.claim(1)
+    assert q.ack("m0")
+    assert q.claim(10)[0].message_id == "m1"
+    assert q.compact(older_than=3600) == 0
+    clock.t += 3601
+    assert q.compact(older_than=3600) == 1
+    assert q.known("m1") and not q.known("m0")
@@ -0,0 +1,204 @@
+# work_queue.py
+# Coordinación entre procesos (uvicorn main:app --workers N) a través de
+# inventory.db, sin servicios externos:
+#
+# • Lease: un solo proceso a la vez es el "poller" (lee Graph y encola). El
+#   lease caduca si su titular deja de renovarlo y otro lo toma.
+# • WorkQueue: tabla work_items compartida. El poller (y el webhook de
+#   notificaciones) encolan; todos los procesos reclaman lotes con un único
+#   UPDATE … RETURNING, así cada correo lo procesa un solo proceso.
+
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+from typing import Callable, NamedTuple
+
+from sqlalchemy import Engine
+
+import metrics
+from models import engine as default_engine, WorkerLease, WorkItem
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID               = f"{socket.gethostname()}:{os.getpid()}"
+WORKER_LEASE_TTL        = float(os.getenv("WORKER_LEASE_TTL", 30))
+WORK_VISIBILITY_TIMEOUT = float(os.getenv("WORK_VISIBILITY_TIMEOUT", 300))
+WORK_MAX_ATTEMPTS       = int(os.getenv("WORK_MAX_ATTEMPTS", 3))
+WORK_DONE_TTL           = float(os.getenv("WORK_DONE_TTL", 24 * 3600))
+
+
+# ------------------- lease ---------------------------------------------------------------
+class Lease:
+    """
+    Lease con nombre en la tabla worker_leases. `acquire()` lo toma si está
+    libre o caducado y lo renueva si ya es nuestro, en una sola sentencia.
+    """
+
+    def __init__(self, name: str, holder: str = WORKER_ID, ttl: float = WORKER_LEASE_TTL,
+                 engine: Engine = default_engine, clock: Callable[[], float] = time.time):
+        self.name, self.holder, self.ttl = name, holder, ttl
+        self.engine = engine
+        self._clock = clock
+        self._until = 0.0
+        WorkerLease.__table__.create(engine, checkfirst=True)
+
+    @property
+    def held(self) -> bool:
+        """Si somos titulares (con margen: dejamos de actuar antes de que caduque)."""
+        return self._clock() < self._until
+
+    def acquire(self) -> bool:
+        now = self._clock()
+        with self.engine.begin() as conn:
+            row = conn.exec_driver_sql(
+                "INSERT INTO worker_leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE worker_leases.holder = excluded.holder OR worker_leases.expires_at < ? "
+                "RETURNING holder",
+                (self.name, self.holder, now + self.ttl, now),
+            ).first()
+        # se deja de actuar un tercio del TTL antes de que otro pueda tomarlo
+        self._until = now + self.ttl * 2 / 3 if row else 0.0
+        return row is not None
+
+    def release(self):
+        self._until = 0.0
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM worker_leases WHERE name = ? AND holder = ?",
+                                 (self.name, self.holder))
+
+    async def run(self, on_acquired: Callable[[], None] | None = None):
+        """Intenta tomar o renovar el lease cada ttl/3 s, indefinidamente."""
+        was_held = False
+        while True:
+            try:
+                held = await asyncio.to_thread(self.acquire)
+            except Exception:
+                logger.exception("Error renovando el lease '%s'", self.name)
+                self._until, held = 0.0, False
+            if held and not was_held:
+                logger.info("Lease '%s' adquirido por %s", self.name, self.holder)
+                if on_acquired:
+                    on_acquired()
+            elif was_held and not held:
+                logger.warning("Lease '%s' perdido por %s", self.name, self.holder)
+            was_held = held
+            await asyncio.sleep(self.ttl / 3)
+
+
+# ------------------- avisos entre procesos -------------------------------------------------
+# Un aviso es una fila "signal:<nombre>" en worker_leases: cualquier proceso
+# lo levanta y el titular del lease lo consume (p. ej. renovar la suscripción
+# de Graph cuando el evento de ciclo de vida llega a otro proceso).
+def raise_signal(name: str, engine: Engine = default_engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO worker_leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at",
+            (f"signal:{name}", WORKER_ID, time.time()),
+        )
+
+def take_signal(name: str, engine: Engine = default_engine) -> bool:
+    """True si había aviso pendiente (y lo borra)."""
+    with engine.begin() as conn:
+        return conn.exec_driver_sql("DELETE FROM worker_leases WHERE name = ? RETURNING name",
+                                    (f"signal:{name}",)).first() is not None
+
+
+# ------------------- cola de trabajo -----------------------------------------------------
+class Claimed(NamedTuple):
+    message_id: str
+    payload:    dict
+    attempts:   int
+
+
+class WorkQueue:
+    """
+    Cola persistente compartida. Un elemento reclamado y no confirmado en
+    `visibility` s (proceso caído) vuelve a estar disponible, hasta
+    `max_attempts` veces.
+    """
+
+    def __init__(self, engine: Engine = default_engine, worker: str = WORKER_ID,
+                 visibility: float = WORK_VISIBILITY_TIMEOUT, max_attempts: int = WORK_MAX_ATTEMPTS,
+                 clock: Callable[[], float] = time.time):
+        self.engine = engine
+        self.worker = worker
+        self.visibility = visibility
+        self.max_attempts = max_attempts
+        self._clock = clock
+        WorkItem.__table__.create(engine, checkfirst=True)
+
+    def enqueue(self, items: list[dict]) -> int:
+        """Encola correos ({'id', …}); los ya presentes se ignoran. Devuelve los nuevos."""
+        if not items:
+            return 0
+        now = self._clock()
+        with self.engine.begin() as conn:
+            result = conn.exec_driver_sql(
+                "INSERT INTO work_items (message_id, payload, status, attempts, visible_at) "
+                "VALUES (?, ?, 'pending', 0, ?) ON CONFLICT (message_id) DO NOTHING",
+                [(em["id"], json.dumps(em, ensure_ascii=False), now) for em in items],
+            )
+            return result.rowcount
+
+    def known(self, message_id: str) -> bool:
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql(
+                "SELECT 1 FROM work_items WHERE message_id = ?", (message_id,)).first() is not None
+
+    def claim(self, limit: int) -> list[Claimed]:
+        """Reclama hasta `limit` elementos visibles, los más antiguos primero, en una sentencia."""
+        if limit <= 0:
+            return []
+        now = self._clock()
+        with self.engine.begin() as conn:
+            rows = conn.exec_driver_sql(
+                "UPDATE work_items SET status = 'claimed', claimed_by = ?, "
+                "attempts = attempts + 1, visible_at = ? "
+                "WHERE message_id IN (SELECT message_id FROM work_items "
+                "WHERE status != 'done' AND visible_at <= ? AND attempts < ? "
+                "ORDER BY visible_at LIMIT ?) "
+                "RETURNING message_id, payload, attempts",
+                (self.worker, now + self.visibility, now, self.max_attempts, limit),
+            ).fetchall()
+        return [Claimed(r[0], json.loads(r[1]), r[2]) for r in rows]
+
+    def ack(self, message_id: str) -> bool:
+        """Marca el elemento como hecho. False si ya no era nuestro (caducó y otro lo reclamó)."""
+        with self.engine.begin() as conn:
+            return conn.exec_driver_sql(
+                "UPDATE work_items SET status = 'done', visible_at = ? "
+                "WHERE message_id = ? AND claimed_by = ? AND status = 'claimed'",
+                (self._clock(), message_id, self.worker),
+            ).rowcount == 1
+
+    def compact(self, older_than: float = WORK_DONE_TTL) -> int:
+        """Borra los hechos (y los agotados) de hace más de `older_than` s."""
+        cutoff = self._clock() - older_than
+        with self.engine.begin() as conn:
+            return conn.exec_driver_sql(
+                "DELETE FROM work_items WHERE visible_at < ? AND (status = 'done' OR attempts >= ?)",
+                (cutoff, self.max_attempts),
+            ).rowcount
+
+    def depths(self) -> dict[str, int]:
+        with self.engine.connect() as conn:
+            counts = dict(conn.exec_driver_sql(
+                "SELECT status, COUNT(*) FROM work_items GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ("pending", "claimed", "done")}
+
+
+_queue: WorkQueue | None = None
+
+def get_work_queue() -> WorkQueue:
+    global _queue
+    if _queue is None:
+        _queue = WorkQueue()
+    return _queue
+
+metrics.gauge("inventario_work_items", "Elementos de la cola de trabajo compartida por estado",
+              collect=lambda: _queue.depths() if _queue else {}, label="status")